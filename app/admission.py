@@ -0,0 +1,218 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from .metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT, ADMISSION_SHED
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Per endpoint: requests worked on at once, requests allowed to wait, longest wait for a slot,
+# and the deadline (from arrival, 0 = none) that model calls made for the request must meet.
+# The chat deadline stays under the Streamlit frontend's 90 s timeout.
+ADMISSION_CHAT_CONCURRENCY = int(os.getenv("ADMISSION_CHAT_CONCURRENCY", "16"))
+ADMISSION_CHAT_QUEUE = int(os.getenv("ADMISSION_CHAT_QUEUE", "32"))
+ADMISSION_CHAT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_CHAT_QUEUE_TIMEOUT_SECONDS", "20"))
+ADMISSION_CHAT_DEADLINE_SECONDS = float(os.getenv("ADMISSION_CHAT_DEADLINE_SECONDS", "80"))
+ADMISSION_INGEST_CONCURRENCY = int(os.getenv("ADMISSION_INGEST_CONCURRENCY", "2"))
+ADMISSION_INGEST_QUEUE = int(os.getenv("ADMISSION_INGEST_QUEUE", "4"))
+ADMISSION_INGEST_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_INGEST_QUEUE_TIMEOUT_SECONDS", "30"))
+ADMISSION_INGEST_DEADLINE_SECONDS = float(os.getenv("ADMISSION_INGEST_DEADLINE_SECONDS", "0"))
+
+# Lower is served first; a safety question can displace a queued normal one when the queue is full,
+# and questions of a /chat/batch call queue behind interactive ones
+PRIORITY_SAFETY = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2
+
+# time.monotonic() by which the current request must finish; read by app/openai_client.py
+REQUEST_DEADLINE: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class OverloadedError(RuntimeError):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(TimeoutError):
+    pass
+
+
+def is_deadline_exceeded(error: BaseException) -> bool:
+    """Whether error was caused, however deeply wrapped, by a request deadline running out"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, DeadlineExceededError):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class AdmissionController:
+    """Bounded concurrency with a bounded priority queue in front of it
+
+    Runs on the event loop, so queued requests do not hold threadpool
+    threads. Requests that cannot get a slot are shed with OverloadedError
+    straight away (queue full) or after queue_timeout seconds, instead of
+    piling up until the client gives up.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int,
+                 queue_timeout: float, deadline_seconds: float = 0.0):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.deadline_seconds = deadline_seconds
+        self._running = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []  # heap of (priority, arrival, future)
+        self._arrivals = itertools.count()
+        self._service_seconds = 1.0  # moving average, for Retry-After
+        self._counters = {"admitted": 0, "queue_full": 0, "queue_timeout": 0, "displaced": 0}
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to be free for a new request"""
+        backlog = (len(self._queue) + 1) / self.max_concurrent
+        return max(1, min(60, math.ceil(backlog * self._service_seconds)))
+
+    def _shed(self, reason: str, priority: int) -> OverloadedError:
+        self._counters[reason] += 1
+        ADMISSION_SHED.inc(endpoint=self.name, reason=reason)
+        logger.warning("request shed", extra={"endpoint": self.name, "reason": reason, "priority": priority,
+                                              "queued": len(self._queue), "running": self._running})
+        return OverloadedError(f"Server busy ({self.name} {reason.replace('_', ' ')}), retry later", self.retry_after())
+
+    def _gauges(self):
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue), endpoint=self.name)
+        ADMISSION_IN_FLIGHT.set(self._running, endpoint=self.name)
+
+    @asynccontextmanager
+    async def admit(self, priority: int = PRIORITY_NORMAL):
+        """Hold a slot for the block; sets REQUEST_DEADLINE for model calls made inside it"""
+        deadline = await self.acquire(priority)
+        token = REQUEST_DEADLINE.set(deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            REQUEST_DEADLINE.reset(token)
+            self.release(started)
+
+    @contextmanager
+    def admit_from_thread(self, loop: asyncio.AbstractEventLoop, priority: int = PRIORITY_NORMAL):
+        """admit() for work running on a worker thread: queues on loop, sets REQUEST_DEADLINE in this thread"""
+        deadline = asyncio.run_coroutine_threadsafe(self.acquire(priority), loop).result()
+        token = REQUEST_DEADLINE.set(deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            REQUEST_DEADLINE.reset(token)
+            loop.call_soon_threadsafe(self.release, started)
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL) -> Optional[float]:
+        """Wait for a slot (or raise OverloadedError); returns the request's deadline"""
+        arrival = time.monotonic()
+        if self._running < self.max_concurrent and not self._queue:
+            self._running += 1
+        else:
+            await self._wait(priority, arrival)
+        self._counters["admitted"] += 1
+        self._gauges()
+        ADMISSION_QUEUE_WAIT.observe(time.monotonic() - arrival, endpoint=self.name)
+        return arrival + self.deadline_seconds if self.deadline_seconds > 0 else None
+
+    def release(self, started: float):
+        """Give back a slot acquired at started (time.monotonic()); runs on the event loop"""
+        self._service_seconds = 0.8 * self._service_seconds + 0.2 * (time.monotonic() - started)
+        self._release()
+
+    async def _wait(self, priority: int, arrival: float):
+        if len(self._queue) >= self.max_queue:
+            # Full: a higher-priority arrival pushes out the newest lowest-priority waiter
+            worst = max(self._queue) if self._queue else None
+            if worst is None or worst[0] <= priority:
+                raise self._shed("queue_full", priority)
+            self._queue.remove(worst)
+            heapq.heapify(self._queue)
+            worst[2].set_exception(self._shed("displaced", worst[0]))
+
+        entry = (priority, next(self._arrivals), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, entry)
+        self._gauges()
+        timeout = self.queue_timeout
+        if self.deadline_seconds > 0:
+            timeout = min(timeout, self.deadline_seconds)
+        try:
+            await asyncio.wait_for(asyncio.shield(entry[2]), timeout=max(0.0, timeout - (time.monotonic() - arrival)))
+        except asyncio.TimeoutError:
+            if entry[2].done():
+                if entry[2].exception():
+                    raise entry[2].exception()
+                return  # granted as the timeout fired
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            self._gauges()
+            raise self._shed("queue_timeout", priority)
+        except asyncio.CancelledError:
+            # Client went away while queued; pass on a slot it may just have been given
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._gauges()
+            elif entry[2].done() and not entry[2].cancelled() and not entry[2].exception():
+                self._release()
+            raise
+
+    def _release(self):
+        """Hand the slot to the best waiter, or free it"""
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(True)
+                self._gauges()
+                return
+        self._running -= 1
+        self._gauges()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "running": self._running,
+            "queued": len(self._queue),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "avg_service_seconds": round(self._service_seconds, 3),
+        }
+
+
+CHAT_ADMISSION = AdmissionController(
+    "chat", ADMISSION_CHAT_CONCURRENCY, ADMISSION_CHAT_QUEUE,
+    ADMISSION_CHAT_QUEUE_TIMEOUT_SECONDS, ADMISSION_CHAT_DEADLINE_SECONDS
+)
+INGEST_ADMISSION = AdmissionController(
+    "ingest", ADMISSION_INGEST_CONCURRENCY, ADMISSION_INGEST_QUEUE,
+    ADMISSION_INGEST_QUEUE_TIMEOUT_SECONDS, ADMISSION_INGEST_DEADLINE_SECONDS
+)
+
+
+def get_admission_stats() -> Dict[str, Any]:
+    return {"chat": CHAT_ADMISSION.stats(), "ingest": INGEST_ADMISSION.stats()}
+
+
+def remaining_seconds() -> Optional[float]:
+    """Time left before the current request's deadline, or None without one"""
+    deadline = REQUEST_DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
@@ -0,0 +1,132 @@
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Tuple
+
+from dotenv import load_dotenv
+from .metrics import LLM_TOKENS, STAGE_LATENCY
+from .tokens import count_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMBED_MODEL = "text-embedding-3-small"
+# OpenAI accepts up to 2048 inputs / 300k tokens per embeddings request; LangChain
+# splits anything over its chunk_size (1000 inputs) into several requests itself
+EMBED_MAX_BATCH_INPUTS = int(os.getenv("EMBED_MAX_BATCH_INPUTS", "1000"))
+EMBED_MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "250000"))
+EMBED_MIN_BATCH_TOKENS = int(os.getenv("EMBED_MIN_BATCH_TOKENS", "2000"))
+EMBED_INITIAL_BATCH_TOKENS = int(os.getenv("EMBED_INITIAL_BATCH_TOKENS", "20000"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_FAILURES = int(os.getenv("EMBED_MAX_FAILURES", "6"))  # consecutive, before giving up
+
+GROW_FACTOR = 1.5
+SHRINK_FACTOR = 0.5
+CEILING_RELAX = 1.05  # per successful batch, so the budget probes back up after transient errors
+
+
+class AdaptiveEmbedder:
+    """Embed texts in token-packed batches, several in flight at once
+
+    Batches are packed up to a token budget that grows after each success
+    and halves after a failure (a failed batch is split and retried). Growth
+    stays below the size that last failed, a ceiling that relaxes slowly, so
+    the embedder settles near the largest batch the API handles reliably. Each
+    finished batch is handed to on_batch as it completes, so writes overlap
+    with the embedding calls still in flight.
+    """
+
+    def __init__(self, embeddings, concurrency: int = EMBED_CONCURRENCY,
+                 initial_batch_tokens: int = EMBED_INITIAL_BATCH_TOKENS,
+                 min_batch_tokens: int = EMBED_MIN_BATCH_TOKENS,
+                 max_batch_tokens: int = EMBED_MAX_BATCH_TOKENS,
+                 max_batch_inputs: int = EMBED_MAX_BATCH_INPUTS,
+                 max_failures: int = EMBED_MAX_FAILURES):
+        self.embeddings = embeddings
+        self.concurrency = max(1, concurrency)
+        self.min_batch_tokens = min_batch_tokens
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_inputs = max_batch_inputs
+        self.max_failures = max_failures
+        self.batch_tokens = min(max(initial_batch_tokens, min_batch_tokens), max_batch_tokens)
+        self.ceiling = float(max_batch_tokens)
+
+    def embed(self, texts: List[str],
+              on_batch: Callable[[int, int, List[List[float]]], None]) -> Dict[str, Any]:
+        """Embed texts, calling on_batch(start, end, vectors) per completed batch; returns throughput stats"""
+        token_counts = [count_tokens(text, EMBED_MODEL) for text in texts]
+        stats = {"chunks": len(texts), "tokens": sum(token_counts), "batches": 0, "failures": 0}
+        retry_ranges: List[Tuple[int, int]] = []
+        in_flight = {}  # future → (start, end)
+        position = 0
+        consecutive_failures = 0
+        start_time = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed") as executor:
+            while position < len(texts) or retry_ranges or in_flight:
+                while len(in_flight) < self.concurrency and (retry_ranges or position < len(texts)):
+                    if retry_ranges:
+                        start, end = retry_ranges.pop()
+                    else:
+                        start, end = position, self._pack(token_counts, position)
+                        position = end
+                    # Keep the lane (bulk) and request id on the worker threads
+                    context = contextvars.copy_context()
+                    future = executor.submit(context.run, self._embed_batch, texts[start:end])
+                    in_flight[future] = (start, end)
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, end = in_flight.pop(future)
+                    try:
+                        vectors = future.result()
+                    except Exception as e:
+                        stats["failures"] += 1
+                        consecutive_failures += 1
+                        self.ceiling = max(self.min_batch_tokens, sum(token_counts[start:end]))
+                        self.batch_tokens = max(self.min_batch_tokens, int(self.ceiling * SHRINK_FACTOR))
+                        logger.warning("embedding batch failed, shrinking", extra={
+                            "chunks": end - start, "batch_tokens": self.batch_tokens, "reason": str(e)
+                        })
+                        if consecutive_failures >= self.max_failures:
+                            raise
+                        # Retry as two halves so an oversized batch gets under the limit
+                        middle = (start + end) // 2
+                        retry_ranges.extend([(middle, end), (start, middle)] if end - start > 1 else [(start, end)])
+                        continue
+
+                    consecutive_failures = 0
+                    stats["batches"] += 1
+                    self.ceiling = min(self.max_batch_tokens, self.ceiling * CEILING_RELAX)
+                    self.batch_tokens = int(min(self.ceiling * 0.9, self.batch_tokens * GROW_FACTOR))
+                    self.batch_tokens = max(self.min_batch_tokens, self.batch_tokens)
+                    on_batch(start, end, vectors)
+
+        seconds = time.perf_counter() - start_time
+        LLM_TOKENS.inc(stats["tokens"], model=EMBED_MODEL, kind="embedding")
+        stats.update({
+            "seconds": round(seconds, 3),
+            "chunks_per_sec": round(len(texts) / seconds, 1) if seconds else None,
+            "tokens_per_sec": round(stats["tokens"] / seconds, 1) if seconds else None,
+            "final_batch_tokens": self.batch_tokens,
+            "concurrency": self.concurrency,
+        })
+        return stats
+
+    def _pack(self, token_counts: List[int], start: int) -> int:
+        """End index of the next batch: as many texts as fit the current token budget"""
+        end = start
+        tokens = 0
+        while end < len(token_counts) and end - start < self.max_batch_inputs:
+            if end > start and tokens + token_counts[end] > self.batch_tokens:
+                break
+            tokens += token_counts[end]
+            end += 1
+        return end
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        with STAGE_LATENCY.time(pipeline="ingest", stage="embed_batch"):
+            return self.embeddings.embed_documents(texts)
@@ -0,0 +1,119 @@
+import logging
+import os
+import sqlite3
+import threading
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence
+
+from dotenv import load_dotenv
+
+# numpy is imported where it is used to keep API start-up fast
+if TYPE_CHECKING:
+    import numpy as np
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+FULL_VECTORS_DB = os.getenv("FULL_VECTORS_DB", "data/full_vectors.db")
+
+
+def shorten(vectors: Sequence[Sequence[float]], dimensions: int) -> "np.ndarray":
+    """Leading dimensions of each vector, re-normalized to unit length
+
+    text-embedding-3 models are trained so a prefix of the embedding is
+    itself a usable embedding (Matryoshka representation learning).
+    """
+    import numpy as np
+
+    prefix = np.asarray(vectors, dtype=np.float32)[:, :dimensions]
+    norms = np.linalg.norm(prefix, axis=1, keepdims=True)
+    return prefix / np.where(norms == 0, 1.0, norms)
+
+
+class FullVectorStore:
+    """Full-dimension embeddings of collections whose Chroma index holds shortened ones
+
+    Kept in SQLite rather than memory: only the few candidates of each
+    query are read back, to re-score them at full precision.
+    """
+
+    def __init__(self, db_path: str = FULL_VECTORS_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS full_vectors ("
+            "collection TEXT NOT NULL, chunk_id TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (collection, chunk_id))"
+        )
+        self._db.commit()
+
+    def add(self, collection: str, chunk_ids: List[str], vectors: Sequence[Sequence[float]]) -> int:
+        import numpy as np
+
+        rows = [
+            (collection, chunk_id, np.asarray(vector, dtype=np.float32).tobytes())
+            for chunk_id, vector in zip(chunk_ids, vectors)
+        ]
+        with self._lock:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO full_vectors VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def get(self, collection: str, chunk_ids: Iterable[str]) -> Dict[str, "np.ndarray"]:
+        """chunk id → full vector, for the ids that have one"""
+        import numpy as np
+
+        chunk_ids = list(chunk_ids)
+        vectors = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for offset in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[offset:offset + 500]
+                rows = self._db.execute(
+                    f"SELECT chunk_id, vector FROM full_vectors WHERE collection = ? "
+                    f"AND chunk_id IN ({','.join('?' * len(batch))})",
+                    [collection, *batch]
+                )
+                for chunk_id, blob in rows:
+                    vectors[chunk_id] = np.frombuffer(blob, dtype=np.float32)
+        return vectors
+
+    def remove(self, collection: str, chunk_ids: List[str]):
+        with self._lock:
+            with self._db:
+                for offset in range(0, len(chunk_ids), 500):
+                    batch = chunk_ids[offset:offset + 500]
+                    self._db.execute(
+                        f"DELETE FROM full_vectors WHERE collection = ? AND chunk_id IN ({','.join('?' * len(batch))})",
+                        [collection, *batch]
+                    )
+
+    def clear(self, collection: str):
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM full_vectors WHERE collection = ?", (collection,))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            vectors, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM full_vectors"
+            ).fetchone()
+        return {"vectors": vectors, "bytes": size}
+
+
+_FULL_VECTORS: Optional[FullVectorStore] = None
+_FULL_VECTORS_LOCK = threading.Lock()
+
+
+def get_full_vectors() -> FullVectorStore:
+    """Process-wide full vector store, opened on first use"""
+    global _FULL_VECTORS
+    if _FULL_VECTORS is None:
+        with _FULL_VECTORS_LOCK:
+            if _FULL_VECTORS is None:
+                _FULL_VECTORS = FullVectorStore(FULL_VECTORS_DB)
+    return _FULL_VECTORS
@@ -0,0 +1,269 @@
+import fcntl
+import glob
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from .ingestion import ingest_pdf, UPLOAD_DIR
+from .full_vectors import get_full_vectors
+from .safety_digest import get_safety_digest
+from .term_index import get_term_index
+from .vectorstore import COLLECTION_ALIASES_PATH, drop_collection, get_alias, get_vectorstore, set_alias, set_build_status
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# A new build must hold at least this share of the live index's chunks to be swapped in
+INDEX_MIN_COUNT_RATIO = float(os.getenv("INDEX_MIN_COUNT_RATIO", "0.5"))
+SMOKE_QUERIES = 3  # stored chunks queried by their own vector; each must come back first
+
+# Held by whichever worker builds (or scripts/index_snapshot.py imports) a new version; the OS
+# releases it when that process exits, so a crashed build never blocks the next one
+BUILD_LOCK_PATH = f"{COLLECTION_ALIASES_PATH}.build.lock"
+RUNNING_STATES = ("queued", "building", "validating", "catching_up", "importing")
+
+# This worker's last build; every worker reads the shared copy through get_build_status
+BUILD_STATUS: Dict[str, Any] = {"state": "idle"}
+
+
+class IndexBuildError(RuntimeError):
+    pass
+
+
+def _acquire_build_lock() -> Optional[int]:
+    """Descriptor holding the build lock, or None if another build holds it"""
+    os.makedirs(os.path.dirname(BUILD_LOCK_PATH) or ".", exist_ok=True)
+    fd = os.open(BUILD_LOCK_PATH, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _release_build_lock(fd: int):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def build_running() -> bool:
+    """Whether any worker or import script (this one included) holds the build lock"""
+    fd = _acquire_build_lock()
+    if fd is None:
+        return True
+    _release_build_lock(fd)
+    return False
+
+
+@contextmanager
+def exclusive_build(alias: str):
+    """Hold the build lock for a build or import of alias; IndexBuildError if one is already running"""
+    fd = _acquire_build_lock()
+    if fd is None:
+        raise IndexBuildError(f"a build or import of {alias} is already running")
+    try:
+        yield
+    finally:
+        _release_build_lock(fd)
+
+
+def report_status(alias: str, **fields):
+    """Update BUILD_STATUS and publish it in the alias registry"""
+    BUILD_STATUS.update(fields)
+    set_build_status(alias, dict(BUILD_STATUS))
+
+
+def get_build_status(alias: str = "manufacturing_manuals") -> Dict[str, Any]:
+    """Latest build or import of alias, whichever worker ran it"""
+    status = get_alias(alias).get("build") or {"state": "idle"}
+    if status["state"] in RUNNING_STATES and not build_running():
+        # Its process exited before recording how it ended
+        status.update({"state": "failed", "error": "interrupted: the process running it exited"})
+    return status
+
+
+def next_version_name(alias: str, versions: List[str]) -> str:
+    """alias__vN with N one above the highest existing version"""
+    numbers = [int(m.group(1)) for v in versions for m in [re.fullmatch(rf"{re.escape(alias)}__v(\d+)", v)] if m]
+    return f"{alias}__v{max(numbers, default=0) + 1}"
+
+
+def validate_collection(collection: str, expected_chunks: int, live_count: int):
+    """Counts and a self-retrieval smoke query; raises IndexBuildError if the build looks wrong"""
+    db = get_vectorstore(collection)
+    count = db._collection.count()
+    if count == 0 or count != expected_chunks:
+        raise IndexBuildError(f"{collection} has {count} chunks, expected {expected_chunks}")
+    if live_count and count < live_count * INDEX_MIN_COUNT_RATIO:
+        raise IndexBuildError(f"{collection} has {count} chunks, live index has {live_count}")
+
+    sample = db._collection.get(limit=SMOKE_QUERIES, include=["embeddings"])
+    for chunk_id, embedding in zip(sample["ids"], sample["embeddings"]):
+        result = db._collection.query(query_embeddings=[embedding], n_results=1, include=["distances"])
+        # A duplicate chunk with the same vector may legitimately come back instead
+        if not result["ids"][0] or (result["ids"][0][0] != chunk_id and result["distances"][0][0] > 1e-6):
+            raise IndexBuildError(f"smoke query for {chunk_id} returned {result['ids'][0]}")
+    return count
+
+
+def drop_version(collection: str):
+    """Delete a physical collection and its term index / safety digest / full vector entries"""
+    drop_collection(collection)
+    get_term_index().clear(collection)
+    get_safety_digest().clear(collection)
+    get_full_vectors().clear(collection)
+
+
+def swap(alias: str, new_collection: str) -> Dict[str, Any]:
+    """Point alias at new_collection, keep the old one as previous and drop anything older"""
+    entry = get_alias(alias)
+    versions = [v for v in entry["versions"] if v != new_collection] + [new_collection]
+    previous = entry["active"]
+    set_alias(alias, new_collection, previous, versions)
+    return garbage_collect(alias)
+
+
+def rollback(alias: str = "manufacturing_manuals") -> Dict[str, Any]:
+    """Swap back to the previous collection (which becomes active; the current one becomes previous)"""
+    entry = get_alias(alias)
+    if not entry["previous"]:
+        raise IndexBuildError(f"{alias} has no previous version to roll back to")
+    set_alias(alias, entry["previous"], entry["active"], entry["versions"])
+    logger.info("collection rolled back", extra={"alias": alias, "active": entry["previous"]})
+    return get_alias(alias)
+
+
+def garbage_collect(alias: str = "manufacturing_manuals") -> Dict[str, Any]:
+    """Drop every version other than active and previous"""
+    entry = get_alias(alias)
+    keep = {entry["active"], entry["previous"]}
+    build = get_build_status(alias)
+    if build["state"] in RUNNING_STATES:
+        keep.add(build.get("collection"))
+    for version in entry["versions"]:
+        if version not in keep:
+            drop_version(version)
+            logger.info("dropped old collection", extra={"alias": alias, "collection": version})
+    set_alias(alias, entry["active"], entry["previous"], [v for v in entry["versions"] if v in keep])
+    return get_alias(alias)
+
+
+def list_sources(files: Optional[List[str]] = None) -> Dict[str, str]:
+    """Every document the index should hold → a marker that changes when it is re-uploaded
+
+    Uploaded PDFs (by modification time) plus the S3 keys ingested so far,
+    which are not kept in UPLOAD_DIR. With files, just those files.
+    """
+    from .s3_utils import list_s3_sources
+
+    paths = files or glob.glob(os.path.join(UPLOAD_DIR, "*.pdf"))
+    sources = {path: str(os.stat(path).st_mtime_ns) for path in paths if os.path.exists(path)}
+    if not files:
+        sources.update({f"s3:{key}": str(recorded_at) for key, recorded_at in list_s3_sources().items()})
+    return sources
+
+
+def ingest_source(source: str, collection: str) -> int:
+    """Ingest one list_sources entry into collection; returns chunks added"""
+    if source.startswith("s3:"):
+        from .s3_utils import ingest_from_s3
+
+        # Already recorded; recording again would look like a new upload to the next scan
+        added, _, _ = ingest_from_s3(source[len("s3:"):], collection, record=False)
+    else:
+        added, _, _ = ingest_pdf(source, collection_name=collection)
+    return added
+
+
+def ingest_pending(alias: str, collection: str, done: Dict[str, str], chunks: Dict[str, int],
+                   files: Optional[List[str]] = None) -> int:
+    """Ingest sources that are new or changed since done recorded them; returns how many"""
+    pending = sorted((source, marker) for source, marker in list_sources(files).items() if done.get(source) != marker)
+    for source, marker in pending:
+        chunks[source] = ingest_source(source, collection)
+        done[source] = marker
+        report_status(alias, files_done=len(done), chunks=sum(chunks.values()))
+    return len(pending)
+
+
+def build_index(alias: str = "manufacturing_manuals", files: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Re-ingest every uploaded manual and S3 document into a new versioned collection, validate it, then swap
+
+    Queries keep using the live collection until the swap. Documents
+    uploaded or re-uploaded while the build runs are picked up before
+    validation, and once more right after the swap for any that arrived
+    in between (ingests starting after the swap write to the new
+    collection themselves). The caller holds the build lock.
+    """
+    entry = get_alias(alias)
+    new_collection = next_version_name(alias, entry["versions"])
+    live_count = get_vectorstore(alias)._collection.count()
+    report_status(alias, state="building", collection=new_collection, started_at=time.time(),
+                  files_done=0, chunks=0, error=None)
+    logger.info("index build started", extra={"alias": alias, "collection": new_collection})
+
+    # Registered before writing so a crashed build is still garbage-collected later
+    set_alias(alias, entry["active"], entry["previous"], entry["versions"] + [new_collection])
+    done: Dict[str, str] = {}    # source → marker it was ingested at
+    chunks: Dict[str, int] = {}  # source → chunks of its latest ingest
+    try:
+        while ingest_pending(alias, new_collection, done, chunks, files):
+            if files:
+                break
+
+        report_status(alias, state="validating")
+        validate_collection(new_collection, sum(chunks.values()), live_count)
+        result = swap(alias, new_collection)
+    except Exception as e:
+        logger.exception("index build failed", extra={"alias": alias, "collection": new_collection})
+        report_status(alias, state="failed", error=str(e), finished_at=time.time())
+        drop_version(new_collection)
+        entry = get_alias(alias)
+        set_alias(alias, entry["active"], entry["previous"], [v for v in entry["versions"] if v != new_collection])
+        raise
+
+    # Uploads saved between the last scan and the swap went to the old collection only
+    report_status(alias, state="catching_up")
+    try:
+        caught_up = ingest_pending(alias, new_collection, done, chunks, files)
+    except Exception as e:
+        # The new collection is live and complete up to the swap; the failed document can be re-uploaded
+        logger.exception("index build catch-up failed", extra={"alias": alias, "collection": new_collection})
+        report_status(alias, state="done", error=f"catch-up failed: {e}", finished_at=time.time())
+        return result
+
+    report_status(alias, state="done", finished_at=time.time())
+    logger.info("index build swapped in", extra={"alias": alias, "collection": new_collection,
+                                                 "chunks": sum(chunks.values()), "caught_up": caught_up})
+    return result
+
+
+def start_background_build(alias: str = "manufacturing_manuals") -> bool:
+    """Run build_index on a daemon thread; False if a build or import is already running in any worker"""
+    fd = _acquire_build_lock()
+    if fd is None:
+        return False
+
+    def run():
+        try:
+            build_index(alias)
+        except Exception:
+            pass  # recorded in the build status
+        finally:
+            _release_build_lock(fd)
+
+    try:
+        BUILD_STATUS.clear()
+        report_status(alias, state="queued", error=None)
+        threading.Thread(target=run, name="index-build", daemon=True).start()
+    except Exception:
+        _release_build_lock(fd)
+        raise
+    return True
@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from .full_vectors import get_full_vectors
+from .index_builds import (
+    IndexBuildError, drop_version, exclusive_build, next_version_name, report_status, swap, validate_collection
+)
+from .safety_digest import get_safety_digest
+from .term_index import extract_terms, get_term_index
+from .vectorstore import (
+    EMBEDDINGS_PROVIDER, bump_collection_version, get_alias, get_chroma_client, get_embeddings,
+    get_vectorstore, get_write_batch_size, hnsw_metadata, resolve_collection, set_alias
+)
+
+# numpy is imported where it is used to keep API start-up fast
+if TYPE_CHECKING:
+    import numpy as np
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+EXPORT_READ_BATCH = 2000   # chunks per get() while exporting
+IMPORT_BATCH_SIZE = 5000   # chunks per add(); also capped at the backend's max batch size
+
+# Snapshot layout (one .npz archive, every column a plain array, so no pickling on load):
+#   manifest                 UTF-8 JSON: format, source collection, metadata, embedding model, counts
+#   embeddings               float32 (N, d), the vectors the HNSW index holds
+#   full_embeddings          float32 (N, D), only for shortened indexes (EMBED_INDEX_DIMENSIONS)
+#   {ids,documents,metadatas}_data / _offsets
+#                            UTF-8 strings concatenated into one byte array, row i is
+#                            data[offsets[i]:offsets[i + 1]]; metadatas are JSON objects
+
+
+def embedding_model() -> str:
+    """Which embeddings a collection was built with; queries must use the same ones"""
+    embeddings = get_embeddings()
+    return f"{EMBEDDINGS_PROVIDER}:{getattr(embeddings, 'model', type(embeddings).__name__)}"
+
+
+def _pack_strings(values: List[str]) -> Tuple["np.ndarray", "np.ndarray"]:
+    import numpy as np
+
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(data: "np.ndarray", offsets: "np.ndarray") -> List[str]:
+    blob = data.tobytes()
+    return [blob[start:end].decode("utf-8") for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def _collection_metadata(collection) -> Dict[str, Any]:
+    """Metadata that recreates the collection's index: its HNSW parameters and index dimensions"""
+    hnsw = (collection.configuration or {}).get("hnsw") or {}
+    metadata = dict(collection.metadata or {})
+    metadata.update(hnsw_metadata(hnsw.get("space", ""), hnsw.get("max_neighbors", 0),
+                                  hnsw.get("ef_construction", 0), hnsw.get("ef_search", 0)))
+    return metadata
+
+
+def export_index(path: str, collection_name: str = "manufacturing_manuals", compress: bool = False) -> Dict[str, Any]:
+    """Write a collection's ids, embeddings, documents and metadata to an .npz snapshot
+
+    Reads the collection in pages, so run it when no ingest or rebuild is
+    writing to it; the result would otherwise mix before and after.
+    """
+    import numpy as np
+
+    started = time.perf_counter()
+    collection_name = resolve_collection(collection_name)
+    collection = get_chroma_client().get_collection(collection_name)
+    metadata = _collection_metadata(collection)
+    index_dimensions = int(metadata.get("index_dimensions") or 0)
+    count = collection.count()
+    if count == 0:
+        raise IndexBuildError(f"{collection_name} is empty, nothing to export")
+
+    ids: List[str] = []
+    documents: List[str] = []
+    metadatas: List[str] = []
+    embeddings = None
+    full_embeddings = None
+    while len(ids) < count:
+        batch = collection.get(include=["embeddings", "documents", "metadatas"],
+                               limit=EXPORT_READ_BATCH, offset=len(ids))
+        if not len(batch["ids"]):
+            break
+        start, end = len(ids), len(ids) + len(batch["ids"])
+        if end > count:
+            raise IndexBuildError(f"{collection_name} grew during the export, retry when nothing writes to it")
+        if embeddings is None:
+            embeddings = np.empty((count, len(batch["embeddings"][0])), dtype=np.float32)
+        embeddings[start:end] = batch["embeddings"]
+        if index_dimensions:
+            full = get_full_vectors().get(collection_name, batch["ids"])
+            missing = [chunk_id for chunk_id in batch["ids"] if chunk_id not in full]
+            if missing:
+                raise IndexBuildError(f"{len(missing)} chunks of {collection_name} have no full vector, e.g. {missing[0]}")
+            if full_embeddings is None:
+                full_embeddings = np.empty((count, len(full[batch["ids"][0]])), dtype=np.float32)
+            full_embeddings[start:end] = [full[chunk_id] for chunk_id in batch["ids"]]
+        ids.extend(batch["ids"])
+        documents.extend(doc or "" for doc in batch["documents"])
+        metadatas.extend(json.dumps(meta) for meta in batch["metadatas"])
+    if len(ids) != count:
+        raise IndexBuildError(f"{collection_name} shrank during the export, retry when nothing writes to it")
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "collection": collection_name,
+        "metadata": metadata,
+        "embedding_model": embedding_model(),
+        "chunks": count,
+        "dimensions": embeddings.shape[1],
+        "full_dimensions": full_embeddings.shape[1] if full_embeddings is not None else None,
+        "exported_at": time.time(),
+    }
+    columns = {"manifest": np.frombuffer(json.dumps(manifest).encode("utf-8"), dtype=np.uint8),
+               "embeddings": embeddings}
+    if full_embeddings is not None:
+        columns["full_embeddings"] = full_embeddings
+    for name, values in (("ids", ids), ("documents", documents), ("metadatas", metadatas)):
+        columns[f"{name}_data"], columns[f"{name}_offsets"] = _pack_strings(values)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # np.savez appends .npz to names without it; a file object keeps the temp name as given
+    with open(tmp_path, "wb") as f:
+        (np.savez_compressed if compress else np.savez)(f, **columns)
+    os.replace(tmp_path, path)
+
+    summary = {"path": path, "collection": collection_name, "chunks": count,
+               "bytes": os.path.getsize(path), "seconds": round(time.perf_counter() - started, 2)}
+    logger.info("index exported", extra=summary)
+    return summary
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    import numpy as np
+
+    with np.load(path, allow_pickle=False) as snapshot:
+        return json.loads(snapshot["manifest"].tobytes().decode("utf-8"))
+
+
+def import_index(path: str, alias: str = "manufacturing_manuals", force: bool = False) -> Dict[str, Any]:
+    """Bulk-load an export_index snapshot into a new version of alias, validate it, then swap
+
+    No embedding calls: vectors come from the snapshot, and the term index,
+    safety digest and full vectors are rebuilt from its columns. Refuses a
+    snapshot built with other embeddings than this node queries with, and
+    (like POST /index/rebuild) one much smaller than the live index, unless
+    force is set. Also refused while a rebuild or another import is running.
+    """
+    import numpy as np
+
+    started = time.perf_counter()
+    with np.load(path, allow_pickle=False) as snapshot:
+        manifest = json.loads(snapshot["manifest"].tobytes().decode("utf-8"))
+        if manifest.get("format") != FORMAT_VERSION:
+            raise IndexBuildError(f"unsupported snapshot format {manifest.get('format')}")
+        model = embedding_model()
+        if manifest["embedding_model"] != model and not force:
+            raise IndexBuildError(f"snapshot was embedded with {manifest['embedding_model']}, this node uses {model}")
+        ids = _unpack_strings(snapshot["ids_data"], snapshot["ids_offsets"])
+        documents = _unpack_strings(snapshot["documents_data"], snapshot["documents_offsets"])
+        metadatas = [json.loads(meta) for meta in _unpack_strings(snapshot["metadatas_data"], snapshot["metadatas_offsets"])]
+        embeddings = snapshot["embeddings"]
+        full_embeddings = snapshot["full_embeddings"] if "full_embeddings" in snapshot.files else None
+    if not (len(ids) == len(documents) == len(metadatas) == len(embeddings) == manifest["chunks"]):
+        raise IndexBuildError(f"{path} is inconsistent: column lengths differ from the manifest")
+    loaded_s = time.perf_counter() - started
+
+    # Same lock as POST /index/rebuild: neither may register a version while the other runs
+    with exclusive_build(alias):
+        entry = get_alias(alias)
+        new_collection = next_version_name(alias, entry["versions"])
+        live_count = 0 if force else get_vectorstore(alias)._collection.count()
+        # Registered before writing so a crashed import is still garbage-collected later
+        set_alias(alias, entry["active"], entry["previous"], entry["versions"] + [new_collection])
+        report_status(alias, state="importing", collection=new_collection, started_at=time.time(),
+                      chunks=len(ids), error=None, finished_at=None)
+        logger.info("index import started", extra={"alias": alias, "collection": new_collection, "chunks": len(ids)})
+
+        try:
+            # Same index dimensions and HNSW graph as the exported collection
+            collection = get_chroma_client().create_collection(new_collection, metadata=manifest["metadata"] or None)
+            if full_embeddings is not None:
+                get_full_vectors().add(new_collection, ids, full_embeddings)
+            batch_size = get_write_batch_size(IMPORT_BATCH_SIZE)
+            for start in range(0, len(ids), batch_size):
+                end = min(start + batch_size, len(ids))
+                collection.add(ids=ids[start:end], embeddings=embeddings[start:end],
+                               documents=documents[start:end], metadatas=[meta or None for meta in metadatas[start:end]])
+            written_s = time.perf_counter() - started - loaded_s
+
+            get_term_index().add(new_collection, ((ids[i], extract_terms(documents[i])) for i in range(len(ids))))
+            get_safety_digest().add(new_collection, (
+                (ids[i], meta.get("source", ""), meta.get("page", 0), meta.get("section", ""), documents[i])
+                for i, meta in enumerate(metadatas) if meta and meta.get("chunk_type") == "safety"
+            ))
+
+            validate_collection(new_collection, len(ids), live_count)
+            result = swap(alias, new_collection)
+        except Exception as e:
+            logger.exception("index import failed", extra={"alias": alias, "collection": new_collection})
+            report_status(alias, state="failed", error=str(e), finished_at=time.time())
+            drop_version(new_collection)
+            entry = get_alias(alias)
+            set_alias(alias, entry["active"], entry["previous"], [v for v in entry["versions"] if v != new_collection])
+            raise
+        report_status(alias, state="done", finished_at=time.time())
+        bump_collection_version(new_collection)
+
+    summary = {"alias": alias, "collection": new_collection, "chunks": len(ids), "read_seconds": round(loaded_s, 2),
+               "write_seconds": round(written_s, 2), "seconds": round(time.perf_counter() - started, 2), **result}
+    logger.info("index imported", extra=summary)
+    return summary
@@ -1,20 +1,36 @@
 import os
 import re
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+import hashlib
+import logging
 from dotenv import load_dotenv
-from typing import List, Dict, Tuple
+from .vectorstore import get_vectorstore, get_write_batch_size, bump_collection_version, resolve_collection, get_index_dimensions
+from .full_vectors import get_full_vectors, shorten
+from .embedding_batcher import AdaptiveEmbedder
+from .term_index import get_term_index, extract_terms, has_spec_value
+from .safety_digest import get_safety_digest, find_section
+from .metrics import stage_timer
+from typing import TYPE_CHECKING, Any, List, Dict, Optional, Tuple
+
+# LangChain loaders/splitters are imported inside the functions that use them
+# to keep API start-up fast
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 load_dotenv()
 
 UPLOAD_DIR = "data/uploads"
 PERSIST_DIR = "data/chroma_db"
+WRITE_BATCH_SIZE = 1000  # per add(); also capped at the backend's max batch size
+CHUNK_SIZE = 650     # characters per free-text chunk (safety blocks and steps are kept whole)
+CHUNK_OVERLAP = 130
+
+logger = logging.getLogger(__name__)
 
-def manufacturing_manual_chunking(documents: List[Document]) -> List[Document]:
+def manufacturing_manual_chunking(documents: List["Document"]) -> List["Document"]:
     """Specialized chunking for manufacturing/automation manuals"""
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    
     final_chunks = []
     
     for doc in documents:
@@ -32,7 +48,8 @@ def manufacturing_manual_chunking(documents: List[Document]) -> List[Document]:
                 safety_metadata.update({
                     "chunk_type": "safety",
                     "priority": "high",
-                    "has_safety": True
+                    "has_safety": True,
+                    "section": find_section(text, match.start())
                 })
                 final_chunks.append(Document(
                     page_content=safety_text,
@@ -65,8 +82,8 @@ def manufacturing_manual_chunking(documents: List[Document]) -> List[Document]:
         # Process remaining content with smart splitting
         if text.strip():
             splitter = RecursiveCharacterTextSplitter(
-                chunk_size=650,
-                chunk_overlap=130,
+                chunk_size=CHUNK_SIZE,
+                chunk_overlap=CHUNK_OVERLAP,
                 separators=[
                     "\n\n## ",
                     "\n\n",
@@ -90,7 +107,7 @@ def manufacturing_manual_chunking(documents: List[Document]) -> List[Document]:
                     # Auto-classify
                     if re.search(r'(figure|diagram|table)\s+\d+', chunk_text, re.IGNORECASE):
                         chunk_metadata["chunk_type"] = "reference"
-                    elif re.search(r'(\d+\s*mm|\d+\s*°C|\d+\s*rpm|\d+\s*psi)', chunk_text):
+                    elif has_spec_value(chunk_text):
                         chunk_metadata["chunk_type"] = "specification"
                     else:
                         chunk_metadata["chunk_type"] = "content"
@@ -102,19 +119,38 @@ def manufacturing_manual_chunking(documents: List[Document]) -> List[Document]:
     
     return final_chunks
 
-def ingest_pdf(file_path: str) -> Tuple[int, Dict[str, int]]:
-    """Ingest manufacturing manual PDF with optimized chunking"""
+def ingest_pdf(file_path: str, collection_name: str = "manufacturing_manuals",
+               source: Optional[str] = None) -> Tuple[int, Dict[str, int], Dict[str, Any]]:
+    """Ingest manufacturing manual PDF with optimized chunking
+    
+    collection_name may be an alias (writes go to its active collection) or
+    a physical collection, e.g. one being built by app/index_builds.py.
+    source names the document in chunk metadata and ids (default: file_path);
+    a download passes where it came from (e.g. its s3:// URI), not its temp path.
+    Chunks of an earlier version of the same source are replaced.
+    Returns (chunks added, chunk counts by type, embedding throughput stats).
+    """
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     os.makedirs(PERSIST_DIR, exist_ok=True)
     
+    from langchain_community.document_loaders import PyMuPDFLoader
+    from .openai_client import use_lane
+    
     # Use PyMuPDF for better text extraction
-    loader = PyMuPDFLoader(file_path)
-    documents = loader.load()
+    with stage_timer("ingest", "load"):
+        loader = PyMuPDFLoader(file_path)
+        documents = loader.load()
+    
+    source = source or file_path
+    for document in documents:
+        document.metadata["source"] = source
+        document.metadata["file_path"] = source
     
-    print(f"📄 Loaded {len(documents)} pages from {os.path.basename(file_path)}")
+    logger.info("pdf loaded", extra={"pages": len(documents), "file": os.path.basename(file_path)})
     
     # Apply manufacturing-optimized chunking
-    chunks = manufacturing_manual_chunking(documents)
+    with stage_timer("ingest", "chunk"):
+        chunks = manufacturing_manual_chunking(documents)
     
     # Statistics
     chunk_types = {}
@@ -122,23 +158,91 @@ def ingest_pdf(file_path: str) -> Tuple[int, Dict[str, int]]:
         chunk_type = chunk.metadata.get("chunk_type", "unknown")
         chunk_types[chunk_type] = chunk_types.get(chunk_type, 0) + 1
     
-    print(f"✂️  Created {len(chunks)} chunks")
-    print(f"📊 Chunk distribution: {chunk_types}")
+    logger.info("chunks created", extra={"chunks": len(chunks), "chunk_types": chunk_types})
     
-    # Create embeddings and vector store
-    embeddings = OpenAIEmbeddings(
-        model="text-embedding-3-small",
-        openai_api_key=os.getenv("OPENAI_API_KEY")
-    )
+    # Shared vector store (same handle and embeddings client the chat path uses);
+    # in CHROMA_MODE=http the writes go to the Chroma server over the pooled client
+    collection = resolve_collection(collection_name)
+    db = get_vectorstore(collection)
+    batch_size = get_write_batch_size(WRITE_BATCH_SIZE)
     
-    db = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=PERSIST_DIR,
-        collection_name="manufacturing_manuals"
-    )
+    texts = [chunk.page_content for chunk in chunks]
+    ids = chunk_ids(source, texts)
+    term_index = get_term_index()
+    safety_digest = get_safety_digest()
+    index_dimensions = get_index_dimensions(db)
     
-    # Persistence is automatic in newer Chroma versions
-    # No need to call db.persist()
+    # Chunks an earlier version of this document left behind (changed pages get new ids);
+    # removed once the new version is written, so the document is never missing meanwhile
+    stale_ids = set(db._collection.get(where={"source": source}, include=[])["ids"]) - set(ids)
     
-    return len(chunks), chunk_types
\ No newline at end of file
+    def write_batch(start: int, end: int, vectors: List[List[float]]):
+        # Shortened index: full vectors go to the side store first, so every chunk
+        # the index can return also has its full vector for re-scoring
+        if index_dimensions:
+            with stage_timer("ingest", "full_vectors"):
+                get_full_vectors().add(collection, ids[start:end], vectors)
+                vectors = shorten(vectors, index_dimensions).tolist()
+        
+        # Upsert with deterministic ids: re-running a failed ingest overwrites what
+        # the first attempt already wrote instead of duplicating it
+        with stage_timer("ingest", "write"):
+            for offset in range(start, end, batch_size):
+                stop = min(offset + batch_size, end)
+                db._collection.upsert(
+                    ids=ids[offset:stop],
+                    embeddings=vectors[offset - start:stop - start],
+                    documents=texts[offset:stop],
+                    metadatas=[chunk.metadata for chunk in chunks[offset:stop]]
+                )
+        # Alarm codes, part numbers and value+unit specs → chunk ids, indexed only once
+        # the chunks exist so an exact hit never points at a missing chunk
+        with stage_timer("ingest", "term_index"):
+            term_index.add(collection, (
+                (ids[i], extract_terms(texts[i])) for i in range(start, end)
+            ))
+        # Per-page safety digest, so answers can attach the warnings for their pages
+        with stage_timer("ingest", "safety_digest"):
+            safety_digest.add(collection, (
+                (ids[i], chunks[i].metadata.get("source", ""), chunks[i].metadata.get("page", 0),
+                 chunks[i].metadata.get("section", ""), texts[i])
+                for i in range(start, end) if chunks[i].metadata.get("chunk_type") == "safety"
+            ))
+    
+    # Bulk lane: queued chat calls take the shared OpenAI quota first.
+    # Each batch is written as soon as it is embedded.
+    try:
+        with stage_timer("ingest", "embed"), use_lane("bulk"):
+            embedding_stats = AdaptiveEmbedder(db.embeddings).embed(texts, write_batch)
+    finally:
+        # Persistence is automatic in newer Chroma versions
+        # No need to call db.persist()
+        # Bumped even on failure: batches written before the error are already visible
+        bump_collection_version(collection)
+    
+    logger.info("chunks embedded", extra={"embedding": embedding_stats})
+    
+    if stale_ids:
+        with stage_timer("ingest", "remove_stale"):
+            remove_chunks(collection, sorted(stale_ids))
+        bump_collection_version(collection)
+        logger.info("stale chunks removed", extra={"source": source, "chunks": len(stale_ids)})
+    
+    return len(chunks), chunk_types, embedding_stats
+
+def chunk_ids(source: str, texts: List[str]) -> List[str]:
+    """Stable ids per (source, position, content) so re-ingesting a document is idempotent"""
+    return [
+        hashlib.sha1(f"{source}\x00{i}\x00{text}".encode("utf-8")).hexdigest()
+        for i, text in enumerate(texts)
+    ]
+
+def remove_chunks(collection: str, ids: List[str]):
+    """Delete chunks from a physical collection and from the term index, safety digest and full vectors"""
+    db = get_vectorstore(collection)
+    batch_size = get_write_batch_size(WRITE_BATCH_SIZE)
+    for offset in range(0, len(ids), batch_size):
+        db._collection.delete(ids=ids[offset:offset + batch_size])
+    get_term_index().remove(collection, ids)
+    get_safety_digest().remove(collection, ids)
+    get_full_vectors().remove(collection, ids)
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from .metrics import CACHE_REQUESTS
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "")  # e.g. data/llm_cache.db, empty = memory only
+LLM_CACHE_DB_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DB_MAX_ENTRIES", "100000"))  # 0 = no cap
+
+
+def make_cache_key(model: str, temperature: Any, max_tokens: Any, messages: List["BaseMessage"]) -> str:
+    """Hash model parameters and the full message list into a cache key"""
+    payload = {
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "messages": [[msg.type, msg.content] for msg in messages],
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Exact-match response cache: in-memory LRU tier plus optional SQLite tier
+
+    The SQLite tier is purged at start-up and every PURGE_EVERY_WRITES
+    writes: expired rows are deleted, then the oldest rows beyond
+    db_max_entries.
+    """
+
+    PURGE_EVERY_WRITES = 256
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 86400, db_path: str = "",
+                 db_max_entries: int = 100000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.db_max_entries = db_max_entries
+        self._writes = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key → (stored_at, value)
+        self._lock = threading.Lock()
+        self._db = None
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "disk_evictions": 0,
+        }
+
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_stored_at ON llm_cache (stored_at)")
+            self._db.commit()
+            self._purge()
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - stored_at > self.ttl_seconds
+
+    def _purge(self):
+        """Delete expired rows, then the oldest beyond db_max_entries (lock held or not yet shared)"""
+        if self.ttl_seconds > 0:
+            cursor = self._db.execute("DELETE FROM llm_cache WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+            self._counters["expirations"] += cursor.rowcount
+        if self.db_max_entries > 0:
+            cursor = self._db.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self.db_max_entries,)
+            )
+            self._counters["disk_evictions"] += cursor.rowcount
+        self._db.commit()
+
+    def _remember(self, key: str, stored_at: float, value: str):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if not self._expired(stored_at):
+                    self._entries.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return value
+                del self._entries[key]
+                self._counters["expirations"] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, stored_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, stored_at = row
+                    if not self._expired(stored_at):
+                        self._remember(key, stored_at, value)
+                        self._counters["disk_hits"] += 1
+                        return value
+                    self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                    self._counters["expirations"] += 1
+
+            self._counters["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        """Store a value in both tiers"""
+        stored_at = time.time()
+        with self._lock:
+            self._remember(key, stored_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, stored_at) VALUES (?, ?, ?)",
+                    (key, value, stored_at),
+                )
+                self._db.commit()
+                self._writes += 1
+                if self._writes % self.PURGE_EVERY_WRITES == 0:
+                    self._purge()
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit-rate metrics for /stats"""
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            **counters,
+            "hits": hits,
+            "lookups": lookups,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": entries,
+            "disk_enabled": self._db is not None,
+        }
+
+
+class CachedChatModel:
+    """Wraps a chat model so identical prompts are answered from cache"""
+
+    def __init__(self, llm, cache: LLMCache, enabled: bool = True):
+        self.llm = llm
+        self.cache = cache
+        self.enabled = enabled
+
+    def __getattr__(self, name):
+        # Delegate everything else (model_name, temperature, ...) to the wrapped model
+        return getattr(self.llm, name)
+
+    def invoke(self, messages: List["BaseMessage"], **kwargs) -> "BaseMessage":
+        if not self.enabled:
+            return self.llm.invoke(messages, **kwargs)
+
+        key = make_cache_key(
+            getattr(self.llm, "model_name", ""),
+            getattr(self.llm, "temperature", None),
+            getattr(self.llm, "max_tokens", None),
+            messages,
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            from langchain_core.messages import AIMessage
+            CACHE_REQUESTS.inc(cache="llm", result="hit")
+            return AIMessage(content=cached, response_metadata={"cache_hit": True})
+        CACHE_REQUESTS.inc(cache="llm", result="miss")
+
+        result = self.llm.invoke(messages, **kwargs)
+        self.cache.set(key, result.content)
+        return result
+
+
+LLM_CACHE = LLMCache(
+    max_entries=LLM_CACHE_MAX_ENTRIES,
+    ttl_seconds=LLM_CACHE_TTL_SECONDS,
+    db_path=LLM_CACHE_DB,
+    db_max_entries=LLM_CACHE_DB_MAX_ENTRIES,
+)
@@ -0,0 +1,63 @@
+import hashlib
+import math
+import re
+from typing import List, Sequence, Union
+
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_DIMENSIONS = 1536
+_LEVELS = (64, 128, 256, 512, 1024, 2048, 4096)  # nested hash ranges, see hash_embedding
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+
+
+def _features(text: Union[str, Sequence[int]]) -> List[str]:
+    """Unigrams and bigrams for text, or the ids themselves for pre-tokenized input"""
+    if not isinstance(text, str):
+        tokens = [str(token) for token in text]
+    else:
+        tokens = _WORD_PATTERN.findall(text.lower())
+    bigrams = [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return tokens + bigrams
+
+
+def hash_embedding(text: Union[str, Sequence[int]], dimensions: int = DEFAULT_DIMENSIONS) -> List[float]:
+    """Deterministic unit-length embedding via signed feature hashing
+
+    Texts sharing words land close together, so retrieval behaves plausibly
+    without calling a model. Accepts raw text or a list of token ids (the
+    form OpenAIEmbeddings sends when context-length checking is on).
+
+    Each feature is hashed into nested ranges (the first 64 dimensions, the
+    first 128, ...), so like text-embedding-3 the leading dimensions are a
+    coarser embedding of their own: the vector for fewer dimensions is the
+    re-normalized prefix of the full one.
+    """
+    levels = _LEVELS if dimensions <= _LEVELS[-1] else _LEVELS + (dimensions,)
+    vector = [0.0] * dimensions
+    for feature in _features(text):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=4 * len(levels)).digest()
+        for i, level in enumerate(levels):
+            value = int.from_bytes(digest[4 * i:4 * i + 4], "little")
+            bucket = value % level
+            if bucket < dimensions:
+                vector[bucket] += 1.0 if value >> 31 else -1.0
+
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return [v / norm for v in vector]
+
+
+class LocalHashEmbeddings(Embeddings):
+    """Offline stand-in for OpenAIEmbeddings (benchmarks, evaluation)"""
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [hash_embedding(text, self.dimensions) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return hash_embedding(text, self.dimensions)
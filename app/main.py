@@ -1,21 +1,113 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+import asyncio
+import json
 import shutil
 import os
-from typing import Dict
+import time
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
 
-from .schemas import IngestResponse, ChatRequest, ChatResponse, ClearHistoryRequest, ClearHistoryResponse
+from .schemas import IngestResponse, ChatRequest, ChatResponse, ClearHistoryRequest, ClearHistoryResponse, BatchChatRequest
 from .ingestion import ingest_pdf
-from .retrieval import answer_question
-from .memory import clear_history, CHAT_MEMORY
+from .retrieval import answer_question, answer_questions_batch, classify_question, get_prompt_cache_stats, ANSWER_FLIGHTS
+from .memory import clear_history, get_session_stats
+from .llm_cache import LLM_CACHE
+from .usage import BudgetExceededError, enforce_budget, metered, get_usage_stats, get_session_usage
+from .admission import (CHAT_ADMISSION, INGEST_ADMISSION, PRIORITY_BATCH, PRIORITY_NORMAL, PRIORITY_SAFETY,
+                        OverloadedError, get_admission_stats, is_deadline_exceeded)
+from .profiling import (PROFILE_MAX_SECONDS, PROFILE_SAMPLE_INTERVAL_MS, ProfilerBusyError, call_profiled, finish_process_profile,
+                        is_admin, list_profiles, profile_path, requested_mode, start_process_profile)
+from .metrics import render_prometheus, HTTP_LATENCY
+from .logging_utils import configure_logging, new_request_id, REQUEST_ID
+from .warmup import WARMUP_ON_START, WARMUP_STATUS, start_background_warmup
 
-app = FastAPI(title="Manufacturing Manual RAG API")
+configure_logging()
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "5000"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+def budget_exceeded(e: BudgetExceededError) -> HTTPException:
+    """429 for a used-up budget; Retry-After when the global budget resets"""
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    return HTTPException(status_code=429, detail=str(e), headers=headers)
+
+def overloaded(e: OverloadedError) -> HTTPException:
+    """503 for a request shed by admission control or out of time"""
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def require_admin(request: Request):
+    """403 unless the request carries X-Admin-Token matching ADMIN_TOKEN"""
+    if not is_admin(request.headers.get("X-Admin-Token")):
+        raise HTTPException(status_code=403, detail="Admin token required (X-Admin-Token; ADMIN_TOKEN unset disables)")
+
+def profile_mode_for(request: Request) -> Optional[str]:
+    """Profile mode asked for with X-Profile or ?profile= (admins only); None for plain requests"""
+    header = request.headers.get("X-Profile")
+    query = request.query_params.get("profile")
+    if header is None and query is None:
+        return None
+    try:
+        mode = requested_mode(header, query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if mode is not None:
+        require_admin(request)
+    return mode
+
+def profile_busy(e: ProfilerBusyError) -> HTTPException:
+    return HTTPException(status_code=409, detail=str(e))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Optionally preload heavy dependencies in the background once the server is up"""
+    if WARMUP_ON_START:
+        start_background_warmup()
+    yield
+
+app = FastAPI(title="Manufacturing Manual RAG API", lifespan=lifespan)
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """Tag each request with an id for logs and time it"""
+    request_id = request.headers.get("X-Request-ID") or new_request_id()
+    token = REQUEST_ID.set(request_id)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", request.url.path)
+        HTTP_LATENCY.observe(time.perf_counter() - start, method=request.method, path=path, status=str(status))
+        REQUEST_ID.reset(token)
 
 @app.post("/ingest", response_model=IngestResponse)
-async def ingest_endpoint(file: UploadFile = File(...)):
+async def ingest_endpoint(request: Request, file: UploadFile = File(...)):
     """Ingest a manufacturing manual PDF"""
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    profile_mode = profile_mode_for(request)
+    try:
+        enforce_budget()
+    except BudgetExceededError as e:
+        raise budget_exceeded(e)
     
+    # Waits for a slot on the event loop; the blocking work runs on the threadpool
+    try:
+        async with INGEST_ADMISSION.admit():
+            return await run_in_threadpool(ingest_upload, file, profile_mode)
+    except OverloadedError as e:
+        raise overloaded(e)
+
+def ingest_upload(file: UploadFile, profile_mode: Optional[str] = None) -> Dict:
+    """Save an uploaded PDF and ingest it (profiling the ingest if profile_mode is set)"""
     os.makedirs("data/uploads", exist_ok=True)
     file_path = f"data/uploads/{file.filename}"
 
@@ -23,34 +115,114 @@ async def ingest_endpoint(file: UploadFile = File(...)):
         shutil.copyfileobj(file.file, f)
 
     try:
-        chunks, chunk_types = ingest_pdf(file_path)
+        with metered() as meter:
+            (chunks, chunk_types, embedding), profile = call_profiled(
+                profile_mode, f"ingest-{REQUEST_ID.get()}", ingest_pdf, file_path
+            )
         
         return {
             "status": "success", 
             "chunks_added": chunks,
             "chunk_types": chunk_types,
+            "embedding": embedding,
+            "usage": meter.summary(),
+            "profile": profile,
             "message": f"Successfully processed {file.filename}"
         }
+    except ProfilerBusyError as e:
+        raise profile_busy(e)
     except Exception as e:
+        if is_deadline_exceeded(e):
+            logger.warning("ingest ran out of time", extra={"file": file.filename})
+            raise overloaded(OverloadedError("Request deadline exceeded", INGEST_ADMISSION.retry_after()))
+        logger.exception("ingest failed", extra={"file": file.filename})
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
 @app.post("/chat", response_model=ChatResponse)
-def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """Ask questions about manufacturing manuals"""
+    profile_mode = profile_mode_for(http_request)
+    # Safety questions go to the front of the admission queue
+    priority = PRIORITY_SAFETY if classify_question(request.question) == "safety" else PRIORITY_NORMAL
     try:
-        answer, sources = answer_question(
-            session_id=request.session_id,
-            question=request.question
-        )
+        async with CHAT_ADMISSION.admit(priority):
+            (answer, sources, details), profile = await run_in_threadpool(
+                call_profiled,
+                profile_mode,
+                f"chat-{REQUEST_ID.get()}",
+                answer_question,
+                session_id=request.session_id,
+                question=request.question
+            )
 
         return {
             "answer": answer, 
             "sources": sources,
-            "context_used": len(sources)
+            "question_type": details.get("question_type"),
+            "context_used": details.get("retrieval", {}).get("context_chunks", len(sources)),
+            "retrieval": details.get("retrieval"),
+            "safety_notices": details.get("safety_notices", []),
+            "usage": details.get("usage"),
+            "budget": details.get("budget"),
+            "prompt_cache": details.get("prompt_cache"),
+            "profile": profile
         }
+    except BudgetExceededError as e:
+        logger.warning("chat rejected, budget used up", extra={"session_id": request.session_id, "reason": str(e)})
+        raise budget_exceeded(e)
+    except OverloadedError as e:
+        raise overloaded(e)
+    except ProfilerBusyError as e:
+        raise profile_busy(e)
     except Exception as e:
+        if is_deadline_exceeded(e):
+            logger.warning("chat ran out of time", extra={"session_id": request.session_id})
+            raise overloaded(OverloadedError("Request deadline exceeded", CHAT_ADMISSION.retry_after()))
+        logger.exception("chat failed", extra={"session_id": request.session_id})
         raise HTTPException(status_code=500, detail=f"Failed to process question: {str(e)}")
 
+@app.post("/chat/batch")
+async def chat_batch_endpoint(request: BatchChatRequest):
+    """Answer many questions; results stream back as NDJSON in completion order
+    
+    Each unique question takes a chat admission slot (behind interactive
+    requests, PRIORITY_BATCH) and gets the chat deadline; a shed or timed-out
+    question comes back as an item with an error and retry_after.
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions provided")
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    
+    # Refuse a batch that could not answer anything; each question is checked again as it runs
+    try:
+        enforce_budget(request.session_id)
+    except BudgetExceededError as e:
+        raise budget_exceeded(e)
+    
+    concurrency = min(request.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    ids = [item.id for item in request.questions]
+    loop = asyncio.get_running_loop()
+    
+    @contextmanager
+    def admit(question_type: str):
+        with CHAT_ADMISSION.admit_from_thread(loop, PRIORITY_BATCH):
+            try:
+                yield
+            except Exception as e:
+                if is_deadline_exceeded(e):
+                    raise OverloadedError("Request deadline exceeded", CHAT_ADMISSION.retry_after()) from e
+                raise
+    
+    # A sync generator: Starlette iterates it on the threadpool
+    def stream():
+        for result in answer_questions_batch([item.question for item in request.questions], concurrency, admit,
+                                             request.session_id):
+            result["id"] = ids[result["index"]]
+            yield json.dumps(result) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/clear_history", response_model=ClearHistoryResponse)
 def clear_history_endpoint(request: ClearHistoryRequest):
     """Clear conversation history for a session"""
@@ -78,27 +250,131 @@ def get_session_info(session_id: str):
         "session_id": session_id,
         "message_count": len(history),
         "exchange_count": len(history) // 2,
-        "active": len(history) > 0
+        "active": len(history) > 0,
+        "usage": get_session_usage(session_id)
     }
 
 @app.get("/stats")
 def get_stats():
     """Get system statistics"""
-    total_sessions = len(CHAT_MEMORY)
-    total_messages = sum(len(msgs) for msgs in CHAT_MEMORY.values())
+    sessions = get_session_stats()
     
     # Check vector store
-    from .vectorstore import get_vectorstore
+    from .vectorstore import get_vectorstore, get_index_dimensions, get_hnsw_settings, CHROMA_MODE
+    from .full_vectors import get_full_vectors
+    from .openai_client import get_rate_limit_stats
+    from .term_index import get_term_index
+    from .safety_digest import get_safety_digest
+    from .working_set import get_working_sets
     try:
         db = get_vectorstore()
-        collection = db.get()
-        doc_count = len(collection['ids']) if collection['ids'] else 0
+        # count() rather than get(): in http mode get() would ship every document over the wire
+        doc_count = db._collection.count()
+        index_dimensions = get_index_dimensions(db) or "full"
+        hnsw = get_hnsw_settings(db)
     except:
         doc_count = 0
+        index_dimensions = None
+        hnsw = None
     
     return {
-        "active_sessions": total_sessions,
-        "total_messages": total_messages,
+        "active_sessions": sessions["sessions"],
+        "total_messages": sessions["messages"],
         "documents_in_db": doc_count,
-        "memory_size": sum(len(str(msgs)) for msgs in CHAT_MEMORY.values())
-    }
\ No newline at end of file
+        "vectorstore_mode": CHROMA_MODE,
+        "index_dimensions": index_dimensions,
+        "hnsw": hnsw,
+        "memory_size": sessions["bytes"],
+        "session_store": sessions,
+        "warmup": dict(WARMUP_STATUS),
+        "llm_cache": LLM_CACHE.stats(),
+        "prompt_cache": get_prompt_cache_stats(),
+        "coalesced_requests": ANSWER_FLIGHTS.stats(),
+        "openai_rate_limit": get_rate_limit_stats(),
+        "term_index": get_term_index().stats(),
+        "safety_digest": get_safety_digest().stats(),
+        "full_vectors": get_full_vectors().stats(),
+        "working_set": get_working_sets().stats(),
+        "admission": get_admission_stats(),
+        "usage": get_usage_stats()
+    }
+
+@app.post("/index/rebuild", status_code=202)
+def rebuild_index_endpoint(request: Request):
+    """Rebuild the index from the uploaded manuals into a new collection, then swap it in (admin)"""
+    require_admin(request)
+    from .index_builds import start_background_build, get_build_status
+    
+    if not start_background_build("manufacturing_manuals"):
+        raise HTTPException(status_code=409, detail="An index build or import is already running")
+    return {"status": "started", "build": get_build_status("manufacturing_manuals")}
+
+@app.get("/index")
+def index_status_endpoint():
+    """Active/previous collection behind the alias and the state of the last build, from any worker"""
+    from .index_builds import get_build_status
+    from .vectorstore import get_alias
+    
+    return {"alias": "manufacturing_manuals", **get_alias("manufacturing_manuals"),
+            "build": get_build_status("manufacturing_manuals")}
+
+@app.post("/index/rollback")
+def rollback_index_endpoint(request: Request):
+    """Switch back to the previous collection (admin)"""
+    require_admin(request)
+    from .index_builds import rollback, IndexBuildError
+    
+    try:
+        return {"status": "rolled_back", **rollback("manufacturing_manuals")}
+    except IndexBuildError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/index/gc")
+def gc_index_endpoint(request: Request):
+    """Drop collections other than the active and previous ones (admin)"""
+    require_admin(request)
+    from .index_builds import garbage_collect
+    
+    return {"status": "collected", **garbage_collect("manufacturing_manuals")}
+
+@app.get("/debug/profile")
+async def process_profile_endpoint(request: Request, seconds: float = 10.0,
+                                   interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS, format: str = "json"):
+    """Sample every thread of this worker for `seconds` (admin); summary or collapsed stacks"""
+    require_admin(request)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}]")
+    if format not in ("json", "collapsed"):
+        raise HTTPException(status_code=400, detail="format must be json or collapsed")
+    try:
+        sampler = start_process_profile(interval_ms)
+    except ProfilerBusyError as e:
+        raise profile_busy(e)
+    # Waits on the event loop, so the sampled traffic keeps every threadpool thread
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        summary, collapsed = finish_process_profile(sampler, f"process-{os.getpid()}")
+    if format == "collapsed":
+        return PlainTextResponse(collapsed)
+    return summary
+
+@app.get("/debug/profiles")
+def list_profiles_endpoint(request: Request):
+    """Stored profiles, newest first (admin)"""
+    require_admin(request)
+    return {"profiles": list_profiles()}
+
+@app.get("/debug/profiles/{name}")
+def get_profile_endpoint(name: str, request: Request):
+    """Download a stored profile: .prof for pstats / snakeviz, .collapsed.txt for flame graphs (admin)"""
+    require_admin(request)
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=name)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
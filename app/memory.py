@@ -1,41 +1,137 @@
-from langchain_core.messages import HumanMessage, AIMessage
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Tuple
+from .session_store import create_session_store
+from .working_set import get_working_sets
+from .admission import REQUEST_DEADLINE
+import contextvars
+import logging
+import os
+import threading
 
-# session_id → messages
-CHAT_MEMORY = {}
-MAX_HISTORY_LENGTH = 10  # Keep last 5 exchanges
+logger = logging.getLogger(__name__)
+
+MAX_HISTORY_LENGTH = 10  # Keep last 10 exchanges (user + assistant message pairs)
+
+# session_id → turns (plain strings) + rolling summary, bounded by idle TTL and LRU limits.
+# The frontend mints a new session id per browser session, so this must evict.
+# Use the sqlite (one host) or redis (several hosts) backend with more than one worker,
+# otherwise a follow-up can land on a worker that never saw the session.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_STORE = create_session_store(
+    SESSION_BACKEND,
+    max_turns=MAX_HISTORY_LENGTH,
+    max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "10000")),
+    max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024))),
+    idle_ttl_seconds=float(os.getenv("SESSION_IDLE_TTL_SECONDS", str(4 * 3600))),
+    sqlite_path=os.getenv("SESSION_SQLITE_PATH", "data/sessions.db"),
+    redis_url=os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+)
+
+# session_id → exchanges not yet folded into the summary (the most recent MAX_HISTORY_LENGTH
+# are kept while summarizing keeps failing)
+_PENDING_EXCHANGES: Dict[str, List[Tuple[str, str]]] = {}
+SUMMARY_CAS_ATTEMPTS = 3
+_REFRESHING = set()
+_SUMMARY_LOCK = threading.Lock()
+_SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
 
 def get_history(session_id: str) -> List:
-    """Get conversation history with automatic pruning"""
-    history = CHAT_MEMORY.setdefault(session_id, [])
+    """Get conversation history as LangChain messages (built on demand)"""
+    from langchain_core.messages import HumanMessage, AIMessage
     
-    # Automatically prune if too long
-    if len(history) > MAX_HISTORY_LENGTH * 2:  # *2 for user+assistant pairs
-        history = history[-MAX_HISTORY_LENGTH*2:]
-        CHAT_MEMORY[session_id] = history
+    history = []
+    for user, ai in SESSION_STORE.get_turns(session_id):
+        history.append(HumanMessage(content=user))
+        history.append(AIMessage(content=ai))
     
     return history
 
 def add_to_history(session_id: str, user: str, ai: str):
-    """Add to history with automatic summarization for long conversations"""
-    history = get_history(session_id)
-    
-    # Add new messages
-    history.append(HumanMessage(content=user))
-    history.append(AIMessage(content=ai))
-    
-    # Keep within limit
-    if len(history) > MAX_HISTORY_LENGTH * 2:
-        CHAT_MEMORY[session_id] = history[-MAX_HISTORY_LENGTH*2:]
+    """Add to history; the rolling summary is refreshed separately (see schedule_summary_refresh)"""
+    # Stored as plain strings; the store keeps only the last MAX_HISTORY_LENGTH exchanges
+    SESSION_STORE.append(session_id, user, ai)
 
 def clear_history(session_id: str):
     """Clear conversation history for a session"""
-    if session_id in CHAT_MEMORY:
-        del CHAT_MEMORY[session_id]
-        return True
-    return False
+    with _SUMMARY_LOCK:
+        _PENDING_EXCHANGES.pop(session_id, None)
+    get_working_sets().clear(session_id)
+    
+    return SESSION_STORE.clear(session_id)
 
 def get_recent_history(session_id: str, num_exchanges: int = 3) -> List:
     """Get recent conversation history (last N exchanges)"""
     history = get_history(session_id)
     return history[-num_exchanges*2:] if history else []
+
+def get_summary(session_id: str) -> str:
+    """Latest rolling summary for a session ("" until the first refresh finishes)"""
+    return SESSION_STORE.get_summary(session_id)
+
+def schedule_summary_refresh(session_id: str, user: str, ai: str,
+                             summarize: Callable[[str, List[Tuple[str, str]]], str]):
+    """Queue an exchange and refresh the session summary in the background
+    
+    summarize(previous_summary, exchanges) returns the new summary. At most
+    one refresh runs per session in this process; exchanges that arrive
+    meanwhile are folded in by the same refresh, and ones whose summarize
+    call failed are retried with the next. The store update is a
+    compare-and-set, so a summary stored by another worker is never lost.
+    """
+    with _SUMMARY_LOCK:
+        _PENDING_EXCHANGES.setdefault(session_id, []).append((user, ai))
+        if session_id in _REFRESHING:
+            return
+        _REFRESHING.add(session_id)
+    
+    # Keep the request id on the worker's log lines, but not the request's deadline
+    context = contextvars.copy_context()
+    context.run(REQUEST_DEADLINE.set, None)
+    _SUMMARY_EXECUTOR.submit(context.run, _refresh_summary, session_id, summarize)
+
+def _refresh_summary(session_id: str, summarize: Callable[[str, List[Tuple[str, str]]], str]):
+    exchanges: List[Tuple[str, str]] = []
+    try:
+        while True:
+            with _SUMMARY_LOCK:
+                exchanges = _PENDING_EXCHANGES.pop(session_id, [])
+            if not exchanges:
+                return
+            _fold_into_summary(session_id, summarize, exchanges)
+            exchanges = []
+    except Exception:
+        logger.exception("summary refresh failed", extra={"session_id": session_id})
+    finally:
+        with _SUMMARY_LOCK:
+            arrived = _PENDING_EXCHANGES.get(session_id, [])
+            if exchanges:
+                # Not folded in: retried by the next refresh, ahead of anything queued since
+                _PENDING_EXCHANGES[session_id] = (exchanges + arrived)[-MAX_HISTORY_LENGTH:]
+            if arrived:
+                # Queued after our last look by callers that saw this refresh running
+                _SUMMARY_EXECUTOR.submit(contextvars.copy_context().run, _refresh_summary, session_id, summarize)
+            else:
+                _REFRESHING.discard(session_id)
+
+def _fold_into_summary(session_id: str, summarize: Callable[[str, List[Tuple[str, str]]], str],
+                       exchanges: List[Tuple[str, str]]):
+    """Summarize exchanges into the stored summary with a compare-and-set
+    
+    _REFRESHING only covers this worker: with the sqlite or redis store,
+    another worker may store a summary for the same session meanwhile.
+    Its summary is then folded into, not overwritten.
+    """
+    for _ in range(SUMMARY_CAS_ATTEMPTS):
+        previous = SESSION_STORE.get_summary(session_id)
+        summary = summarize(previous, exchanges)
+        if SESSION_STORE.set_summary(session_id, summary, expected=previous):
+            return
+        if SESSION_STORE.get_summary(session_id) == previous:
+            # Dropped: the session was cleared or evicted while we were summarizing
+            return
+    logger.warning("summary refresh lost to concurrent updates",
+                   extra={"session_id": session_id, "exchanges": len(exchanges)})
+
+def get_session_stats() -> Dict:
+    """Session counts and memory accounting for /stats"""
+    return SESSION_STORE.stats()
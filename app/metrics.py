@@ -0,0 +1,241 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond lookups up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket latency histogram"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[Tuple[str, ...], list] = {}  # key → [bucket counts, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def summary(self, **labels) -> Dict[str, float]:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            if series is None:
+                return {"count": 0, "sum": 0.0}
+            return {"count": series[2], "sum": series[1]}
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render_prometheus() -> str:
+    """All registered metrics in Prometheus text exposition format (per process)"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.header())
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Pipeline metrics
+STAGE_LATENCY = Histogram(
+    "rag_stage_duration_seconds",
+    "Latency of each pipeline stage",
+    ["pipeline", "stage"],
+)
+HTTP_LATENCY = Histogram(
+    "rag_http_request_duration_seconds",
+    "End-to-end HTTP request latency",
+    ["method", "path", "status"],
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total",
+    "Tokens consumed by model calls",
+    ["model", "kind"],
+)
+CACHE_REQUESTS = Counter(
+    "rag_cache_requests_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"],
+)
+COALESCED_REQUESTS = Counter(
+    "rag_coalesced_requests_total",
+    "Chat requests that shared an in-flight answer",
+)
+RETRIEVAL_DECISIONS = Counter(
+    "rag_retrieval_decisions_total",
+    "Adaptive retrieval depth decisions",
+    ["question_type", "mode"],
+)
+WORKING_SET_LOOKUPS = Counter(
+    "rag_working_set_lookups_total",
+    "Follow-ups scored against their session's recent chunks (hit = index search skipped)",
+    ["result"],
+)
+PROMPT_CACHE_TOKENS = Counter(
+    "rag_prompt_cache_tokens_total",
+    "Prompt tokens of answer generation calls, and how many the provider served from its prompt cache",
+    ["question_type", "kind"],
+)
+CONTEXT_CHUNKS = Histogram(
+    "rag_context_chunks",
+    "Chunks placed in the answer prompt",
+    ["question_type"],
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10),
+)
+RATE_LIMIT_WAIT = Histogram(
+    "rag_rate_limit_wait_seconds",
+    "Time model calls waited for RPM/TPM quota",
+    ["lane"],
+)
+UPSTREAM_RETRIES = Counter(
+    "rag_upstream_retries_total",
+    "Retried model calls by reason (HTTP status or connect)",
+    ["reason"],
+)
+LLM_COST = Counter(
+    "rag_llm_cost_usd_total",
+    "Estimated USD cost of model calls (from reported usage)",
+    ["model"],
+)
+BUDGET_ACTIONS = Counter(
+    "rag_budget_actions_total",
+    "Requests served degraded or rejected because of a usage budget",
+    ["action"],
+)
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "rag_admission_queue_depth",
+    "Requests waiting for an admission slot",
+    ["endpoint"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "rag_admission_in_flight",
+    "Requests holding an admission slot",
+    ["endpoint"],
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "rag_admission_queue_wait_seconds",
+    "Time admitted requests waited for a slot",
+    ["endpoint"],
+)
+ADMISSION_SHED = Counter(
+    "rag_admission_shed_total",
+    "Requests rejected with 503 by admission control",
+    ["endpoint", "reason"],
+)
+
+PROFILES = Counter(
+    "rag_profiles_total",
+    "Profiles captured on admin request (per-request cProfile / sampling, or whole process)",
+    ["kind"],
+)
+
+@contextmanager
+def stage_timer(pipeline: str, stage: str):
+    """Time one pipeline stage, e.g. stage_timer("chat", "rewrite")"""
+    with STAGE_LATENCY.time(pipeline=pipeline, stage=stage):
+        yield
@@ -0,0 +1,324 @@
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from .admission import DeadlineExceededError, remaining_seconds
+from .metrics import RATE_LIMIT_WAIT, UPSTREAM_RETRIES
+from .tokens import count_tokens
+from .usage import record_usage
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Account quota (0 disables a limit). The limiter lives in each process, so with N workers
+# each one enforces 1/N of it; OPENAI_LIMIT_WORKERS defaults to uvicorn's WEB_CONCURRENCY
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+OPENAI_LIMIT_WORKERS = max(1, int(os.getenv("OPENAI_LIMIT_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+OPENAI_RETRY_BASE_SECONDS = float(os.getenv("OPENAI_RETRY_BASE_SECONDS", "0.5"))
+OPENAI_RETRY_MAX_SECONDS = float(os.getenv("OPENAI_RETRY_MAX_SECONDS", "20"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Lower rank is served first: a queued chat call always goes before queued bulk embedding
+LANES = {"interactive": 0, "bulk": 1}
+REQUEST_LANE = contextvars.ContextVar("request_lane", default="interactive")
+
+
+@contextmanager
+def use_lane(lane: str):
+    """Send model calls made inside the block through the given priority lane"""
+    if lane not in LANES:
+        raise ValueError(f"Unknown lane: {lane}")
+    token = REQUEST_LANE.set(lane)
+    try:
+        yield
+    finally:
+        REQUEST_LANE.reset(token)
+
+
+class _Bucket:
+    """Token bucket refilled continuously at limit_per_minute / 60 per second"""
+
+    def __init__(self, limit_per_minute: int):
+        self.capacity = float(limit_per_minute)
+        self.rate = limit_per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        return max(0.0, (amount - self.level) / self.rate)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limiter with priority lanes
+
+    Callers queue in (lane, arrival) order and only the head of the queue may
+    take capacity, so bulk work never jumps ahead of waiting interactive work.
+    Token costs are estimated up front and corrected with adjust() once the
+    response reports actual usage.
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self._requests = _Bucket(rpm) if rpm > 0 else None
+        self._tokens = _Bucket(tpm) if tpm > 0 else None
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (lane rank, arrival)
+        self._arrivals = itertools.count()
+        self._paused_until = 0.0
+        self._counters = {"acquired": 0, "waited": 0, "pauses": 0}
+
+    def acquire(self, tokens: int, lane: str = "interactive", deadline: Optional[float] = None) -> float:
+        """Block until the call fits in both buckets; returns seconds waited
+
+        Raises DeadlineExceededError if that would be after deadline (time.monotonic()).
+        """
+        start = time.monotonic()
+        entry = (LANES[lane], next(self._arrivals))
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    delay = self._head_delay(tokens) if self._queue[0] == entry else None
+                    if delay == 0.0:
+                        break
+                    if deadline is not None and time.monotonic() + (delay or 0.0) >= deadline:
+                        raise DeadlineExceededError("request deadline passed while waiting for rate limit quota")
+                    # Non-head waiters are woken when the head leaves; the cap guards against missed wakeups
+                    self._cond.wait(timeout=min(delay, 1.0) if delay is not None else 1.0)
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            if self._requests is not None:
+                self._requests.level -= 1
+            if self._tokens is not None:
+                self._tokens.level -= min(tokens, self._tokens.capacity)
+            self._counters["acquired"] += 1
+            waited = time.monotonic() - start
+            if waited > 0.001:
+                self._counters["waited"] += 1
+            self._cond.notify_all()
+        return waited
+
+    def _head_delay(self, tokens: int) -> float:
+        now = time.monotonic()
+        delay = max(0.0, self._paused_until - now)
+        if self._requests is not None:
+            self._requests.refill(now)
+            delay = max(delay, self._requests.seconds_until(1))
+        if self._tokens is not None:
+            self._tokens.refill(now)
+            delay = max(delay, self._tokens.seconds_until(min(tokens, self._tokens.capacity)))
+        return delay
+
+    def adjust(self, tokens: int):
+        """Correct the token bucket by actual minus estimated usage"""
+        if self._tokens is None or tokens == 0:
+            return
+        with self._cond:
+            self._tokens.refill(time.monotonic())
+            self._tokens.level = min(self._tokens.capacity, self._tokens.level - tokens)
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """Hold every lane for seconds, e.g. after the API answers 429"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._counters["pauses"] += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            for bucket in (self._requests, self._tokens):
+                if bucket is not None:
+                    bucket.refill(now)
+            return {
+                **self._counters,
+                "queued": len(self._queue),
+                "requests_available": round(self._requests.level, 1) if self._requests else None,
+                "tokens_available": round(self._tokens.level) if self._tokens else None,
+                "paused_seconds": round(max(0.0, self._paused_until - now), 3),
+            }
+
+
+def request_body(request: httpx.Request) -> dict:
+    try:
+        body = json.loads(request.content or b"{}")
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def estimate_tokens(body: dict) -> int:
+    """Upper-bound token cost of a chat or embeddings request body"""
+    if "messages" in body:
+        prompt = sum(count_tokens(str(message.get("content") or "")) for message in body["messages"])
+        return prompt + int(body.get("max_completion_tokens") or body.get("max_tokens") or 0)
+    inputs = body.get("input", "")
+    if isinstance(inputs, str):
+        return count_tokens(inputs)
+    if inputs and isinstance(inputs[0], int):
+        return len(inputs)  # a single pre-tokenized input
+    # LangChain sends token ids when tiktoken is available, strings otherwise
+    return sum(len(item) if isinstance(item, list) else count_tokens(item) for item in inputs)
+
+
+def deadline_timeout(message: str) -> httpx.TimeoutException:
+    """A timeout the OpenAI SDK reports as APITimeoutError, caused by DeadlineExceededError"""
+    error = httpx.PoolTimeout(message)
+    error.__cause__ = DeadlineExceededError(message)
+    return error
+
+
+def retry_delay(response: Optional[httpx.Response], attempt: int) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+    backoff = random.uniform(0, min(OPENAI_RETRY_MAX_SECONDS, OPENAI_RETRY_BASE_SECONDS * 2 ** attempt))
+    if response is None:
+        return backoff
+    try:
+        if "retry-after-ms" in response.headers:
+            return max(backoff, float(response.headers["retry-after-ms"]) / 1000)
+        if "retry-after" in response.headers:
+            return max(backoff, float(response.headers["retry-after"]))
+    except ValueError:
+        pass
+    return backoff
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """Keep-alive transport that rate limits, prioritizes and retries model calls"""
+
+    def __init__(self, limiter: RateLimiter, max_retries: int = 4):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self._transport = httpx.HTTPTransport(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            )
+        )
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        lane = REQUEST_LANE.get()
+        body = request_body(request)
+        estimate = estimate_tokens(body)
+        streaming = bool(body.get("stream"))
+        # Set by admission control (app/admission.py); None for background work
+        left = remaining_seconds()
+        deadline = None if left is None else time.monotonic() + left
+        configured_timeout = dict(request.extensions.get("timeout") or {})
+        attempt = 0
+        while True:
+            try:
+                waited = self.limiter.acquire(estimate, lane, deadline)
+            except DeadlineExceededError as e:
+                raise deadline_timeout(str(e))
+            RATE_LIMIT_WAIT.observe(waited, lane=lane)
+
+            if deadline is not None:
+                # No single phase of the call may outlast what is left of the request's deadline
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise deadline_timeout("request deadline passed before the model call")
+                request.extensions["timeout"] = {
+                    phase: left if value is None else min(value, left) for phase, value in configured_timeout.items()
+                } or {"connect": left, "read": left, "write": left, "pool": left}
+
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TimeoutException:
+                if deadline is not None and time.monotonic() >= deadline - 0.01:
+                    raise deadline_timeout("request deadline passed during the model call")
+                raise
+            except httpx.ConnectError:
+                # Nothing reached the server, so retrying cannot duplicate work
+                delay = retry_delay(None, attempt)
+                if attempt >= self.max_retries:
+                    raise
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise deadline_timeout("no time left to retry the model call")
+                UPSTREAM_RETRIES.inc(reason="connect")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = retry_delay(response, attempt)
+                response.close()
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise deadline_timeout(f"no time left to retry the model call after HTTP {response.status_code}")
+                UPSTREAM_RETRIES.inc(reason=str(response.status_code))
+                if response.status_code == 429:
+                    # Our quota estimate was off; hold every lane, not just this call
+                    self.limiter.pause(delay)
+                logger.warning("retrying model call", extra={
+                    "status": response.status_code, "attempt": attempt + 1, "delay": round(delay, 3), "lane": lane
+                })
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            if response.status_code == 200 and not streaming:
+                response.read()
+                try:
+                    usage = json.loads(response.content).get("usage") or {}
+                    if "total_tokens" in usage:
+                        self.limiter.adjust(usage["total_tokens"] - estimate)
+                        # Every chat and embedding call passes here, so this is the one place to meter
+                        record_usage(str(body.get("model", "unknown")), usage)
+                except ValueError:
+                    pass
+            return response
+
+    def close(self):
+        self._transport.close()
+
+
+def worker_share(limit: int) -> int:
+    """This process's part of an account-wide limit (0 stays unlimited)"""
+    return max(1, limit // OPENAI_LIMIT_WORKERS) if limit > 0 else 0
+
+
+_LIMITER = RateLimiter(worker_share(OPENAI_RPM_LIMIT), worker_share(OPENAI_TPM_LIMIT))
+_HTTP_CLIENT = None
+_HTTP_CLIENT_LOCK = threading.Lock()
+
+
+def get_http_client() -> httpx.Client:
+    """One keep-alive HTTP client shared by the chat model and the embeddings"""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        with _HTTP_CLIENT_LOCK:
+            if _HTTP_CLIENT is None:
+                _HTTP_CLIENT = httpx.Client(
+                    transport=RateLimitedTransport(_LIMITER, max_retries=OPENAI_MAX_RETRIES),
+                    timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=5.0),
+                )
+    return _HTTP_CLIENT
+
+
+def get_rate_limit_stats() -> dict:
+    return {**_LIMITER.stats(), "workers": OPENAI_LIMIT_WORKERS,
+            "rpm_limit": worker_share(OPENAI_RPM_LIMIT), "tpm_limit": worker_share(OPENAI_TPM_LIMIT)}
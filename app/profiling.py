@@ -0,0 +1,282 @@
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as Tally
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from .metrics import PROFILES
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Profiling is admin-only: requests must send X-Admin-Token: <ADMIN_TOKEN> (empty = profiling off)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))                # newest profile files kept
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))              # functions listed in a summary
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))  # longest process profile
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+
+PROFILE_MODES = ("cprofile", "sample")
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(APP_DIR)
+# Leaf frames of a thread with nothing to do (idle pool worker, event loop poll, or a uvloop
+# loop inside its C code); such samples are dropped unless app code is on the stack, e.g.
+# waiting on a lock or a reply
+IDLE_LEAVES = {("threading.py", "wait"), ("queue.py", "get"), ("selectors.py", "select"),
+               ("thread.py", "_worker"), ("_thread.py", "get"), ("runners.py", "run")}
+
+# cProfile supports one active profiler per thread (per process from Python 3.12),
+# and one process profile at a time keeps its overhead bounded
+_CPROFILE_LOCK = threading.Lock()
+_PROCESS_PROFILE_LOCK = threading.Lock()
+
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def requested_mode(header: Optional[str], query: Optional[str]) -> Optional[str]:
+    """Profile mode asked for by X-Profile or ?profile= ("1"/"true" = cprofile), or None"""
+    value = (header or query or "").strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return None
+    if value in ("1", "true", "yes", "on"):
+        return "cprofile"
+    if value not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode {value!r}, expected one of {', '.join(PROFILE_MODES)}")
+    return value
+
+
+def _location(filename: str, line: int, name: str) -> str:
+    """"function (file:line)" with repo-relative or package-relative paths"""
+    if filename.startswith(REPO_DIR):
+        filename = os.path.relpath(filename, REPO_DIR)
+    # Site-packages paths are long and all alike; keep from the package name on
+    filename = re.sub(r"^.*[/\\](?:site|dist)-packages[/\\]", "", filename)
+    return f"{name} ({filename}:{line})"
+
+
+def _save(name: str, write: Callable[[str], None]) -> str:
+    """Write a profile file under PROFILE_DIR, dropping the oldest beyond PROFILE_KEEP"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    # Names carry the client-supplied request id
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}-{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}")
+    write(path)
+    files = sorted((os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR)), key=os.path.getmtime)
+    for old in files[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    return path
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Path of a stored profile by file name (None if unknown or not a plain name)"""
+    if os.path.basename(name) != name or name.startswith("."):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+class StackSampler:
+    """Samples thread stacks every interval from a background thread (sys._current_frames)
+
+    Costs nothing to the sampled threads beyond the GIL hand-offs, so it can
+    watch the whole process; the result is stack → sample count, written in
+    the collapsed format flame graph tools read.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL_MS / 1000,
+                 thread_ids: Optional[Iterable[int]] = None):
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        self.stacks: Tally = Tally()
+        self.samples = 0
+        self.idle_samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self.seconds = 0.0
+
+    def _label(self, code) -> str:
+        return _location(code.co_filename, code.co_firstlineno, code.co_name)
+
+    def _sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == threading.get_ident() or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                continue
+            leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+            stack = []
+            in_app = False
+            while frame is not None:
+                in_app = in_app or frame.f_code.co_filename.startswith(APP_DIR)
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if leaf in IDLE_LEAVES and not in_app:
+                self.idle_samples += 1
+                continue
+            stack.append(f"thread:{names.get(thread_id, thread_id)}")
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> "StackSampler":
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "StackSampler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.seconds = time.perf_counter() - self._started
+        return self
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = PROFILE_TOP_N) -> Dict[str, Any]:
+        """Functions by samples on top of the stack (self) and anywhere on it (total)"""
+        own: Tally = Tally()
+        total: Tally = Tally()
+        threads: Tally = Tally()
+        for stack, count in self.stacks.items():
+            threads[stack[0]] += count
+            own[stack[-1]] += count
+            for function in set(stack[1:]):
+                total[function] += count
+        samples = max(1, self.samples)
+        return {
+            "mode": "sample",
+            "seconds": round(self.seconds, 3),
+            "interval_ms": round(self.interval * 1000, 2),
+            "samples": self.samples,
+            "idle_samples": self.idle_samples,
+            "threads": dict(threads.most_common()),
+            "top_self": [{"function": f, "samples": n, "share": round(n / samples, 3)} for f, n in own.most_common(top)],
+            "top_total": [{"function": f, "samples": n, "share": round(n / samples, 3)} for f, n in total.most_common(top)],
+        }
+
+
+def _cprofile_summary(profiler, seconds: float, top: int = PROFILE_TOP_N) -> Dict[str, Any]:
+    import pstats
+
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return {
+        "mode": "cprofile",
+        "seconds": round(seconds, 3),
+        "calls": stats.total_calls,
+        "top_cumulative": [
+            {"function": _location(filename, line, name), "calls": calls,
+             "self_s": round(own_time, 4), "cumulative_s": round(cumulative, 4)}
+            for (filename, line, name), (_, calls, own_time, cumulative, _) in rows
+        ],
+    }
+
+
+@contextmanager
+def profile_request(mode: str, name: str):
+    """Profile the calling thread for the block; yields a dict filled with the summary on exit
+
+    Run it in the thread doing the request's work (inside run_in_threadpool):
+    cProfile only sees the thread that enabled it, and the sampler is told to
+    watch just this one. Work handed to other threads (embedding batches,
+    summary refreshes) shows up as the wait for it.
+    """
+    result: Dict[str, Any] = {}
+    started = time.perf_counter()
+    if mode == "cprofile":
+        import cProfile
+
+        if not _CPROFILE_LOCK.acquire(blocking=False):
+            raise ProfilerBusyError("Another request is being profiled with cProfile, retry or use profile=sample")
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                yield result
+            finally:
+                profiler.disable()
+        finally:
+            _CPROFILE_LOCK.release()
+        result.update(_cprofile_summary(profiler, time.perf_counter() - started))
+        result["file"] = os.path.basename(_save(f"{name}.prof", profiler.dump_stats))
+    else:
+        sampler = StackSampler(thread_ids=[threading.get_ident()]).start()
+        try:
+            yield result
+        finally:
+            sampler.stop()
+        result.update(sampler.summary())
+        result["file"] = os.path.basename(_save(f"{name}.collapsed.txt", lambda path: _write_text(path, sampler.collapsed())))
+    PROFILES.inc(kind=f"request_{mode}")
+    logger.info("request profiled", extra={"mode": mode, "file": result["file"], "seconds": result["seconds"]})
+
+
+def call_profiled(mode: Optional[str], name: str, func: Callable, *args, **kwargs) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    """(func's result, profile summary); without a mode just calls func"""
+    if mode is None:
+        return func(*args, **kwargs), None
+    with profile_request(mode, name) as profile:
+        result = func(*args, **kwargs)
+    return result, profile
+
+
+def _write_text(path: str, text: str):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Stored profile files, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    files = [os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR)]
+    return [{"file": os.path.basename(path), "bytes": os.path.getsize(path), "created_at": os.path.getmtime(path)}
+            for path in sorted(files, key=os.path.getmtime, reverse=True)]
+
+
+def start_process_profile(interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS) -> StackSampler:
+    """Start sampling every thread of this process; one at a time"""
+    if not _PROCESS_PROFILE_LOCK.acquire(blocking=False):
+        raise ProfilerBusyError("A process profile is already running")
+    try:
+        return StackSampler(interval=max(0.001, interval_ms / 1000)).start()
+    except Exception:
+        _PROCESS_PROFILE_LOCK.release()
+        raise
+
+
+def finish_process_profile(sampler: StackSampler, name: str) -> Tuple[Dict[str, Any], str]:
+    """Stop a start_process_profile sampler; returns (summary, collapsed stacks)"""
+    try:
+        sampler.stop()
+    finally:
+        _PROCESS_PROFILE_LOCK.release()
+    collapsed = sampler.collapsed()
+    summary = sampler.summary()
+    summary["file"] = os.path.basename(_save(f"{name}.collapsed.txt", lambda path: _write_text(path, collapsed)))
+    PROFILES.inc(kind="process")
+    logger.info("process profiled", extra={"file": summary["file"], "seconds": summary["seconds"],
+                                           "samples": summary["samples"]})
+    return summary, collapsed
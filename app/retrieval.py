@@ -1,86 +1,824 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage
-from .vectorstore import get_vectorstore
-from .memory import get_history, add_to_history
+from .vectorstore import get_vectorstore, get_collection_version, get_collection_space, distance_to_similarity, get_index_dimensions
+from .full_vectors import get_full_vectors, shorten
+from .memory import get_history, add_to_history, get_summary, schedule_summary_refresh
+from .llm_cache import CachedChatModel, LLM_CACHE, LLM_CACHE_ENABLED
+from .singleflight import SingleFlight, normalize_question
+from .tokens import count_tokens, truncate_to_tokens
+from .term_index import get_term_index, extract_terms, rank_candidates
+from .safety_digest import safety_notices_for
+from .usage import BudgetExceededError, enforce_budget, metered, DEGRADED_CONTEXT_CHUNKS
+from .working_set import get_working_sets, WORKING_SET_ENABLED
+from .admission import REQUEST_DEADLINE
+from .metrics import stage_timer, LLM_TOKENS, COALESCED_REQUESTS, RETRIEVAL_DECISIONS, CONTEXT_CHUNKS, WORKING_SET_LOOKUPS, PROMPT_CACHE_TOKENS
 from dotenv import load_dotenv
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+import contextlib
+import contextvars
+import logging
+import os
 import re
+import threading
+import time
 
 load_dotenv()
 
-# Initialize LLM with manufacturing-appropriate settings
-llm = ChatOpenAI(
-    model="gpt-4o",
-    temperature=0.1,  # Low temperature for precise, factual answers
-    max_tokens=1000
-)
+logger = logging.getLogger(__name__)
+
+# The LLM client is built on first use (see get_llm) so importing this module
+# does not pull in langchain_openai / openai at process start
+_llm = None
+_llm_lock = threading.Lock()
+
+def get_llm():
+    """Shared LLM client, created on first use"""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                from langchain_openai import ChatOpenAI
+                from .openai_client import get_http_client, OPENAI_TIMEOUT_SECONDS
+                
+                # Initialize LLM with manufacturing-appropriate settings
+                # Wrapped in an exact-match cache: at this temperature identical prompts
+                # (e.g. the same question in a fresh session) get the same answer anyway
+                _llm = CachedChatModel(
+                    ChatOpenAI(
+                        model="gpt-4o",
+                        temperature=0.1,  # Low temperature for precise, factual answers
+                        max_tokens=1000,
+                        # Shared rate-limited client; it retries 429/5xx itself, so the SDK must not
+                        http_client=get_http_client(),
+                        max_retries=0,
+                        timeout=OPENAI_TIMEOUT_SECONDS
+                    ),
+                    cache=LLM_CACHE,
+                    enabled=LLM_CACHE_ENABLED
+                )
+    return _llm
+
+def human_message(content: str):
+    from langchain_core.messages import HumanMessage
+    return HumanMessage(content=content)
+
+def prompt_messages(system: str, user: str) -> List:
+    """[system, user] messages; the system text should be one of the fixed prompts"""
+    from langchain_core.messages import SystemMessage
+    return [SystemMessage(content=system), human_message(user)]
+
+# Concurrent requests for the same standalone question share one retrieval + answer
+ANSWER_FLIGHTS = SingleFlight()
+# Loads the vectors of chunks new to a session's working set (see remember_chunks)
+_WORKING_SET_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="working-set")
+
+# classify_question keywords, checked in this order (no match → "general")
+QUESTION_TYPE_KEYWORDS = {
+    "safety": ['safety', 'warning', 'caution', 'danger', 'risk', 'hazard'],
+    "procedure": ['step', 'procedure', 'how to', 'install', 'assemble', 'maintenance', 'operation'],
+    "troubleshooting": ['error', 'fault', 'troubleshoot', 'fix', 'problem', 'alarm', 'diagnose'],
+    "specification": ['spec', 'parameter', 'setting', 'value', 'torque', 'rpm', 'pressure', 'temperature', 'voltage'],
+    "definition": ['what is', 'define', 'explain', 'meaning', 'purpose'],
+}
+
+# Retrieval depth per question type: MMR k / fetch_k and chunks kept for the prompt.
+# Spec lookups need one or two precise chunks; procedures and safety need breadth.
+RETRIEVAL_PROFILES = {
+    "specification": {"k": 4, "fetch_k": 10, "keep": 3},
+    "definition": {"k": 4, "fetch_k": 10, "keep": 3},
+    "troubleshooting": {"k": 6, "fetch_k": 15, "keep": 4},
+    "general": {"k": 6, "fetch_k": 15, "keep": 4},
+    "procedure": {"k": 8, "fetch_k": 20, "keep": 5},
+    "safety": {"k": 8, "fetch_k": 20, "keep": 5},
+}
+PROBE_K = 5                 # similarity probe used to read the score distribution
+EARLY_EXIT_MIN_SCORE = 0.5  # top hit must be at least this relevant to stop early
+EARLY_EXIT_MARGIN = 0.08    # ...and beat the runner-up by this much
+FLAT_SCORE_SPREAD = 0.03    # top-to-last spread below this means no clear winner
+WIDEN_FACTOR = 2
+MAX_FETCH_K = 40
+MMR_LAMBDA_MULT = 0.7       # 1 = pure relevance, 0 = pure diversity
+# Collections with a shortened index: candidates taken from it and re-scored on full vectors
+SHORTLIST_CANDIDATES = int(os.getenv("SHORTLIST_CANDIDATES", "80"))
+
+# Follow-ups are first scored against the chunks their session retrieved recently
+# (app/working_set.py); the index is searched only when the best local match is below this
+WORKING_SET_MIN_SCORE = float(os.getenv("WORKING_SET_MIN_SCORE", "0.5"))
+WORKING_SET_MARGIN = 0.1  # local chunks kept must be this close to the best one
+
+# Exact-term fast path (alarm codes, part numbers, value+unit specs; see app/term_index.py)
+EXACT_TERM_TYPES = ("troubleshooting", "specification")
+EXACT_MAX_CANDIDATES = 200  # a term in more chunks than this is too common to narrow on
+
+# Rolling conversation summary used for query rewriting instead of raw history
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "200"))
+SUMMARY_ANSWER_TOKENS = 300  # each answer is clipped to this before being summarized
+
+# Prompts are rendered once here. Everything that never changes between requests goes in
+# the system message, ahead of the retrieved context, so the prompt prefix stays identical.
+# OpenAI only caches prefixes of 1024+ tokens, and these system messages are about 160-180
+# tokens (the rewrite one about 45), so two requests with different context never share a
+# cached prefix; identical prompts are served by the LLM cache instead. The stable prefix
+# only starts paying off if fixed material pushes it past the minimum, which would cost
+# more in uncached calls than the cache discount saves at today's size.
+PROVIDER_PROMPT_CACHE_MIN_TOKENS = 1024
+TYPE_INSTRUCTIONS = {
+    "safety": """CRITICAL SAFETY INSTRUCTIONS:
+- Always start with safety warnings if present
+- List ALL safety precautions mentioned
+- Use clear warning symbols ⚠️ for dangers
+- Be explicit about risks and consequences
+- Never omit or minimize safety information""",
+    "procedure": """PROCEDURE INSTRUCTIONS:
+- List steps in exact numerical order
+- Include required tools and materials
+- Mention safety steps before procedure steps
+- Include verification/check steps
+- Be precise with measurements and settings""",
+    "troubleshooting": """TROUBLESHOOTING INSTRUCTIONS:
+- List possible causes from most to least likely
+- Include diagnostic steps to identify the issue
+- Provide clear resolution steps
+- Mention any required tools or parts
+- State when professional help is needed""",
+    "specification": """SPECIFICATION INSTRUCTIONS:
+- Provide exact values with units
+- Include acceptable ranges if specified
+- Mention measurement conditions if relevant
+- Reference the exact source document""",
+    "definition": """DEFINITION INSTRUCTIONS:
+- Provide clear, concise definitions
+- Include context from the manual
+- Mention related terms if applicable
+- Reference the source document""",
+    "general": """GENERAL INSTRUCTIONS:
+- Be precise and technical
+- Include specific values when available
+- Cite the source document for key information
+- If information is incomplete, state what's missing""",
+}
+
+SYSTEM_PROMPT_TEMPLATE = """You are a manufacturing automation expert answering questions from technical manuals.
+
+{type_instructions}
+
+ANSWER GUIDELINES:
+1. Answer based ONLY on the context provided
+2. If the context doesn't contain the answer, say: "I don't have that specific information in the available manuals."
+3. For safety questions, always start with safety warnings
+4. For procedures, use numbered lists
+5. Be concise but complete
+6. Reference which document(s) you're using (e.g., "Based on Document 1...")"""
+
+SYSTEM_PROMPTS = {
+    q_type: SYSTEM_PROMPT_TEMPLATE.format(type_instructions=type_instructions)
+    for q_type, type_instructions in TYPE_INSTRUCTIONS.items()
+}
+
+CONTEXT_BLOCK_TEMPLATE = "DOCUMENT {number} {source}:\n{content}"
+
+# Only present when the retrieved pages carry warnings, so other prompts are unchanged
+SAFETY_SECTION_TEMPLATE = """
+SAFETY NOTICES ON THESE PAGES (state any that apply to the answer):
+{safety_notes}
+"""
+
+ANSWER_PROMPT_TEMPLATE = """CONTEXT FROM TECHNICAL MANUALS:
+{context}
+{safety_section}
+QUESTION: {question}
+
+ANSWER:"""
+
+REWRITE_SYSTEM_PROMPT = """Rewrite manufacturing questions to be standalone and optimized for search.
+Rewrite to include relevant manufacturing keywords for better document retrieval.
+Keep it concise and clear."""
+
+REWRITE_PROMPT_TEMPLATE = """Conversation context:
+{context}
+
+Current question: {question}
+
+Question type: {question_type}
+
+Rewritten question:"""
+
+def invoke_llm(messages: List, stage: str, pipeline: str = "chat"):
+    """Call the LLM under a stage timer and record token usage"""
+    llm = get_llm()
+    with stage_timer(pipeline, stage):
+        result = llm.invoke(messages)
+    
+    usage = getattr(result, "usage_metadata", None) or {}
+    model = getattr(llm, "model_name", "unknown")
+    if usage:
+        LLM_TOKENS.inc(usage.get("input_tokens", 0), model=model, kind="prompt")
+        LLM_TOKENS.inc(usage.get("output_tokens", 0), model=model, kind="completion")
+        # Prompt tokens served from the provider's prompt cache (a subset of "prompt")
+        LLM_TOKENS.inc(prompt_cache_usage(result)["cached_tokens"], model=model, kind="cached")
+    return result
+
+def prompt_cache_usage(result) -> Dict[str, int]:
+    """Prompt and cached-prompt token counts reported by the API for one call (zeros on a local cache hit)"""
+    usage = getattr(result, "usage_metadata", None) or {}
+    return {
+        "prompt_tokens": usage.get("input_tokens", 0),
+        "cached_tokens": (usage.get("input_token_details") or {}).get("cache_read", 0)
+    }
+
+def get_prompt_cache_stats() -> Dict[str, Any]:
+    """Share of answer prompt tokens served from the provider's prompt cache, per question type
+    
+    Also reports each type's fixed system prefix size: below
+    PROVIDER_PROMPT_CACHE_MIN_TOKENS no cross-request hit is possible.
+    """
+    stats = {}
+    for question_type in RETRIEVAL_PROFILES:
+        prefix_tokens = count_tokens(SYSTEM_PROMPTS.get(question_type, SYSTEM_PROMPTS["general"]))
+        entry = {"system_prefix_tokens": prefix_tokens,
+                 "prefix_cacheable": prefix_tokens >= PROVIDER_PROMPT_CACHE_MIN_TOKENS}
+        prompt = int(PROMPT_CACHE_TOKENS.value(question_type=question_type, kind="prompt"))
+        cached = int(PROMPT_CACHE_TOKENS.value(question_type=question_type, kind="cached"))
+        if prompt:
+            entry.update({"prompt_tokens": prompt, "cached_tokens": cached, "cached_share": round(cached / prompt, 3)})
+        stats[question_type] = entry
+    return stats
 
 def classify_question(question: str) -> str:
     """Classify manufacturing questions for better retrieval"""
     question_lower = question.lower()
     
-    if any(word in question_lower for word in ['safety', 'warning', 'caution', 'danger', 'risk', 'hazard']):
-        return "safety"
-    elif any(word in question_lower for word in ['step', 'procedure', 'how to', 'install', 'assemble', 'maintenance', 'operation']):
-        return "procedure"
-    elif any(word in question_lower for word in ['error', 'fault', 'troubleshoot', 'fix', 'problem', 'alarm', 'diagnose']):
-        return "troubleshooting"
-    elif any(word in question_lower for word in ['spec', 'parameter', 'setting', 'value', 'torque', 'rpm', 'pressure', 'temperature', 'voltage']):
-        return "specification"
-    elif any(word in question_lower for word in ['what is', 'define', 'explain', 'meaning', 'purpose']):
-        return "definition"
-    else:
-        return "general"
+    # First question type with a matching keyword wins
+    for question_type, keywords in QUESTION_TYPE_KEYWORDS.items():
+        if any(word in question_lower for word in keywords):
+            return question_type
+    return "general"
 
-def answer_question(session_id: str, question: str) -> Tuple[str, List[str]]:
-    """Enhanced Q&A for manufacturing manuals"""
-    # Get vector store
-    db = get_vectorstore("manufacturing_manuals")
+def answer_question(session_id: str, question: str) -> Tuple[str, List[str], Dict[str, Any]]:
+    """Enhanced Q&A for manufacturing manuals
     
-    # Enhanced retriever with manufacturing focus
-    retriever = db.as_retriever(
-        search_type="mmr",  # Maximal Marginal Relevance
-        search_kwargs={
-            "k": 6,
-            "score_threshold": 0.5,
-            "fetch_k": 15,
-            "lambda_mult": 0.7
-        }
-    )
+    Raises BudgetExceededError when the session or global budget is used up.
+    """
+    # Near a budget, answer more cheaply: no rewrite call, smaller context, no summary refresh
+    budget = enforce_budget(session_id)
+    degraded = budget["level"] == "degraded"
+    
+    with metered(session_id) as meter:
+        answer, sources, details = _answer_question(session_id, question, degraded)
     
+    details["usage"] = meter.summary()
+    details["budget"] = budget
+    return answer, sources, details
+
+def _answer_question(session_id: str, question: str, degraded: bool) -> Tuple[str, List[str], Dict[str, Any]]:
     # Get conversation history
     history = get_history(session_id)
     
     # Classify question
-    question_type = classify_question(question)
-    print(f"🔍 Question type: {question_type}")
+    with stage_timer("chat", "classify"):
+        question_type = classify_question(question)
+    logger.info("question classified", extra={"question_type": question_type})
     
-    # Query rewriting for better retrieval
-    if history and len(history) > 0:
-        rewrite_prompt = f"""
-        Rewrite this manufacturing question to be standalone and optimized for search.
-        
-        Conversation context (last 2 exchanges):
-        {format_history(history[-4:]) if len(history) >= 4 else "No relevant history"}
-        
-        Current question: {question}
+    # Query rewriting for better retrieval, driven by the compact rolling summary
+    # so the prompt size does not depend on how long earlier answers were
+    if history and len(history) > 0 and not degraded:
+        rewrite_prompt = REWRITE_PROMPT_TEMPLATE.format(
+            context=conversation_context(session_id, history),
+            question=question,
+            question_type=question_type
+        )
         
-        Question type: {question_type}
-        
-        Rewrite to include relevant manufacturing keywords for better document retrieval.
-        Keep it concise and clear.
+        enhanced_question = invoke_llm(prompt_messages(REWRITE_SYSTEM_PROMPT, rewrite_prompt), "rewrite").content
+    else:
+        enhanced_question = question
+    
+    logger.info("standalone question ready", extra={"search_query": enhanced_question, "degraded": degraded})
+    
+    # Identical standalone questions against the same index contents are answered once;
+    # callers that arrive while it is in flight wait for and share that answer. A rewritten
+    # follow-up is first matched against its session's working set, so the key also carries
+    # that set's fingerprint: only sessions holding the same chunks share the answer
+    context_limit = DEGRADED_CONTEXT_CHUNKS if degraded else None
+    collection = get_vectorstore("manufacturing_manuals")._collection.name
+    follow_up = WORKING_SET_ENABLED and normalize_question(enhanced_question) != normalize_question(question)
+    working_set = get_working_sets().fingerprint(session_id, collection) if follow_up else None
+    flight_key = (
+        normalize_question(enhanced_question),
+        question_type,
+        get_collection_version("manufacturing_manuals"),
+        context_limit,
+        working_set
+    )
+    (answer, sources, details), shared = ANSWER_FLIGHTS.do(
+        flight_key,
+        lambda: retrieve_and_answer(enhanced_question, question_type, context_limit,
+                                    session_id=session_id if working_set else None)
+    )
+    if shared:
+        COALESCED_REQUESTS.inc()
+        logger.info("coalesced with in-flight request", extra={"search_query": enhanced_question})
+    
+    if WORKING_SET_ENABLED:
+        try:
+            with stage_timer("chat", "working_set"):
+                remember_chunks(session_id, details.get("documents", []), collection)
+        except Exception:
+            # Only a cache for the next turn; never fail the answer over it
+            logger.exception("working set update failed", extra={"session_id": session_id})
+    
+    # Update history (every session gets its own entry, shared or not)
+    add_to_history(session_id, enhanced_question, answer)
+    
+    # Fold this turn into the rolling summary off the hot path
+    if not degraded:
+        schedule_summary_refresh(session_id, enhanced_question, answer, summarize_conversation)
+    
+    return answer, sources, {key: value for key, value in details.items() if key != "documents"}
+
+def conversation_context(session_id: str, history: List) -> str:
+    """Rolling summary, or the latest user questions until the first summary is ready"""
+    summary = get_summary(session_id)
+    if not summary:
+        recent_questions = [msg.content for msg in history[::2]][-2:]
+        summary = "\n".join(f"User asked: {q}" for q in recent_questions)
+    return truncate_to_tokens(summary, SUMMARY_MAX_TOKENS) or "No relevant history"
+
+def summarize_conversation(previous_summary: str, exchanges: List[Tuple[str, str]]) -> str:
+    """Fold new exchanges into the running summary, capped at SUMMARY_MAX_TOKENS"""
+    turns = "\n".join(
+        f"User: {user}\nAssistant: {truncate_to_tokens(ai, SUMMARY_ANSWER_TOKENS)}"
+        for user, ai in exchanges
+    )
+    prompt = f"""Update the summary of a conversation about manufacturing manuals.
+Keep the equipment, components, fault codes, procedures and values being discussed.
+Drop pleasantries and answer details that are not needed to understand follow-up questions.
+Use at most {SUMMARY_MAX_TOKENS // 2} words.
+
+Current summary:
+{previous_summary or "(none)"}
+
+New exchanges:
+{turns}
+
+Updated summary:"""
+    from .openai_client import use_lane
+    
+    # Background work: never queue ahead of a user's question
+    with use_lane("bulk"):
+        summary = invoke_llm([human_message(prompt)], "summarize", pipeline="memory").content
+    return truncate_to_tokens(summary.strip(), SUMMARY_MAX_TOKENS)
+
+def retrieve_and_answer(enhanced_question: str, question_type: str, context_limit: Optional[int] = None,
+                        session_id: Optional[str] = None) -> Tuple[str, List[str], Dict[str, Any]]:
+    """Retrieve context for a standalone question and generate the answer"""
+    # Get vector store
+    db = get_vectorstore("manufacturing_manuals")
+    
+    # Embed once, then search by vector so the two stages are timed separately;
+    # skipped entirely when an exact term hit answers the question
+    def embed_query() -> List[float]:
+        with stage_timer("chat", "embed"):
+            return db.embeddings.embed_query(enhanced_question)
+    
+    return answer_from_store(db, enhanced_question, question_type, embed_query, context_limit=context_limit,
+                             session_id=session_id)
+
+def answer_from_store(db, enhanced_question: str, question_type: str, embed_query: Callable[[], List[float]],
+                      pipeline: str = "chat", context_limit: Optional[int] = None,
+                      session_id: Optional[str] = None) -> Tuple[str, List[str], Dict[str, Any]]:
+    """Retrieval + generation; embed_query is only called if a vector search is needed"""
+    filtered_docs, depth, safety_notices = retrieve_context(db, enhanced_question, question_type, embed_query,
+                                                            pipeline, context_limit, session_id)
+    
+    # Build context
+    context = build_context(filtered_docs)
+    
+    # Build manufacturing-specific prompt: fixed system message, then context and question
+    system, prompt = build_manufacturing_prompt(context, enhanced_question, question_type,
+                                                safety_notes=format_safety_notices(safety_notices))
+    
+    # Generate answer
+    result = invoke_llm(prompt_messages(system, prompt), "generate", pipeline)
+    answer = result.content
+    
+    prompt_cache = prompt_cache_usage(result)
+    PROMPT_CACHE_TOKENS.inc(prompt_cache["prompt_tokens"], question_type=question_type, kind="prompt")
+    PROMPT_CACHE_TOKENS.inc(prompt_cache["cached_tokens"], question_type=question_type, kind="cached")
+    
+    details = {"question_type": question_type, "retrieval": depth, "safety_notices": safety_notices,
+               "prompt_cache": prompt_cache, "chunk_ids": [doc.id for doc in filtered_docs if doc.id],
+               "documents": filtered_docs}
+    return answer, extract_sources(filtered_docs), details
+
+def retrieve_context(db, enhanced_question: str, question_type: str, embed_query: Callable[[], List[float]],
+                     pipeline: str = "chat", context_limit: Optional[int] = None,
+                     session_id: Optional[str] = None) -> Tuple[List, Dict[str, Any], List[Dict[str, Any]]]:
+    """The retrieval half of an answer: (chunks for the prompt, retrieval depth, safety notices)
+    
+    No LLM call, so scripts/eval_retrieval.py can run it offline. context_limit
+    caps the chunks kept for the prompt (budget degradation); with a session_id
+    the session's working set is tried before the index.
+    """
+    # Sidecar indexes are keyed by the physical collection this handle points at,
+    # so a request stays on one index version even if the alias is swapped meanwhile
+    collection = db._collection.name
+    exact = None
+    if question_type in EXACT_TERM_TYPES:
+        with stage_timer(pipeline, "term_lookup"):
+            exact = lookup_exact_terms(enhanced_question, collection)
+    
+    docs = []
+    # A strong exact hit with few enough chunks to use them all: no embedding call, no vector search
+    if exact and exact["strong"] and len(exact["best"]) <= RETRIEVAL_PROFILES[question_type]["keep"]:
+        with stage_timer(pipeline, "search"):
+            docs, depth = exact_search(db, exact, question_type)
+    
+    if not docs:
+        query_embedding = embed_query()
+        with stage_timer(pipeline, "search"):
+            if session_id is not None:
+                docs, depth = working_set_search(session_id, collection, query_embedding, question_type)
+            if not docs:
+                docs, depth = adaptive_search(db, query_embedding, question_type)
+            # Other exact hits: the closest of them lead, the vector results fill up the rest
+            if exact:
+                docs, depth = merge_exact(db, exact, question_type, query_embedding, docs, depth)
+    
+    if context_limit is not None and depth["context_chunks"] > context_limit:
+        depth = {**depth, "context_chunks": context_limit, "degraded": True}
+    
+    with stage_timer(pipeline, "reorder"):
+        filtered_docs = prioritize_docs(docs, question_type, limit=depth["context_chunks"])
+    
+    # Warnings on the retrieved pages, by direct lookup rather than a bigger k
+    with stage_timer(pipeline, "safety_digest"):
+        safety_notices = safety_notices_for(filtered_docs, collection)
+    
+    return filtered_docs, depth, safety_notices
+
+def answer_questions_batch(questions: List[str], max_concurrency: int = 4,
+                           admit: Optional[Callable[[str], ContextManager]] = None,
+                           session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Answer many standalone questions, yielding each result as soon as it is ready
+    
+    Duplicate questions (after normalization) share one retrieval and answer,
+    all unique questions are embedded in a single batched call, and at most
+    max_concurrency retrieval + LLM calls run at once. No session history is
+    read or written. Each yielded dict carries the question's index in the input.
+    Model calls go through the bulk lane, so /chat is served first.
+    admit(question_type), if given, is entered around each unique question's
+    work, e.g. to take an admission slot (which sets its deadline).
+    
+    Each unique question is checked against the budgets (of session_id, if
+    given, and the global one) before it runs and metered on its own: its
+    result carries "usage" and "budget" like /chat, and a question refused
+    by a budget comes back with "budget_exceeded". Duplicates that share an
+    answer report no usage of their own.
+    """
+    from .openai_client import use_lane
+    
+    start = time.perf_counter()
+    db = get_vectorstore("manufacturing_manuals")
+    
+    # Group duplicates: normalized question → input indexes
+    groups: Dict[str, List[int]] = {}
+    for index, question in enumerate(questions):
+        groups.setdefault(normalize_question(question), []).append(index)
+    unique = [(indexes, questions[indexes[0]]) for indexes in groups.values()]
+    
+    # One call for every question; charged to the session, not to any one question.
+    # Batch work queues behind interactive /chat calls for the OpenAI quota
+    with stage_timer("batch", "embed"), metered(session_id) as embed_meter, use_lane("bulk"):
+        embeddings = db.embeddings.embed_documents([question for _, question in unique])
+    
+    def answer_one(question: str, question_type: str, embedding: List[float]):
+        # Near a budget, answer with less context, as /chat does
+        budget = enforce_budget(session_id)
+        context_limit = DEGRADED_CONTEXT_CHUNKS if budget["level"] == "degraded" else None
+        with admit(question_type) if admit is not None else contextlib.nullcontext():
+            with metered(session_id) as meter, use_lane("bulk"):
+                answer, sources, details = answer_from_store(db, question, question_type, lambda: embedding, "batch",
+                                                             context_limit=context_limit)
+        details["usage"] = meter.summary()
+        details["budget"] = budget
+        return answer, sources, details
+    
+    errors = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+        futures = {}
+        for (indexes, question), embedding in zip(unique, embeddings):
+            question_type = classify_question(question)
+            # The request id (and deadline) follow each question onto the pool thread
+            future = pool.submit(contextvars.copy_context().run, answer_one, question, question_type, embedding)
+            futures[future] = (indexes, question_type)
         
-        Rewritten question:"""
+        for future in as_completed(futures):
+            indexes, question_type = futures[future]
+            try:
+                answer, sources, details = future.result()
+                payload = {"answer": answer, "sources": sources,
+                           **{key: value for key, value in details.items() if key != "documents"}}
+            except Exception as e:
+                errors += len(indexes)
+                payload = {"question_type": question_type, "error": str(e)}
+                if isinstance(e, BudgetExceededError):
+                    payload["budget_exceeded"] = True
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after:
+                    payload["retry_after"] = retry_after
+                    logger.warning("batch question shed", extra={"question": questions[indexes[0]], "reason": str(e)})
+                else:
+                    logger.exception("batch question failed", extra={"question": questions[indexes[0]]})
+            
+            for position, index in enumerate(indexes):
+                item = {"index": index, "question": questions[index], "shared": position > 0, **payload}
+                if position > 0 and "usage" in item:
+                    item["usage"] = None
+                yield item
+    
+    logger.info("batch finished", extra={
+        "questions": len(questions),
+        "unique_questions": len(unique),
+        "errors": errors,
+        "embed_usage": embed_meter.summary(),
+        "elapsed_seconds": round(time.perf_counter() - start, 3)
+    })
+
+def choose_retrieval_depth(question_type: str, scores: List[float]) -> Dict[str, Any]:
+    """Pick k / fetch_k / context size from the question type and probe scores"""
+    profile = RETRIEVAL_PROFILES.get(question_type, RETRIEVAL_PROFILES["general"])
+    depth = {
+        "mode": "standard",
+        "k": profile["k"],
+        "fetch_k": profile["fetch_k"],
+        "context_chunks": profile["keep"],
+        "top_score": round(scores[0], 4) if scores else None,
+        "score_margin": round(scores[0] - scores[1], 4) if len(scores) > 1 else None,
+    }
+    if not scores:
+        return depth
+    
+    margin = scores[0] - scores[1] if len(scores) > 1 else scores[0]
+    spread = scores[0] - scores[-1]
+    
+    # Decisive top hit: answer from the probe, only keeping hits close to the winner
+    if scores[0] >= EARLY_EXIT_MIN_SCORE and margin >= EARLY_EXIT_MARGIN:
+        close = sum(1 for score in scores if score >= scores[0] - EARLY_EXIT_MARGIN)
+        keep = min(profile["keep"], close)
+        depth.update({"mode": "early_exit", "k": keep, "fetch_k": len(scores), "context_chunks": keep})
+    # Flat scores: nothing stands out, so look wider and give the LLM more context
+    elif len(scores) >= PROBE_K and spread < FLAT_SCORE_SPREAD:
+        depth.update({"mode": "widened",
+                      "k": profile["k"] * WIDEN_FACTOR,
+                      "fetch_k": min(MAX_FETCH_K, profile["fetch_k"] * WIDEN_FACTOR),
+                      "context_chunks": profile["keep"] + 1})
+    return depth
+
+def adaptive_search(db, query_embedding: List[float], question_type: str) -> Tuple[List, Dict[str, Any]]:
+    """Probe with a cheap similarity search, then stop early or run MMR at the chosen depth"""
+    index_dimensions = get_index_dimensions(db)
+    if index_dimensions:
+        docs, depth = two_stage_search(db, query_embedding, question_type, index_dimensions)
+    else:
+        # Chroma returns distances here; compare on cosine similarity instead
+        probe = db.similarity_search_by_vector_with_relevance_scores(query_embedding, k=PROBE_K)
+        space = get_collection_space(db)
+        scores = [distance_to_similarity(distance, space) for _, distance in probe]
+        depth = choose_retrieval_depth(question_type, scores)
         
-        enhanced_question = llm.invoke([HumanMessage(content=rewrite_prompt)]).content
+        if depth["mode"] == "early_exit":
+            docs = [doc for doc, _ in probe[:depth["k"]]]
+        else:
+            docs = db.max_marginal_relevance_search_by_vector(
+                query_embedding,
+                k=depth["k"],
+                fetch_k=depth["fetch_k"],
+                lambda_mult=MMR_LAMBDA_MULT
+            )
+    
+    RETRIEVAL_DECISIONS.inc(question_type=question_type, mode=depth["mode"])
+    CONTEXT_CHUNKS.observe(depth["context_chunks"], question_type=question_type)
+    logger.info("retrieval depth chosen", extra={"retrieval": depth})
+    return docs, depth
+
+def two_stage_search(db, query_embedding: List[float], question_type: str,
+                     index_dimensions: int) -> Tuple[List, Dict[str, Any]]:
+    """Shortlist on the shortened index, re-score the shortlist on full vectors, then probe/MMR as usual
+    
+    One small-index query (ids only) replaces the probe and MMR queries; the
+    full vectors of SHORTLIST_CANDIDATES chunks come from app/full_vectors.py
+    and only the chunks finally picked are fetched from Chroma.
+    """
+    from langchain_core.documents import Document
+    from langchain_chroma.vectorstores import maximal_marginal_relevance
+    import numpy as np
+    
+    ids = db._collection.query(
+        query_embeddings=shorten([query_embedding], index_dimensions).tolist(),
+        n_results=SHORTLIST_CANDIDATES,
+        include=[]
+    )["ids"][0]
+    full = get_full_vectors().get(db._collection.name, ids)
+    ids = [chunk_id for chunk_id in ids if chunk_id in full]
+    
+    query = np.asarray(query_embedding, dtype=np.float32)
+    vectors = np.asarray([full[chunk_id] for chunk_id in ids], dtype=np.float32).reshape(len(ids), len(query))
+    similarity = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-12)
+    order = [int(i) for i in np.argsort(-similarity, kind="stable")]
+    
+    depth = choose_retrieval_depth(question_type, [float(similarity[i]) for i in order[:PROBE_K]])
+    depth.update({"index_dimensions": index_dimensions, "candidates": len(ids)})
+    if depth["mode"] == "early_exit":
+        picked = order[:depth["k"]]
     else:
-        enhanced_question = question
+        pool = order[:depth["fetch_k"]]
+        selected = maximal_marginal_relevance(
+            query, vectors[pool], lambda_mult=MMR_LAMBDA_MULT, k=min(depth["k"], len(pool))
+        ) if pool else []
+        # Keep similarity order among the MMR picks, like Chroma's MMR search does
+        picked = [pool[i] for i in sorted(selected)]
+    
+    picked_ids = [ids[i] for i in picked]
+    found = db._collection.get(ids=picked_ids, include=["documents", "metadatas"]) if picked_ids else {"ids": []}
+    position = {chunk_id: i for i, chunk_id in enumerate(found["ids"])}
+    docs = [
+        Document(page_content=found["documents"][position[chunk_id]], metadata=found["metadatas"][position[chunk_id]] or {},
+                 id=chunk_id)
+        for chunk_id in picked_ids if chunk_id in position
+    ]
+    return docs, depth
+
+def working_set_search(session_id: str, collection: str, query_embedding: List[float],
+                       question_type: str) -> Tuple[List, Optional[Dict[str, Any]]]:
+    """The session's recent chunks close to the question, or ([], None) if the best local match is weak"""
+    working_sets = get_working_sets()
+    scored = working_sets.search(session_id, collection, query_embedding)
+    if not scored:
+        return [], None
+    
+    top_score = scored[0][2]
+    hit = top_score >= WORKING_SET_MIN_SCORE
+    working_sets.record(hit)
+    WORKING_SET_LOOKUPS.inc(result="hit" if hit else "miss")
+    if not hit:
+        logger.info("working set match too weak, searching the index", extra={"top_score": round(top_score, 4)})
+        return [], None
+    
+    profile = RETRIEVAL_PROFILES.get(question_type, RETRIEVAL_PROFILES["general"])
+    docs = [doc for _, doc, score in scored if score >= top_score - WORKING_SET_MARGIN][:profile["k"]]
+    depth = {
+        "mode": "working_set",
+        "k": len(docs),
+        "fetch_k": len(scored),
+        "context_chunks": min(len(docs), profile["keep"]),
+        "top_score": round(top_score, 4),
+        "score_margin": round(top_score - scored[1][2], 4) if len(scored) > 1 else None,
+    }
+    RETRIEVAL_DECISIONS.inc(question_type=question_type, mode=depth["mode"])
+    CONTEXT_CHUNKS.observe(depth["context_chunks"], question_type=question_type)
+    logger.info("retrieval depth chosen", extra={"retrieval": depth})
+    return docs, depth
+
+def remember_chunks(session_id: str, docs: List, collection: str):
+    """Add the chunks an answer used to the session's working set
+    
+    The Documents come from the answer's own search; only the vectors of
+    chunks the set lacks are loaded, on a background worker, so the answer
+    never waits on the index for them.
+    """
+    chunk_ids = [doc.id for doc in docs if doc.id]
+    if not chunk_ids:
+        return
+    working_sets = get_working_sets()
+    missing = working_sets.missing(session_id, collection, chunk_ids)
+    if not missing:
+        working_sets.remember(session_id, collection, chunk_ids, {})
+        return
+    
+    new_docs = {doc.id: doc for doc in docs if doc.id in set(missing)}
+    # One worker keeps a session's updates in order; no deadline, it is not the request's work
+    context = contextvars.copy_context()
+    context.run(REQUEST_DEADLINE.set, None)
+    _WORKING_SET_EXECUTOR.submit(context.run, _load_working_set_chunks, session_id, collection, chunk_ids, new_docs)
+
+def _load_working_set_chunks(session_id: str, collection: str, chunk_ids: List[str], new_docs: Dict[str, Any]):
+    try:
+        db = get_vectorstore(collection)
+        # Scored at full precision, like the index's candidates
+        if get_index_dimensions(db):
+            vector_of = get_full_vectors().get(collection, list(new_docs))
+        else:
+            found = db._collection.get(ids=list(new_docs), include=["embeddings"])
+            vector_of = dict(zip(found["ids"], found["embeddings"]))
+        new_chunks = {chunk_id: (doc, vector_of[chunk_id]) for chunk_id, doc in new_docs.items() if chunk_id in vector_of}
+        get_working_sets().remember(session_id, collection, chunk_ids, new_chunks)
+    except Exception:
+        logger.exception("working set update failed", extra={"session_id": session_id})
+
+def lookup_exact_terms(question: str, collection: str = "manufacturing_manuals") -> Optional[Dict[str, Any]]:
+    """Chunks sharing exact codes / part numbers / specs with the question, or None
+    
+    "strong" marks hits that can stand in for a vector search: the best chunks
+    contain every term the question names, including a code or part number
+    (a value with a unit or a thread size alone is too common to settle a
+    question, so those only narrow the vector results).
+    """
+    terms = extract_terms(question)
+    if not terms:
+        return None
+    hits = get_term_index().lookup(collection, terms)
+    if not hits:
+        return None
+    ranked = rank_candidates(hits)
+    if len(ranked) > EXACT_MAX_CANDIDATES:
+        logger.info("exact terms too common, using vector search", extra={"terms": sorted(hits), "candidates": len(ranked)})
+        return None
+    best_count = ranked[0][1]
+    return {
+        "terms": sorted(hits),
+        "ranked": ranked,
+        "best": [chunk_id for chunk_id, count in ranked if count == best_count],
+        "strong": best_count == len(terms) and any(terms[term] in ("code", "part") for term in hits),
+    }
+
+def exact_search(db, exact: Dict[str, Any], question_type: str) -> Tuple[List, Dict[str, Any]]:
+    """All the best chunks of a strong exact term hit"""
+    profile = RETRIEVAL_PROFILES[question_type]
+    docs = exact_docs(db, exact, question_type)
+    depth = {
+        "mode": "exact",
+        "k": len(docs),
+        "fetch_k": len(exact["best"]),
+        "context_chunks": min(len(docs), profile["keep"]),
+        "terms": exact["terms"],
+        "top_score": None,
+        "score_margin": None,
+    }
+    RETRIEVAL_DECISIONS.inc(question_type=question_type, mode=depth["mode"])
+    CONTEXT_CHUNKS.observe(depth["context_chunks"], question_type=question_type)
+    logger.info("retrieval depth chosen", extra={"retrieval": depth})
+    return docs, depth
+
+def merge_exact(db, exact: Dict[str, Any], question_type: str, query_embedding: List[float],
+                docs: List, depth: Dict[str, Any]) -> Tuple[List, Dict[str, Any]]:
+    """Exact term hits (closest keep of them) ahead of the vector results, without duplicates"""
+    profile = RETRIEVAL_PROFILES[question_type]
+    exact_hits = exact_docs(db, exact, question_type, query_embedding)[:profile["keep"]]
+    seen = {doc.id for doc in exact_hits}
+    merged = exact_hits + [doc for doc in docs if doc.id not in seen]
+    merged_depth = {
+        **depth,
+        "mode": "exact_merged",
+        "vector_mode": depth["mode"],
+        "k": len(merged),
+        "context_chunks": min(len(merged), max(depth["context_chunks"], len(exact_hits))),
+        "terms": exact["terms"],
+        "exact_chunks": len(exact_hits),
+    }
+    RETRIEVAL_DECISIONS.inc(question_type=question_type, mode=merged_depth["mode"])
+    logger.info("exact hits merged with vector results", extra={"retrieval": merged_depth})
+    return merged, merged_depth
+
+def exact_docs(db, exact: Dict[str, Any], question_type: str,
+               query_embedding: Optional[List[float]] = None) -> List:
+    """Chunks from an exact term hit: all the best ones, or the closest k when a query embedding is given"""
+    from langchain_core.documents import Document
+    import numpy as np
     
-    print(f"🔍 Searching for: {enhanced_question}")
+    profile = RETRIEVAL_PROFILES[question_type]
+    index_dimensions = get_index_dimensions(db)
+    chunk_ids = exact["best"] if query_embedding is None else [chunk_id for chunk_id, _ in exact["ranked"]]
+    with_embeddings = query_embedding is not None and not index_dimensions
+    include = ["documents", "metadatas"] + (["embeddings"] if with_embeddings else [])
+    found = db._collection.get(ids=chunk_ids, include=include)
     
-    # Retrieve documents
-    docs = retriever.invoke(enhanced_question)
+    # Chroma does not keep the requested order
+    position = {chunk_id: i for i, chunk_id in enumerate(found["ids"])}
+    order = [chunk_id for chunk_id in chunk_ids if chunk_id in position]
+    if query_embedding is not None and order:
+        # Compare on full vectors; a shortened index keeps them in the side store
+        if index_dimensions:
+            vector_of = get_full_vectors().get(db._collection.name, order)
+            order = [chunk_id for chunk_id in order if chunk_id in vector_of]
+        else:
+            vector_of = {chunk_id: found["embeddings"][position[chunk_id]] for chunk_id in order}
+        
+        # More matched terms first, then by similarity to the question
+        matched = dict(exact["ranked"])
+        vectors = np.asarray([vector_of[chunk_id] for chunk_id in order], dtype=np.float32).reshape(len(order), len(query_embedding))
+        query = np.asarray(query_embedding, dtype=np.float32)
+        similarity = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-12)
+        score = {chunk_id: similarity[i] for i, chunk_id in enumerate(order)}
+        order.sort(key=lambda chunk_id: (-matched[chunk_id], -score[chunk_id]))
+        order = order[:profile["k"]]
     
+    return [
+        Document(page_content=found["documents"][position[chunk_id]], metadata=found["metadatas"][position[chunk_id]] or {},
+                 id=chunk_id)
+        for chunk_id in order
+    ]
+
+def prioritize_docs(docs: List, question_type: str, limit: int = 4) -> List:
+    """Reorder retrieved chunks by manufacturing priority and keep the top ones"""
     # Priority filtering for manufacturing
     filtered_docs = []
     for doc in docs:
@@ -99,10 +837,11 @@ def answer_question(session_id: str, question: str) -> Tuple[str, List[str]]:
         else:
             filtered_docs.append(doc)
     
-    # Take top 4 most relevant
-    filtered_docs = filtered_docs[:4]
-    
-    # Build context
+    # Take top N most relevant
+    return filtered_docs[:limit]
+
+def build_context(filtered_docs: List) -> str:
+    """Format retrieved chunks with their source/page for the prompt"""
     context_parts = []
     for i, doc in enumerate(filtered_docs):
         source_info = []
@@ -113,20 +852,12 @@ def answer_question(session_id: str, question: str) -> Tuple[str, List[str]]:
         
         source_str = f"[{', '.join(source_info)}]" if source_info else ""
         
-        context_parts.append(f"""
-        DOCUMENT {i+1} {source_str}:
-        {doc.page_content}
-        """)
-    
-    context = "\n---\n".join(context_parts)
-    
-    # Build manufacturing-specific prompt
-    prompt = build_manufacturing_prompt(context, enhanced_question, question_type)
-    
-    # Generate answer
-    answer = llm.invoke([HumanMessage(content=prompt)]).content
+        context_parts.append(CONTEXT_BLOCK_TEMPLATE.format(number=i + 1, source=source_str, content=doc.page_content))
     
-    # Extract sources
+    return "\n---\n".join(context_parts)
+
+def extract_sources(filtered_docs: List) -> List[str]:
+    """Unique "source (page N)" strings for the response"""
     sources = []
     seen = set()
     for doc in filtered_docs:
@@ -138,10 +869,7 @@ def answer_question(session_id: str, question: str) -> Tuple[str, List[str]]:
                 sources.append(source_str)
                 seen.add(source_str)
     
-    # Update history
-    add_to_history(session_id, enhanced_question, answer)
-    
-    return answer, sources[:3]  # Return top 3 unique sources
+    return sources[:3]  # Return top 3 unique sources
 
 def format_history(history: List) -> str:
     """Format conversation history"""
@@ -153,76 +881,23 @@ def format_history(history: List) -> str:
             formatted.append(f"Assistant: {msg.content}")
     return "\n".join(formatted)
 
-def build_manufacturing_prompt(context: str, question: str, q_type: str) -> str:
-    """Build specialized prompt for manufacturing Q&A"""
-    
-    # Type-specific instructions
-    instructions = {
-        "safety": """
-        CRITICAL SAFETY INSTRUCTIONS:
-        - Always start with safety warnings if present
-        - List ALL safety precautions mentioned
-        - Use clear warning symbols ⚠️ for dangers
-        - Be explicit about risks and consequences
-        - Never omit or minimize safety information
-        """,
-        "procedure": """
-        PROCEDURE INSTRUCTIONS:
-        - List steps in exact numerical order
-        - Include required tools and materials
-        - Mention safety steps before procedure steps
-        - Include verification/check steps
-        - Be precise with measurements and settings
-        """,
-        "troubleshooting": """
-        TROUBLESHOOTING INSTRUCTIONS:
-        - List possible causes from most to least likely
-        - Include diagnostic steps to identify the issue
-        - Provide clear resolution steps
-        - Mention any required tools or parts
-        - State when professional help is needed
-        """,
-        "specification": """
-        SPECIFICATION INSTRUCTIONS:
-        - Provide exact values with units
-        - Include acceptable ranges if specified
-        - Mention measurement conditions if relevant
-        - Reference the exact source document
-        """,
-        "definition": """
-        DEFINITION INSTRUCTIONS:
-        - Provide clear, concise definitions
-        - Include context from the manual
-        - Mention related terms if applicable
-        - Reference the source document
-        """
-    }
-    
-    type_instructions = instructions.get(q_type, """
-    GENERAL INSTRUCTIONS:
-    - Be precise and technical
-    - Include specific values when available
-    - Cite the source document for key information
-    - If information is incomplete, state what's missing
-    """)
-    
-    prompt = f"""You are a manufacturing automation expert answering questions from technical manuals.
-
-{type_instructions}
-
-CONTEXT FROM TECHNICAL MANUALS:
-{context}
-
-QUESTION: {question}
-
-ANSWER GUIDELINES:
-1. Answer based ONLY on the context provided
-2. If the context doesn't contain the answer, say: "I don't have that specific information in the available manuals."
-3. For safety questions, always start with safety warnings
-4. For procedures, use numbered lists
-5. Be concise but complete
-6. Reference which document(s) you're using (e.g., "Based on Document 1...")
+def format_safety_notices(notices: List[Dict[str, Any]]) -> str:
+    """Safety digest blocks as prompt lines tagged with their page and section"""
+    lines = []
+    for notice in notices:
+        location = f"page {notice['page']}" + (f", {notice['section']}" if notice["section"] else "")
+        # A shortened block sends the reader to the page for the rest of it
+        note = " (shortened; read the full warning on that page)" if notice.get("truncated") else ""
+        lines.append(f"- [{notice['source']}, {location}] {notice['text']}{note}")
+    return "\n".join(lines)
 
-ANSWER:"""
+def build_manufacturing_prompt(context: str, question: str, q_type: str, safety_notes: str = "") -> Tuple[str, str]:
+    """(system, user) prompt for manufacturing Q&A
     
-    return prompt
\ No newline at end of file
+    The system message depends only on the question type, so it is a
+    byte-identical prefix across requests; it is too short for the
+    provider's prompt cache (see PROVIDER_PROMPT_CACHE_MIN_TOKENS).
+    """
+    safety_section = SAFETY_SECTION_TEMPLATE.format(safety_notes=safety_notes) if safety_notes else ""
+    user = ANSWER_PROMPT_TEMPLATE.format(context=context, safety_section=safety_section, question=question)
+    return SYSTEM_PROMPTS.get(q_type, SYSTEM_PROMPTS["general"]), user
@@ -1,38 +1,61 @@
-import boto3
 import os
+import sqlite3
 import tempfile
-from botocore.exceptions import ClientError
+import threading
+import time
 import uuid
+from typing import Dict
 
 AWS_REGION = os.getenv("AWS_REGION")
 BUCKET ="gautam-rag-pdf-storage"
 
-s3 = boto3.client(
-    "s3",
-    region_name=os.getenv("AWS_REGION", "ap-south-1"),
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
-)
+# S3 keys ingested so far, so index rebuilds (app/index_builds.py) can re-ingest them:
+# unlike uploads, they are never kept in data/uploads
+S3_SOURCES_DB = os.getenv("S3_SOURCES_DB", "data/s3_sources.db")
+_sources_db = None
+_sources_lock = threading.Lock()
+
+# boto3 client is created on first use, not at import
+_s3 = None
+_s3_lock = threading.Lock()
+
+def get_s3_client():
+    """Shared boto3 S3 client, created on first use"""
+    global _s3
+    if _s3 is None:
+        with _s3_lock:
+            if _s3 is None:
+                import boto3
+                _s3 = boto3.client(
+                    "s3",
+                    region_name=os.getenv("AWS_REGION", "ap-south-1"),
+                    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+                )
+    return _s3
 
 def upload_file_to_s3(local_path: str, s3_key: str):
+    from botocore.exceptions import ClientError
     try:
-        s3.upload_file(local_path, BUCKET, s3_key)
+        get_s3_client().upload_file(local_path, BUCKET, s3_key)
         return f"s3://{BUCKET}/{s3_key}"
     except ClientError as e:
         raise RuntimeError(f"S3 upload failed: {e}")
 
 def download_file_from_s3(s3_key: str, local_path: str):
+    from botocore.exceptions import ClientError
     try:
-        s3.download_file(BUCKET, s3_key, local_path)
+        get_s3_client().download_file(BUCKET, s3_key, local_path)
     except ClientError as e:
         raise RuntimeError(f"S3 download failed: {e}")
 
 def generate_presigned_url(filename: str, content_type: str):
     """Generate presigned URL for direct frontend upload"""
+    from botocore.exceptions import ClientError
     s3_key = f"uploads/{uuid.uuid4()}_{filename}"
     
     try:
-        presigned_url = s3.generate_presigned_url(
+        presigned_url = get_s3_client().generate_presigned_url(
             ClientMethod='put_object',
             Params={
                 'Bucket': BUCKET,
@@ -50,8 +73,44 @@ def generate_presigned_url(filename: str, content_type: str):
     except ClientError as e:
         raise RuntimeError(f"Failed to generate presigned URL: {e}")
 
-def ingest_from_s3(s3_key: str):
-    """Download from S3 and process"""
+def _get_sources_db():
+    global _sources_db
+    if _sources_db is None:
+        os.makedirs(os.path.dirname(S3_SOURCES_DB) or ".", exist_ok=True)
+        _sources_db = sqlite3.connect(S3_SOURCES_DB, timeout=30, check_same_thread=False)
+        _sources_db.execute("PRAGMA journal_mode=WAL")
+        _sources_db.execute("CREATE TABLE IF NOT EXISTS s3_sources (s3_key TEXT PRIMARY KEY, recorded_at REAL NOT NULL)")
+        _sources_db.commit()
+    return _sources_db
+
+def record_s3_source(s3_key: str) -> float:
+    """Remember an ingested key; returns its marker (changes on every re-ingest)"""
+    recorded_at = time.time()
+    with _sources_lock:
+        db = _get_sources_db()
+        with db:
+            db.execute("INSERT OR REPLACE INTO s3_sources VALUES (?, ?)", (s3_key, recorded_at))
+    return recorded_at
+
+def forget_s3_source(s3_key: str, recorded_at: float):
+    """Undo record_s3_source, unless the key was recorded again since"""
+    with _sources_lock:
+        db = _get_sources_db()
+        with db:
+            db.execute("DELETE FROM s3_sources WHERE s3_key = ? AND recorded_at = ?", (s3_key, recorded_at))
+
+def list_s3_sources() -> Dict[str, float]:
+    """s3 key → marker of its latest ingest"""
+    with _sources_lock:
+        return dict(_get_sources_db().execute("SELECT s3_key, recorded_at FROM s3_sources"))
+
+def ingest_from_s3(s3_key: str, collection_name: str = "manufacturing_manuals", record: bool = True):
+    """Download from S3 and process
+    
+    Recorded before ingesting (like an upload is saved first), so a rebuild
+    running meanwhile picks the key up; forgotten again if the ingest fails.
+    """
+    recorded_at = record_s3_source(s3_key) if record else None
     try:
         # Create a temporary file
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
@@ -60,14 +119,17 @@ def ingest_from_s3(s3_key: str):
         # Download from S3
         download_file_from_s3(s3_key, tmp_path)
         
-        # Process the file
+        # Process the file; chunks are named after the object, not the temp file
         from .ingestion import ingest_pdf
-        chunks_added, chunk_types = ingest_pdf(tmp_path)
-        
-        # Cleanup
-        os.unlink(tmp_path)
+        try:
+            chunks_added, chunk_types, embedding = ingest_pdf(tmp_path, collection_name, source=f"s3://{BUCKET}/{s3_key}")
+        finally:
+            # Cleanup
+            os.unlink(tmp_path)
         
-        return chunks_added, chunk_types
+        return chunks_added, chunk_types, embedding
         
     except Exception as e:
+        if recorded_at is not None:
+            forget_s3_source(s3_key, recorded_at)
         raise RuntimeError(f"Failed to ingest from S3: {str(e)}") 
\ No newline at end of file
@@ -0,0 +1,230 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from .tokens import count_tokens, truncate_to_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SAFETY_DIGEST_DB = os.getenv("SAFETY_DIGEST_DB", "data/safety_digest.db")
+# Per answer. Blocks are never cut: ones that do not fit are left out, least severe first
+SAFETY_DIGEST_MAX_TOKENS = int(os.getenv("SAFETY_DIGEST_MAX_TOKENS", "240"))
+SAFETY_DIGEST_MAX_BLOCKS = int(os.getenv("SAFETY_DIGEST_MAX_BLOCKS", "3"))
+
+SEVERITY = {"danger": 0, "warning": 1, "caution": 2}
+SEVERITY_PATTERN = re.compile(r'\s*(DANGER|WARNING|CAUTION)\b', re.IGNORECASE)
+
+# Section headings: "4.2 Spindle Maintenance" or an all-caps line such as "HYDRAULIC UNIT"
+HEADING_PATTERN = re.compile(r'^(?:\d+(?:\.\d+)*\.?\s+[A-Z][^\n]{2,80}|[A-Z][A-Z0-9 /&-]{3,60})$', re.MULTILINE)
+
+
+def find_section(text: str, position: int) -> str:
+    """Nearest heading above position in a page's text ("" if none)"""
+    section = ""
+    for match in HEADING_PATTERN.finditer(text, 0, position):
+        section = match.group(0).strip()
+    return section
+
+
+def clip_to_sentences(text: str, max_tokens: int) -> str:
+    """text cut after its last full sentence or line within max_tokens and marked "…" (whole if it fits)"""
+    clipped = truncate_to_tokens(text, max_tokens)
+    if clipped == text:
+        return text
+    end = max(clipped.rfind(". "), clipped.rfind("\n"))
+    if end > len(clipped) // 2:
+        clipped = clipped[:end + 1]
+    return clipped.rstrip() + " …"
+
+
+def severity(text: str) -> int:
+    """0 for DANGER, 1 for WARNING, 2 for CAUTION, 3 for anything else"""
+    match = SEVERITY_PATTERN.match(text)
+    return SEVERITY[match.group(1).lower()] if match else len(SEVERITY)
+
+
+class SafetyDigest:
+    """Safety blocks keyed by (source, page, section) for direct per-page lookup
+
+    Stored in SQLite and served from an in-memory dict, refreshed when
+    another process writes (PRAGMA data_version). Like app/term_index.py,
+    new rows are read past a rowid watermark and only a removal reloads
+    everything.
+    """
+
+    def __init__(self, db_path: str = SAFETY_DIGEST_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # (collection, source, page) → chunk id → block, in rowid order
+        self._pages: Dict[Tuple[str, str, int], Dict[str, Dict[str, Any]]] = {}
+        # (collection, chunk id) → its page key, so a replaced block leaves its old page
+        self._locations: Dict[Tuple[str, str], Tuple[str, str, int]] = {}
+        self._data_version = None
+        self._rowid = 0          # highest safety_blocks rowid loaded into the dict
+        self._removals = None    # removal counter the dict reflects
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        # One connection, always used under self._lock: data_version is per connection
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS safety_blocks ("
+            "collection TEXT NOT NULL, chunk_id TEXT NOT NULL, source TEXT NOT NULL, page INTEGER NOT NULL, "
+            "section TEXT NOT NULL, text TEXT NOT NULL, PRIMARY KEY (collection, chunk_id))"
+        )
+        # Bumped with every removal: deleted rows leave nothing behind for a watermark to see
+        self._db.execute("CREATE TABLE IF NOT EXISTS safety_digest_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.execute("INSERT OR IGNORE INTO safety_digest_meta VALUES ('removals', 0)")
+        self._db.commit()
+
+    def _refresh(self):
+        """Bring the dict up to date when the database changed (e.g. another worker ingested)"""
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        removals = self._db.execute("SELECT value FROM safety_digest_meta WHERE key = 'removals'").fetchone()[0]
+        if removals != self._removals:
+            self._pages, self._locations, self._rowid = {}, {}, 0
+        self._load_new_rows()
+        self._data_version = version
+        self._removals = removals
+
+    def _load_new_rows(self):
+        rows = self._db.execute(
+            "SELECT rowid, collection, chunk_id, source, page, section, text FROM safety_blocks "
+            "WHERE rowid > ? ORDER BY rowid", (self._rowid,)
+        )
+        for rowid, collection, chunk_id, source, page, section, text in rows:
+            # INSERT OR REPLACE gives a replaced block a new rowid
+            previous = self._locations.get((collection, chunk_id))
+            if previous is not None:
+                self._pages[previous].pop(chunk_id, None)
+            key = (collection, source, page)
+            self._pages.setdefault(key, {})[chunk_id] = {
+                "chunk_id": chunk_id, "source": source, "page": page, "section": section, "text": text
+            }
+            self._locations[(collection, chunk_id)] = key
+            self._rowid = rowid
+
+    def add(self, collection: str, blocks: Iterable[Tuple[str, str, int, str, str]]) -> int:
+        """Store (chunk_id, source, page, section, text) blocks, whole"""
+        rows = [
+            (collection, chunk_id, source, int(page), section, text)
+            for chunk_id, source, page, section, text in blocks
+        ]
+        if not rows:
+            return 0
+        with self._lock:
+            self._refresh()
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO safety_blocks VALUES (?, ?, ?, ?, ?, ?)", rows)
+            # Our own commits do not change data_version, so read them past the watermark now
+            self._load_new_rows()
+        return len(rows)
+
+    def lookup(self, collection: str, pages: Iterable[Tuple[str, int]], exclude_texts: Iterable[str] = (),
+               exclude_chunk_ids: Iterable[str] = (), limit: int = SAFETY_DIGEST_MAX_BLOCKS,
+               max_tokens: int = SAFETY_DIGEST_MAX_TOKENS) -> List[Dict[str, Any]]:
+        """Whole safety blocks on the given (source, page) pairs, most severe first, then in page order
+
+        Blocks with an excluded text or chunk id are skipped. Blocks after
+        the first are added only while they fit in max_tokens, so warnings
+        are not cut off mid-sentence. A first block longer than the whole
+        budget is shortened to its last full sentence and marked truncated,
+        pointing the reader to its page.
+        """
+        excluded_texts, excluded_ids = set(exclude_texts), set(exclude_chunk_ids)
+        with self._lock:
+            self._refresh()
+            candidates = [
+                block
+                for source, page in pages
+                for block in self._pages.get((collection, source, page), {}).values()
+                if block["chunk_id"] not in excluded_ids and block["text"] not in excluded_texts
+            ]
+            candidates.sort(key=lambda block: severity(block["text"]))  # stable: page order within a severity
+            blocks, used = [], 0
+            for block in candidates:
+                if len(blocks) >= limit:
+                    break
+                if "tokens" not in block:
+                    block["tokens"] = count_tokens(block["text"])
+                if blocks and used + block["tokens"] > max_tokens:
+                    continue
+                notice = {key: value for key, value in block.items() if key != "tokens"}
+                if block["tokens"] > max_tokens:
+                    notice.update(text=clip_to_sentences(block["text"], max_tokens), truncated=True)
+                blocks.append(notice)
+                used += block["tokens"]
+        return blocks
+
+    def remove(self, collection: str, chunk_ids: List[str]):
+        with self._lock:
+            with self._db:
+                for offset in range(0, len(chunk_ids), 500):
+                    batch = chunk_ids[offset:offset + 500]
+                    self._db.execute(
+                        f"DELETE FROM safety_blocks WHERE collection = ? AND chunk_id IN ({','.join('?' * len(batch))})",
+                        [collection, *batch]
+                    )
+                self._count_removal()
+            self._data_version = None
+
+    def clear(self, collection: str):
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM safety_blocks WHERE collection = ?", (collection,))
+                self._count_removal()
+            self._data_version = None
+
+    def _count_removal(self):
+        self._db.execute("UPDATE safety_digest_meta SET value = value + 1 WHERE key = 'removals'")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._refresh()
+            return {
+                "pages": sum(1 for blocks in self._pages.values() if blocks),
+                "blocks": sum(len(blocks) for blocks in self._pages.values()),
+            }
+
+
+_SAFETY_DIGEST: Optional[SafetyDigest] = None
+_SAFETY_DIGEST_LOCK = threading.Lock()
+
+
+def get_safety_digest() -> SafetyDigest:
+    """Process-wide safety digest, opened on first use"""
+    global _SAFETY_DIGEST
+    if _SAFETY_DIGEST is None:
+        with _SAFETY_DIGEST_LOCK:
+            if _SAFETY_DIGEST is None:
+                _SAFETY_DIGEST = SafetyDigest(SAFETY_DIGEST_DB)
+    return _SAFETY_DIGEST
+
+
+def safety_notices_for(docs: List, collection: str = "manufacturing_manuals") -> List[Dict[str, Any]]:
+    """Safety blocks for the pages of the retrieved chunks, minus those already retrieved"""
+    pages = []
+    for doc in docs:
+        if "source" in doc.metadata and "page" in doc.metadata:
+            key = (doc.metadata["source"], int(doc.metadata["page"]))
+            if key not in pages:
+                pages.append(key)
+    if not pages:
+        return []
+    retrieved_safety = [doc for doc in docs if doc.metadata.get("chunk_type") == "safety"]
+    blocks = get_safety_digest().lookup(
+        collection, pages,
+        exclude_texts=[doc.page_content for doc in retrieved_safety],
+        exclude_chunk_ids=[doc.id for doc in retrieved_safety if doc.id]
+    )
+    for block in blocks:
+        block.pop("chunk_id", None)
+    return blocks
@@ -5,6 +5,9 @@ class IngestResponse(BaseModel):
     status: str
     chunks_added: int
     chunk_types: Dict[str, int] = {}
+    embedding: Optional[Dict[str, Any]] = None  # Throughput: chunks_per_sec, tokens_per_sec, batches, ...
+    usage: Optional[Dict[str, Any]] = None  # Tokens and estimated cost of the model calls, by model
+    profile: Optional[Dict[str, Any]] = None  # Profile summary, when an admin sent X-Profile
     message: Optional[str] = None
 
 class ChatRequest(BaseModel):
@@ -17,7 +20,22 @@ class ChatResponse(BaseModel):
     sources: List[str]
     question_type: Optional[str] = None  # For debugging
     context_used: Optional[int] = None   # Number of chunks used
+    retrieval: Optional[Dict[str, Any]] = None  # Chosen retrieval depth (mode, k, fetch_k, ...)
+    safety_notices: List[Dict[str, Any]] = []  # Safety blocks on the retrieved pages (source, page, section, text[, truncated])
+    usage: Optional[Dict[str, Any]] = None  # Tokens and estimated cost of this turn's model calls, by model
+    budget: Optional[Dict[str, Any]] = None  # Service level (ok / degraded) and spend against the budgets
+    prompt_cache: Optional[Dict[str, int]] = None  # Answer prompt tokens, and how many came from the provider's cache
+    profile: Optional[Dict[str, Any]] = None  # Profile summary, when an admin sent X-Profile
     
+class BatchQuestion(BaseModel):
+    question: str
+    id: Optional[str] = None  # Echoed back so clients can match streamed results
+
+class BatchChatRequest(BaseModel):
+    questions: List[BatchQuestion]
+    max_concurrency: Optional[int] = None  # Concurrent LLM calls, capped server-side
+    session_id: Optional[str] = None  # Budget and usage are charged per question to this session
+
 class ClearHistoryRequest(BaseModel):
     session_id: str
 
@@ -0,0 +1,495 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class Turn:
+    """One user/assistant exchange stored as plain strings"""
+    __slots__ = ("user", "ai")
+
+    def __init__(self, user: str, ai: str):
+        self.user = user
+        self.ai = ai
+
+
+class SessionRecord:
+    __slots__ = ("turns", "summary", "last_access", "nbytes")
+
+    def __init__(self):
+        self.turns: List[Turn] = []
+        self.summary = ""
+        self.last_access = time.monotonic()
+        self.nbytes = 0
+
+
+def _turn_size(turn: Turn) -> int:
+    return sys.getsizeof(turn) + sys.getsizeof(turn.user) + sys.getsizeof(turn.ai)
+
+
+def _record_size(record: SessionRecord, session_id: str) -> int:
+    """Bytes held by a session: key, record, turn list, turns, strings and summary"""
+    return (
+        sys.getsizeof(session_id)
+        + sys.getsizeof(record)
+        + sys.getsizeof(record.turns)
+        + sum(_turn_size(turn) for turn in record.turns)
+        + sys.getsizeof(record.summary)
+    )
+
+
+class SessionStore:
+    """Session backend interface used by app/memory.py"""
+
+    def get_turns(self, session_id: str) -> List[Tuple[str, str]]:
+        raise NotImplementedError
+
+    def append(self, session_id: str, user: str, ai: str):
+        """Atomically append one exchange and trim to max_turns"""
+        raise NotImplementedError
+
+    def clear(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+    def get_summary(self, session_id: str) -> str:
+        raise NotImplementedError
+
+    def set_summary(self, session_id: str, summary: str, expected: Optional[str] = None) -> bool:
+        """Store a summary; False if the session is gone or (with expected) the summary has changed since"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """Per-process session store with idle-TTL and max-sessions / max-bytes LRU eviction"""
+
+    def __init__(self, max_turns: int = 10, max_sessions: int = 10000,
+                 max_bytes: int = 256 * 1024 * 1024, idle_ttl_seconds: float = 4 * 3600):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._sessions: "OrderedDict[str, SessionRecord]" = OrderedDict()  # least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._evictions = {"idle": 0, "max_sessions": 0, "max_bytes": 0}
+
+    def _expired(self, record: SessionRecord, now: float) -> bool:
+        return self.idle_ttl_seconds > 0 and now - record.last_access > self.idle_ttl_seconds
+
+    def _drop(self, session_id: str, reason: Optional[str] = None):
+        record = self._sessions.pop(session_id)
+        self._bytes -= record.nbytes
+        if reason:
+            self._evictions[reason] += 1
+
+    def _lookup(self, session_id: str) -> Optional[SessionRecord]:
+        """Fetch a live record and mark it most recently used (lock held)"""
+        record = self._sessions.get(session_id)
+        if record is None:
+            return None
+        now = time.monotonic()
+        if self._expired(record, now):
+            self._drop(session_id, "idle")
+            return None
+        record.last_access = now
+        self._sessions.move_to_end(session_id)
+        return record
+
+    def _resize(self, session_id: str, record: SessionRecord):
+        size = _record_size(record, session_id)
+        self._bytes += size - record.nbytes
+        record.nbytes = size
+
+    def _evict(self):
+        """Expire idle sessions, then trim least recently used ones to the limits (lock held)"""
+        now = time.monotonic()
+        # LRU order is last-access order, so idle sessions sit at the front
+        while self._sessions:
+            session_id, record = next(iter(self._sessions.items()))
+            if not self._expired(record, now):
+                break
+            self._drop(session_id, "idle")
+        # Never evict the session that was just written (the last one)
+        while len(self._sessions) > max(1, self.max_sessions):
+            self._drop(next(iter(self._sessions)), "max_sessions")
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            self._drop(next(iter(self._sessions)), "max_bytes")
+
+    def get_turns(self, session_id: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            record = self._lookup(session_id)
+            if record is None:
+                return []
+            return [(turn.user, turn.ai) for turn in record.turns]
+
+    def append(self, session_id: str, user: str, ai: str):
+        with self._lock:
+            record = self._lookup(session_id)
+            if record is None:
+                record = self._sessions[session_id] = SessionRecord()
+            record.turns.append(Turn(user, ai))
+            if len(record.turns) > self.max_turns:
+                del record.turns[:-self.max_turns]
+            self._resize(session_id, record)
+            self._evict()
+
+    def clear(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._drop(session_id)
+            return True
+
+    def get_summary(self, session_id: str) -> str:
+        with self._lock:
+            record = self._lookup(session_id)
+            return record.summary if record is not None else ""
+
+    def set_summary(self, session_id: str, summary: str, expected: Optional[str] = None) -> bool:
+        """Store a summary; ignored (False) if the session was cleared or evicted, or is not at expected"""
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None or (expected is not None and record.summary != expected):
+                return False
+            record.summary = summary
+            self._resize(session_id, record)
+            self._evict()
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._evict()
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "messages": sum(len(record.turns) * 2 for record in self._sessions.values()),
+                "bytes": self._bytes,
+                "evictions": dict(self._evictions),
+                "limits": {
+                    "max_sessions": self.max_sessions,
+                    "max_bytes": self.max_bytes,
+                    "idle_ttl_seconds": self.idle_ttl_seconds,
+                    "max_turns": self.max_turns,
+                },
+            }
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session store shared by all workers on a host via SQLite in WAL mode
+
+    Appends run in a single IMMEDIATE transaction (insert + trim + touch), so
+    concurrent workers never interleave partial updates. Idle sessions and
+    sessions beyond max_sessions (least recently used first) are swept
+    periodically.
+    """
+
+    SWEEP_INTERVAL_SECONDS = 60.0
+
+    def __init__(self, path: str, max_turns: int = 10, max_sessions: int = 10000,
+                 idle_ttl_seconds: float = 4 * 3600):
+        self.path = path
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        self._evictions = {"idle": 0, "max_sessions": 0}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL DEFAULT '',
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access);
+            CREATE TABLE IF NOT EXISTS turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                user TEXT NOT NULL,
+                ai TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, id);
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread, autocommit mode with explicit transactions"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _live(self, conn: sqlite3.Connection, session_id: str) -> bool:
+        row = conn.execute("SELECT last_access FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return False
+        if self.idle_ttl_seconds > 0 and time.time() - row[0] > self.idle_ttl_seconds:
+            return False
+        return True
+
+    def get_turns(self, session_id: str) -> List[Tuple[str, str]]:
+        conn = self._conn()
+        if not self._live(conn, session_id):
+            return []
+        conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (time.time(), session_id))
+        rows = conn.execute(
+            "SELECT user, ai FROM turns WHERE session_id = ? ORDER BY id", (session_id,)
+        ).fetchall()
+        return [(user, ai) for user, ai in rows]
+
+    def append(self, session_id: str, user: str, ai: str):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not self._live(conn, session_id):
+                # Expired or new: start from a clean slate
+                conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            conn.execute(
+                "INSERT INTO sessions (session_id, last_access) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_access = excluded.last_access",
+                (session_id, now),
+            )
+            conn.execute("INSERT INTO turns (session_id, user, ai) VALUES (?, ?, ?)", (session_id, user, ai))
+            conn.execute(
+                "DELETE FROM turns WHERE session_id = ? AND id NOT IN "
+                "(SELECT id FROM turns WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, self.max_turns),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if now - self._last_sweep > self.SWEEP_INTERVAL_SECONDS:
+            self._last_sweep = now
+            self._sweep(conn, protect=session_id)
+
+    def _sweep(self, conn: sqlite3.Connection, protect: str = ""):
+        """Drop idle sessions, then the least recently used ones beyond max_sessions"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            victims = []
+            if self.idle_ttl_seconds > 0:
+                rows = conn.execute(
+                    "SELECT session_id FROM sessions WHERE last_access < ?",
+                    (time.time() - self.idle_ttl_seconds,),
+                ).fetchall()
+                victims += [(row[0], "idle") for row in rows]
+            (count,) = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()
+            excess = count - len(victims) - self.max_sessions
+            if excess > 0:
+                rows = conn.execute(
+                    "SELECT session_id FROM sessions WHERE session_id != ? ORDER BY last_access LIMIT ? OFFSET ?",
+                    (protect, excess, len(victims)),
+                ).fetchall()
+                victims += [(row[0], "max_sessions") for row in rows]
+            for victim, reason in victims:
+                conn.execute("DELETE FROM turns WHERE session_id = ?", (victim,))
+                conn.execute("DELETE FROM sessions WHERE session_id = ?", (victim,))
+                self._evictions[reason] += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear(self, session_id: str) -> bool:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            deleted = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return deleted > 0
+
+    def get_summary(self, session_id: str) -> str:
+        conn = self._conn()
+        if not self._live(conn, session_id):
+            return ""
+        row = conn.execute("SELECT summary FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else ""
+
+    def set_summary(self, session_id: str, summary: str, expected: Optional[str] = None) -> bool:
+        if expected is None:
+            cursor = self._conn().execute(
+                "UPDATE sessions SET summary = ? WHERE session_id = ?", (summary, session_id)
+            )
+        else:
+            cursor = self._conn().execute(
+                "UPDATE sessions SET summary = ? WHERE session_id = ? AND summary = ?", (summary, session_id, expected)
+            )
+        return cursor.rowcount > 0
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._conn()
+        cutoff = time.time() - self.idle_ttl_seconds if self.idle_ttl_seconds > 0 else 0
+        sessions, summary_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(summary AS BLOB))), 0) FROM sessions WHERE last_access >= ?",
+            (cutoff,),
+        ).fetchone()
+        turns, turn_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(user AS BLOB)) + LENGTH(CAST(ai AS BLOB))), 0) FROM turns "
+            "WHERE session_id IN (SELECT session_id FROM sessions WHERE last_access >= ?)",
+            (cutoff,),
+        ).fetchone()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "sessions": sessions,
+            "messages": turns * 2,
+            "bytes": summary_bytes + turn_bytes,
+            "file_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "evictions": dict(self._evictions),  # this worker's sweeps only
+            "limits": {
+                "max_sessions": self.max_sessions,
+                "idle_ttl_seconds": self.idle_ttl_seconds,
+                "max_turns": self.max_turns,
+            },
+        }
+
+
+class RedisSessionStore(SessionStore):
+    """Session store for multi-node deployments on any Redis-protocol server
+
+    Each session is a list of JSON-encoded turns plus a summary string. An
+    append is one MULTI/EXEC transaction (RPUSH + LTRIM + EXPIRE), so it is
+    atomic across workers and nodes. Idle TTL maps onto key expiry; for
+    size-based LRU eviction configure the server with
+    `maxmemory` + `maxmemory-policy allkeys-lru`.
+    A `fakeredis://` URL uses the in-process fakeredis package for local
+    tests (a development requirement).
+
+    Sessions are also listed in a sorted set by last access, so stats()
+    counts live sessions without scanning the keyspace; message counts
+    are estimated from a random sample of STATS_SAMPLE_SESSIONS sessions.
+    """
+
+    STATS_SAMPLE_SESSIONS = 100
+
+    def __init__(self, url: str, max_turns: int = 10, idle_ttl_seconds: float = 4 * 3600,
+                 prefix: str = "rag:session:"):
+        if url.startswith("fakeredis://"):
+            import fakeredis
+            self.client = fakeredis.FakeRedis(decode_responses=True)
+        else:
+            import redis
+            self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.url = url
+        self.max_turns = max_turns
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.prefix = prefix
+
+    def _keys(self, session_id: str) -> Tuple[str, str]:
+        return f"{self.prefix}{session_id}:turns", f"{self.prefix}{session_id}:summary"
+
+    @property
+    def _index_key(self) -> str:
+        return f"{self.prefix}index"
+
+    def _touch(self, pipe, *keys):
+        if self.idle_ttl_seconds > 0:
+            for key in keys:
+                pipe.expire(key, int(self.idle_ttl_seconds))
+
+    def get_turns(self, session_id: str) -> List[Tuple[str, str]]:
+        turns_key, summary_key = self._keys(session_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.lrange(turns_key, 0, -1)
+        self._touch(pipe, turns_key, summary_key)
+        pipe.zadd(self._index_key, {session_id: time.time()}, xx=True)
+        raw = pipe.execute()[0]
+        return [tuple(json.loads(item)) for item in raw]
+
+    def append(self, session_id: str, user: str, ai: str):
+        turns_key, summary_key = self._keys(session_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(turns_key, json.dumps([user, ai]))
+        pipe.ltrim(turns_key, -self.max_turns, -1)
+        self._touch(pipe, turns_key, summary_key)
+        pipe.zadd(self._index_key, {session_id: time.time()})
+        pipe.execute()
+
+    def clear(self, session_id: str) -> bool:
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(*self._keys(session_id))
+        pipe.zrem(self._index_key, session_id)
+        return pipe.execute()[0] > 0
+
+    def get_summary(self, session_id: str) -> str:
+        return self.client.get(self._keys(session_id)[1]) or ""
+
+    def set_summary(self, session_id: str, summary: str, expected: Optional[str] = None) -> bool:
+        from redis.exceptions import WatchError
+
+        turns_key, summary_key = self._keys(session_id)
+        with self.client.pipeline(transaction=True) as pipe:
+            try:
+                # EXEC fails if either key changes between WATCH and EXEC
+                pipe.watch(turns_key, summary_key)
+                if not pipe.exists(turns_key):
+                    return False
+                if expected is not None and (pipe.get(summary_key) or "") != expected:
+                    return False
+                pipe.multi()
+                pipe.set(summary_key, summary)
+                self._touch(pipe, summary_key)
+                pipe.execute()
+            except WatchError:
+                return False
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        if self.idle_ttl_seconds > 0:
+            # Their keys have expired; drop them from the index too
+            self.client.zremrangebyscore(self._index_key, "-inf", time.time() - self.idle_ttl_seconds)
+        sessions = self.client.zcard(self._index_key)
+        sample = self.client.zrandmember(self._index_key, self.STATS_SAMPLE_SESSIONS) or []
+        pipe = self.client.pipeline(transaction=False)
+        for session_id in sample:
+            pipe.llen(self._keys(session_id)[0])
+        lengths = pipe.execute() if sample else []
+        messages = round(sum(lengths) * 2 * sessions / len(lengths)) if lengths else 0
+        try:
+            used_memory = self.client.info("memory").get("used_memory", 0)
+        except Exception:
+            used_memory = None
+        return {
+            "backend": "redis",
+            "sessions": sessions,
+            "messages": messages,  # estimated from messages_sampled sessions
+            "messages_sampled": len(lengths),
+            "bytes": used_memory,  # whole server, as reported by INFO memory
+            "limits": {
+                "idle_ttl_seconds": self.idle_ttl_seconds,
+                "max_turns": self.max_turns,
+            },
+        }
+
+
+def create_session_store(backend: str, max_turns: int, max_sessions: int, max_bytes: int,
+                         idle_ttl_seconds: float, sqlite_path: str = "", redis_url: str = "") -> SessionStore:
+    """Build the configured backend: memory (per process), sqlite (per host) or redis (cluster)"""
+    if backend == "sqlite":
+        return SQLiteSessionStore(sqlite_path, max_turns=max_turns, max_sessions=max_sessions,
+                                  idle_ttl_seconds=idle_ttl_seconds)
+    if backend == "redis":
+        return RedisSessionStore(redis_url, max_turns=max_turns, idle_ttl_seconds=idle_ttl_seconds)
+    if backend != "memory":
+        raise ValueError(f"Unknown SESSION_BACKEND '{backend}' (expected memory, sqlite or redis)")
+    return InMemorySessionStore(max_turns=max_turns, max_sessions=max_sessions,
+                                max_bytes=max_bytes, idle_ttl_seconds=idle_ttl_seconds)
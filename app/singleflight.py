@@ -0,0 +1,85 @@
+import re
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from .admission import DeadlineExceededError, is_deadline_exceeded, remaining_seconds
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different phrasings share a key"""
+    text = re.sub(r"\s+", " ", question.strip().lower())
+    return text.rstrip("?.! ")
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single execution"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run fn once per in-flight key; returns (result, shared)
+
+        Followers wait no longer than their own request deadline. If the
+        leader ran out of its deadline, a follower with time left does not
+        inherit that failure: it joins or leads the next flight for the key.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is not None:
+                    call.waiters += 1
+                    leader = False
+                else:
+                    call = _Call()
+                    self._calls[key] = call
+                    self.executed += 1
+                    leader = True
+
+            if leader:
+                break
+            left = remaining_seconds()
+            if not call.done.wait(None if left is None else max(0.0, left)):
+                raise DeadlineExceededError("request deadline passed while waiting for a coalesced call")
+            if call.error is None:
+                # Counted only now: a follower that timed out or retried did not share anything
+                with self._lock:
+                    self.coalesced += 1
+                return call.result, True
+            left = remaining_seconds()
+            if not is_deadline_exceeded(call.error) or (left is not None and left <= 0):
+                raise call.error
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": in_flight,
+        }
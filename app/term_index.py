@@ -0,0 +1,222 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TERM_INDEX_DB = os.getenv("TERM_INDEX_DB", "data/term_index.db")
+
+# Alarm / fault codes written after a keyword: "fault F0712", "Alarm 1020", "error code: E-23"
+PREFIXED_CODE_PATTERN = re.compile(
+    r'\b(?:alarm|fault|error|alm|err)\s*(?:code)?\s*(?:no\.?|#|:)?\s*([A-Z]{0,3}-?\d{1,5}[A-Z]?)\b',
+    re.IGNORECASE
+)
+# Bare upper-case codes: F0712, AL-101. Without a keyword a code needs a hyphen or 3+ digits,
+# so sizes and model names (M8, X5, E23) are left to vector search
+BARE_CODE_PATTERN = re.compile(r'(?<![-/])\b[A-Z]{1,3}(?:-\d{1,5}|\d{3,5})\b(?!-[A-Z0-9])')
+# Part numbers: "P/N 6204-2RS", "Part No. A1234" or any hyphenated token with digits
+PREFIXED_PART_PATTERN = re.compile(
+    r'\b(?:P/?N|part\s*(?:no\.?|number|#))\s*[:#]?\s*([A-Z0-9][A-Z0-9./-]*\d[A-Z0-9./-]*)',
+    re.IGNORECASE
+)
+HYPHENATED_PART_PATTERN = re.compile(r'\b[A-Z0-9]*\d[A-Z0-9]*(?:-[A-Z0-9]+)+\b')
+# Dates written like part numbers: 2020-01-15, 15-01-2020
+DATE_PATTERN = re.compile(r'(?:\d{4}-\d{1,2}-\d{1,2}|\d{1,2}-\d{1,2}-\d{2,4})')
+# Metric thread / fastener sizes: M8, M10, M12x1.5. They narrow results ("torque for M8 bolt")
+# but are too common to settle a question on their own
+SIZE_PATTERN = re.compile(r'\bM(\d{1,2}(?:\.\d)?)(?:\s?[xX×]\s?(\d+(?:\.\d+)?))?\b')
+# Value + unit specifications: "25 Nm", "1500 rpm", "0.05mm", "80 °C"
+SPEC_VALUE_PATTERN = re.compile(
+    r'(\d+(?:[.,]\d+)?)\s*(mm|cm|°C|°F|rpm|psi|bar|kPa|MPa|N·m|N-m|Nm|VAC|VDC|V|mA|A|kW|W|Hz|kg|l/min|L/min)(?![A-Za-z])'
+)
+UNIT_ALIASES = {"n·m": "nm", "n-m": "nm"}
+
+
+def normalize_code(code: str) -> str:
+    return code.upper().replace("-", "").replace(" ", "")
+
+
+def normalize_spec(value: str, unit: str) -> str:
+    value = value.replace(",", ".")
+    if "." in value:
+        value = value.rstrip("0").rstrip(".")
+    unit = unit.lower()
+    return f"{value}{UNIT_ALIASES.get(unit, unit)}"
+
+
+def has_spec_value(text: str) -> bool:
+    """True if text states a value with an engineering unit (used to tag specification chunks)"""
+    return SPEC_VALUE_PATTERN.search(text) is not None
+
+
+def normalize_size(diameter: str, pitch: Optional[str]) -> str:
+    return f"M{diameter}X{pitch}" if pitch else f"M{diameter}"
+
+
+def extract_terms(text: str) -> Dict[str, str]:
+    """Exact-match terms in text → kind ("code", "part", "spec" or "size")"""
+    terms = {}
+    for match in SPEC_VALUE_PATTERN.finditer(text):
+        terms[normalize_spec(match.group(1), match.group(2))] = "spec"
+    for match in PREFIXED_PART_PATTERN.finditer(text):
+        terms[normalize_code(match.group(1).rstrip("./-"))] = "part"
+    for match in HYPHENATED_PART_PATTERN.finditer(text):
+        token = match.group(0)
+        # Skip plain ranges such as "10-20" and dates
+        if DATE_PATTERN.fullmatch(token):
+            continue
+        if any(c.isalpha() for c in token) or token.count("-") >= 2:
+            terms.setdefault(normalize_code(token), "part")
+    for match in PREFIXED_CODE_PATTERN.finditer(text):
+        terms.setdefault(normalize_code(match.group(1)), "code")
+    for match in BARE_CODE_PATTERN.finditer(text):
+        terms.setdefault(normalize_code(match.group(0)), "code")
+    for match in SIZE_PATTERN.finditer(text):
+        terms.setdefault(normalize_size(match.group(1), match.group(2)), "size")
+    return terms
+
+
+class TermIndex:
+    """Inverted index term → chunk ids, persisted in SQLite and served from a dict
+
+    Lookups only touch the in-memory dict (plus SQLite's data_version check,
+    which notices writes by other worker processes), so they stay well under
+    a millisecond. Rows other workers add are read past a rowid watermark;
+    only a removal makes the next lookup reload everything.
+    """
+
+    def __init__(self, db_path: str = TERM_INDEX_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._postings: Dict[Tuple[str, str], Set[str]] = {}  # (collection, term) → chunk ids
+        self._kinds: Dict[Tuple[str, str], str] = {}
+        self._data_version = None
+        self._rowid = 0          # highest terms rowid loaded into the dict
+        self._removals = None    # removal counter the dict reflects
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        # One connection, always used under self._lock: data_version is per connection
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS terms ("
+            "collection TEXT NOT NULL, term TEXT NOT NULL, kind TEXT NOT NULL, chunk_id TEXT NOT NULL, "
+            "PRIMARY KEY (collection, term, chunk_id))"
+        )
+        # Bumped with every removal: deleted rows leave nothing behind for a watermark to see
+        self._db.execute("CREATE TABLE IF NOT EXISTS term_index_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.execute("INSERT OR IGNORE INTO term_index_meta VALUES ('removals', 0)")
+        self._db.commit()
+
+    def _refresh(self):
+        """Bring the dict up to date when the database changed (e.g. another worker ingested)"""
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        removals = self._db.execute("SELECT value FROM term_index_meta WHERE key = 'removals'").fetchone()[0]
+        if removals != self._removals:
+            self._postings, self._kinds, self._rowid = {}, {}, 0
+        rows = self._db.execute(
+            "SELECT rowid, collection, term, kind, chunk_id FROM terms WHERE rowid > ? ORDER BY rowid", (self._rowid,)
+        )
+        for rowid, collection, term, kind, chunk_id in rows:
+            self._postings.setdefault((collection, term), set()).add(chunk_id)
+            self._kinds[(collection, term)] = kind
+            self._rowid = rowid
+        self._data_version = version
+        self._removals = removals
+
+    def add(self, collection: str, chunk_terms: Iterable[Tuple[str, Dict[str, str]]]) -> int:
+        """Index (chunk_id, {term: kind}) pairs; returns the number of postings written"""
+        rows = [
+            (collection, term, kind, chunk_id)
+            for chunk_id, terms in chunk_terms
+            for term, kind in terms.items()
+        ]
+        if not rows:
+            return 0
+        with self._lock:
+            self._refresh()
+            with self._db:
+                self._db.executemany("INSERT OR IGNORE INTO terms VALUES (?, ?, ?, ?)", rows)
+            # Our own commits do not change data_version, so update the dict directly
+            for collection_name, term, kind, chunk_id in rows:
+                self._postings.setdefault((collection_name, term), set()).add(chunk_id)
+                self._kinds[(collection_name, term)] = kind
+        return len(rows)
+
+    def lookup(self, collection: str, terms: Iterable[str]) -> Dict[str, Set[str]]:
+        """term → chunk ids, for the terms that have at least one hit"""
+        with self._lock:
+            self._refresh()
+            hits = {}
+            for term in terms:
+                chunk_ids = self._postings.get((collection, term))
+                if chunk_ids:
+                    hits[term] = set(chunk_ids)
+            return hits
+
+    def remove(self, collection: str, chunk_ids: List[str]):
+        """Drop the postings of chunks that no longer exist"""
+        with self._lock:
+            with self._db:
+                for offset in range(0, len(chunk_ids), 500):
+                    batch = chunk_ids[offset:offset + 500]
+                    self._db.execute(
+                        f"DELETE FROM terms WHERE collection = ? AND chunk_id IN ({','.join('?' * len(batch))})",
+                        [collection, *batch]
+                    )
+                self._count_removal()
+            self._data_version = None
+
+    def clear(self, collection: str):
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM terms WHERE collection = ?", (collection,))
+                self._count_removal()
+            self._data_version = None
+
+    def _count_removal(self):
+        self._db.execute("UPDATE term_index_meta SET value = value + 1 WHERE key = 'removals'")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._refresh()
+            kinds: Dict[str, int] = {}
+            for kind in self._kinds.values():
+                kinds[kind] = kinds.get(kind, 0) + 1
+            return {
+                "terms": len(self._postings),
+                "postings": sum(len(ids) for ids in self._postings.values()),
+                **{f"{kind}_terms": count for kind, count in kinds.items()},
+            }
+
+
+_TERM_INDEX = None
+_TERM_INDEX_LOCK = threading.Lock()
+
+
+def get_term_index() -> TermIndex:
+    """Process-wide term index, opened on first use"""
+    global _TERM_INDEX
+    if _TERM_INDEX is None:
+        with _TERM_INDEX_LOCK:
+            if _TERM_INDEX is None:
+                _TERM_INDEX = TermIndex(TERM_INDEX_DB)
+    return _TERM_INDEX
+
+
+def rank_candidates(hits: Dict[str, Set[str]]) -> List[Tuple[str, int]]:
+    """(chunk_id, matched term count), best first"""
+    counts: Dict[str, int] = {}
+    for chunk_ids in hits.values():
+        for chunk_id in chunk_ids:
+            counts[chunk_id] = counts.get(chunk_id, 0) + 1
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
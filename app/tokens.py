@@ -0,0 +1,41 @@
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    """tiktoken encoding for model, or None when tiktoken/its data is unavailable"""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("tiktoken unavailable, estimating tokens from length", extra={"reason": str(e)})
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Token count for text (≈ len/4 when tiktoken cannot be loaded)"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-4o") -> str:
+    """Cut text down to at most max_tokens tokens"""
+    if not text or max_tokens <= 0:
+        return ""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,281 @@
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+from .metrics import BUDGET_ACTIONS, LLM_COST
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+USAGE_DB = os.getenv("USAGE_DB", "data/usage.db")
+
+# USD per million tokens; the longest matching model-name prefix wins (override with MODEL_PRICES_JSON)
+MODEL_PRICES = {
+    "gpt-4o-mini": {"prompt": 0.15, "cached": 0.075, "completion": 0.60},
+    "gpt-4o": {"prompt": 2.50, "cached": 1.25, "completion": 10.00},
+    "text-embedding-3-small": {"prompt": 0.02, "cached": 0.02, "completion": 0.0},
+    "text-embedding-3-large": {"prompt": 0.13, "cached": 0.13, "completion": 0.0},
+}
+MODEL_PRICES.update(json.loads(os.getenv("MODEL_PRICES_JSON") or "{}"))
+
+# Budgets in USD (0 = unlimited). A session's budget covers its whole lifetime; the global
+# budget resets every GLOBAL_BUDGET_PERIOD (day or month, UTC)
+SESSION_BUDGET_USD = float(os.getenv("SESSION_BUDGET_USD", "0"))
+GLOBAL_BUDGET_USD = float(os.getenv("GLOBAL_BUDGET_USD", "0"))
+GLOBAL_BUDGET_PERIOD = os.getenv("GLOBAL_BUDGET_PERIOD", "month").lower()
+# Share of a budget after which requests are served in degraded mode (no rewrite call,
+# smaller context, no summary refresh) instead of normally
+BUDGET_DEGRADE_AT = float(os.getenv("BUDGET_DEGRADE_AT", "0.8"))
+DEGRADED_CONTEXT_CHUNKS = int(os.getenv("DEGRADED_CONTEXT_CHUNKS", "2"))
+USAGE_SESSION_RETENTION_SECONDS = float(os.getenv("USAGE_SESSION_RETENTION_SECONDS", str(30 * 86400)))
+
+BUDGET_LEVELS = ("ok", "degraded", "exhausted")
+
+
+class BudgetExceededError(RuntimeError):
+    def __init__(self, message: str, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def price_for(model: str) -> Dict[str, float]:
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else {}
+
+
+def cost_of(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """USD cost of one call (0 for models without a price)"""
+    price = price_for(model)
+    if not price:
+        return 0.0
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * price["prompt"] + cached_tokens * price["cached"]
+            + completion_tokens * price["completion"]) / 1_000_000
+
+
+def current_period(now: Optional[float] = None) -> str:
+    moment = datetime.fromtimestamp(now if now is not None else time.time(), tz=timezone.utc)
+    return moment.strftime("%Y-%m-%d" if GLOBAL_BUDGET_PERIOD == "day" else "%Y-%m")
+
+
+def seconds_until_next_period(now: Optional[float] = None) -> int:
+    moment = datetime.fromtimestamp(now if now is not None else time.time(), tz=timezone.utc)
+    if GLOBAL_BUDGET_PERIOD == "day":
+        start = (moment + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        start = (moment.replace(day=28) + timedelta(days=4)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return max(1, int((start - moment).total_seconds()))
+
+
+class UsageMeter:
+    """Token and cost totals of one request (plus its background work), by model"""
+
+    def __init__(self, session_id: Optional[str] = None):
+        self.session_id = session_id
+        self._lock = threading.Lock()
+        self.models: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int, cost: float):
+        with self._lock:
+            totals = self.models.setdefault(model, {
+                "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "cost_usd": 0.0
+            })
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["cached_tokens"] += cached_tokens
+            totals["cost_usd"] += cost
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {name: {**totals, "cost_usd": round(totals["cost_usd"], 6)} for name, totals in self.models.items()}
+        return {
+            "calls": sum(m["calls"] for m in models.values()),
+            "prompt_tokens": sum(m["prompt_tokens"] for m in models.values()),
+            "completion_tokens": sum(m["completion_tokens"] for m in models.values()),
+            "cached_tokens": sum(m["cached_tokens"] for m in models.values()),
+            "total_tokens": sum(m["prompt_tokens"] + m["completion_tokens"] for m in models.values()),
+            "cost_usd": round(sum(m["cost_usd"] for m in models.values()), 6),
+            "by_model": models,
+        }
+
+
+# Meter of the request being served; worker threads that copy the context (embedding
+# batches, summary refresh) keep adding to it
+CURRENT_METER: contextvars.ContextVar[Optional[UsageMeter]] = contextvars.ContextVar("usage_meter", default=None)
+
+
+@contextmanager
+def metered(session_id: Optional[str] = None):
+    """Collect the usage of every model call made inside the block"""
+    meter = UsageMeter(session_id)
+    token = CURRENT_METER.set(meter)
+    try:
+        yield meter
+    finally:
+        CURRENT_METER.reset(token)
+
+
+class UsageLedger:
+    """Per-session and global usage totals in SQLite, shared by the worker processes on a host"""
+
+    def __init__(self, db_path: str = USAGE_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            "scope TEXT NOT NULL, period TEXT NOT NULL, model TEXT NOT NULL, "
+            "calls INTEGER NOT NULL, prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, "
+            "cached_tokens INTEGER NOT NULL, cost_usd REAL NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (scope, period, model))"
+        )
+        self._db.commit()
+
+    def add(self, session_id: Optional[str], model: str, prompt_tokens: int, completion_tokens: int,
+            cached_tokens: int, cost: float):
+        now = time.time()
+        rows = [("global", current_period(now))]
+        if session_id:
+            rows.append((f"session:{session_id}", "all"))
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    "INSERT INTO usage VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (scope, period, model) DO UPDATE SET calls = calls + 1, "
+                    "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                    "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                    "cached_tokens = cached_tokens + excluded.cached_tokens, "
+                    "cost_usd = cost_usd + excluded.cost_usd, updated_at = excluded.updated_at",
+                    [(scope, period, model, prompt_tokens, completion_tokens, cached_tokens, cost, now)
+                     for scope, period in rows]
+                )
+                if now - self._last_prune > 3600:
+                    self._db.execute("DELETE FROM usage WHERE scope LIKE 'session:%' AND updated_at < ?",
+                                     (now - USAGE_SESSION_RETENTION_SECONDS,))
+                    self._last_prune = now
+
+    def spent(self, scope: str, period: str) -> float:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COALESCE(SUM(cost_usd), 0) FROM usage WHERE scope = ? AND period = ?", (scope, period)
+            ).fetchone()
+        return row[0]
+
+    def totals(self, scope: str, period: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT model, calls, prompt_tokens, completion_tokens, cached_tokens, cost_usd "
+                "FROM usage WHERE scope = ? AND period = ?", (scope, period)
+            ).fetchall()
+        by_model = {
+            model: {"calls": calls, "prompt_tokens": prompt, "completion_tokens": completion,
+                    "cached_tokens": cached, "cost_usd": round(cost, 6)}
+            for model, calls, prompt, completion, cached, cost in rows
+        }
+        return {
+            "calls": sum(m["calls"] for m in by_model.values()),
+            "total_tokens": sum(m["prompt_tokens"] + m["completion_tokens"] for m in by_model.values()),
+            "cost_usd": round(sum(m["cost_usd"] for m in by_model.values()), 6),
+            "by_model": by_model,
+        }
+
+
+_LEDGER: Optional[UsageLedger] = None
+_LEDGER_LOCK = threading.Lock()
+
+
+def get_usage_ledger() -> UsageLedger:
+    """Process-wide usage ledger, opened on first use"""
+    global _LEDGER
+    if _LEDGER is None:
+        with _LEDGER_LOCK:
+            if _LEDGER is None:
+                _LEDGER = UsageLedger(USAGE_DB)
+    return _LEDGER
+
+
+def record_usage(model: str, usage: Dict[str, Any]):
+    """Account one model call's reported usage to the current request, its session and the global total"""
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    completion_tokens = int(usage.get("completion_tokens") or 0)
+    cached_tokens = int((usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0)
+    cost = cost_of(model, prompt_tokens, completion_tokens, cached_tokens)
+
+    meter = CURRENT_METER.get()
+    if meter is not None:
+        meter.add(model, prompt_tokens, completion_tokens, cached_tokens, cost)
+    LLM_COST.inc(cost, model=model)
+    try:
+        get_usage_ledger().add(meter.session_id if meter else None, model,
+                               prompt_tokens, completion_tokens, cached_tokens, cost)
+    except sqlite3.Error:
+        logger.exception("could not record usage", extra={"model": model})
+
+
+def _level(spent: float, budget: float) -> str:
+    if budget <= 0:
+        return "ok"
+    if spent >= budget:
+        return "exhausted"
+    return "degraded" if spent >= budget * BUDGET_DEGRADE_AT else "ok"
+
+
+def check_budget(session_id: Optional[str] = None) -> Dict[str, Any]:
+    """Spend so far against the session and global budgets, and the resulting service level"""
+    status: Dict[str, Any] = {"level": "ok"}
+    if not SESSION_BUDGET_USD and not GLOBAL_BUDGET_USD:
+        return status
+    ledger = get_usage_ledger()
+    levels = []
+    if GLOBAL_BUDGET_USD:
+        spent = ledger.spent("global", current_period())
+        levels.append(_level(spent, GLOBAL_BUDGET_USD))
+        status.update({"global_spent_usd": round(spent, 6), "global_budget_usd": GLOBAL_BUDGET_USD,
+                       "global_level": levels[-1]})
+    if SESSION_BUDGET_USD and session_id:
+        spent = ledger.spent(f"session:{session_id}", "all")
+        levels.append(_level(spent, SESSION_BUDGET_USD))
+        status.update({"session_spent_usd": round(spent, 6), "session_budget_usd": SESSION_BUDGET_USD,
+                       "session_level": levels[-1]})
+    status["level"] = max(levels, key=BUDGET_LEVELS.index, default="ok")
+    return status
+
+
+def enforce_budget(session_id: Optional[str] = None) -> Dict[str, Any]:
+    """check_budget, raising BudgetExceededError once a budget is used up"""
+    status = check_budget(session_id)
+    if status["level"] == "exhausted":
+        BUDGET_ACTIONS.inc(action="rejected")
+        if status.get("global_level") == "exhausted":
+            raise BudgetExceededError(
+                f"Global model budget of ${GLOBAL_BUDGET_USD} for this {GLOBAL_BUDGET_PERIOD} is used up",
+                retry_after=seconds_until_next_period()
+            )
+        raise BudgetExceededError(f"Session model budget of ${SESSION_BUDGET_USD} is used up")
+    if status["level"] == "degraded":
+        BUDGET_ACTIONS.inc(action="degraded")
+    return status
+
+
+def get_usage_stats() -> Dict[str, Any]:
+    """Global usage of the current budget period for /stats"""
+    period = current_period()
+    return {"period": period, **get_usage_ledger().totals("global", period), "budget": check_budget()}
+
+
+def get_session_usage(session_id: str) -> Dict[str, Any]:
+    return get_usage_ledger().totals(f"session:{session_id}", "all")
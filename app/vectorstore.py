@@ -1,36 +1,308 @@
 import os
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+import json
+import time
+import fcntl
+import logging
+import threading
+from typing import Any, Dict, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 PERSIST_DIR = "data/chroma_db"
 
+# embedded: each process opens PERSIST_DIR itself (fine for a single worker).
+# http: every worker talks to one Chroma server (`chroma run --path data/chroma_db --port 8001`),
+# so N uvicorn workers share one index instead of each loading it and contending on SQLite.
+CHROMA_MODE = os.getenv("CHROMA_MODE", "embedded").lower()
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8001"))
+CHROMA_SSL = os.getenv("CHROMA_SSL", "false").lower() in ("1", "true", "yes")
+CHROMA_CONNECT_TIMEOUT_SECONDS = float(os.getenv("CHROMA_CONNECT_TIMEOUT_SECONDS", "5"))
+CHROMA_TIMEOUT_SECONDS = float(os.getenv("CHROMA_TIMEOUT_SECONDS", "30"))
+CHROMA_MAX_CONNECTIONS = int(os.getenv("CHROMA_MAX_CONNECTIONS", "32"))
+CHROMA_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("CHROMA_MAX_KEEPALIVE_CONNECTIONS", "16"))
+CHROMA_KEEPALIVE_SECONDS = float(os.getenv("CHROMA_KEEPALIVE_SECONDS", "40"))
+
+# openai, or local: deterministic offline hash embeddings (app/local_embeddings.py) for
+# evaluation and benchmarks; an index must be queried with the embeddings it was built with
+EMBEDDINGS_PROVIDER = os.getenv("EMBEDDINGS_PROVIDER", "openai").lower()
+
+# Dimensions indexed by collections created from now on (0 = the full embedding). With e.g.
+# 256, Chroma's HNSW index holds shortened vectors for candidate search and the full ones
+# are kept in app/full_vectors.py to re-score the candidates. Recorded in each collection's
+# metadata, so changing it only affects new collections (e.g. the next /index/rebuild).
+EMBED_INDEX_DIMENSIONS = int(os.getenv("EMBED_INDEX_DIMENSIONS", "0"))
+
+# HNSW parameters of collections created from now on (empty / 0 = Chroma's default: l2, M 16,
+# construction_ef 100, search_ef 100), stored in the collection metadata like index_dimensions.
+# search_ef only affects queries, so it is also applied to existing collections when opened
+# (a process that already loaded the index keeps the old value until it restarts).
+# Pick values with scripts/hnsw_sweep.py.
+HNSW_SPACE = os.getenv("HNSW_SPACE", "").lower()
+HNSW_M = int(os.getenv("HNSW_M", "0"))
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", "0"))
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "0"))
+
+# Alias → physical collection registry for blue/green index builds (see app/index_builds.py)
+COLLECTION_ALIASES_PATH = os.getenv("COLLECTION_ALIASES_PATH", "data/collection_aliases.json")
+
+logger = logging.getLogger(__name__)
+
+# One Chroma client per process, shared by every collection (and its connection pool)
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+# collection name → write generation, bumped on every ingest so that anything
+# keyed on collection contents (e.g. coalesced answers) stops matching
+COLLECTION_VERSIONS = {}
+
+# collection name → opened Chroma store, reused across requests
+_VECTORSTORES = {}
+_VECTORSTORES_LOCK = threading.Lock()
+
+# Cached registry, reloaded when the file changes (another worker may have swapped)
+_ALIASES: Dict[str, Dict[str, Any]] = {}
+_ALIASES_MTIME = None
+_ALIASES_LOCK = threading.Lock()
+
+def get_collection_version(collection_name: str = "manufacturing_manuals") -> str:
+    """Cache key for a collection's contents: physical collection + write generation
+    
+    Resolves aliases, so anything keyed on this (e.g. coalesced answers)
+    moves to the new index as soon as an alias is swapped.
+    """
+    physical = resolve_collection(collection_name)
+    return f"{physical}@{COLLECTION_VERSIONS.get(physical, 0)}"
+
+def bump_collection_version(collection_name: str = "manufacturing_manuals"):
+    COLLECTION_VERSIONS[collection_name] = COLLECTION_VERSIONS.get(collection_name, 0) + 1
+
+def _load_aliases() -> Dict[str, Dict[str, Any]]:
+    global _ALIASES, _ALIASES_MTIME
+    try:
+        mtime = os.stat(COLLECTION_ALIASES_PATH).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime != _ALIASES_MTIME:
+        with _ALIASES_LOCK:
+            if mtime is None:
+                _ALIASES = {}
+            else:
+                with open(COLLECTION_ALIASES_PATH) as f:
+                    _ALIASES = json.load(f)
+            _ALIASES_MTIME = mtime
+    return _ALIASES
+
+def resolve_collection(alias: str = "manufacturing_manuals") -> str:
+    """Physical collection an alias points at (the alias itself until the first swap)"""
+    entry = _load_aliases().get(alias)
+    return entry["active"] if entry else alias
+
+def get_alias(alias: str = "manufacturing_manuals") -> Dict[str, Any]:
+    """Registry entry: active and previous physical collections, every known version and the latest build"""
+    entry = _load_aliases().get(alias)
+    if entry is None:
+        return {"active": alias, "previous": None, "versions": [alias], "updated_at": None}
+    return json.loads(json.dumps(entry))
+
+def _update_alias(alias: str, **fields):
+    """Read-modify-write one registry entry under a file lock, so workers never drop each other's writes
+
+    Written to a temp file and renamed over the registry, so readers see
+    either the old or the new registry, never a partial one.
+    """
+    global _ALIASES, _ALIASES_MTIME
+    with _ALIASES_LOCK:
+        os.makedirs(os.path.dirname(COLLECTION_ALIASES_PATH) or ".", exist_ok=True)
+        with open(f"{COLLECTION_ALIASES_PATH}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(COLLECTION_ALIASES_PATH) as f:
+                    aliases = json.load(f)
+            except FileNotFoundError:
+                aliases = {}
+            entry = aliases.get(alias) or {"active": alias, "previous": None, "versions": [alias], "updated_at": None}
+            entry.update(fields)
+            aliases[alias] = entry
+            tmp_path = f"{COLLECTION_ALIASES_PATH}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(aliases, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, COLLECTION_ALIASES_PATH)
+            _ALIASES = aliases
+            _ALIASES_MTIME = os.stat(COLLECTION_ALIASES_PATH).st_mtime_ns
+
+def set_alias(alias: str, active: str, previous: Optional[str], versions: list):
+    """Atomically repoint an alias"""
+    _update_alias(alias, active=active, previous=previous, versions=versions, updated_at=time.time())
+    logger.info("collection alias updated", extra={"alias": alias, "active": active, "previous": previous})
+
+def set_build_status(alias: str, build: Dict[str, Any]):
+    """Record the state of the alias's latest build or import, for every worker to read"""
+    _update_alias(alias, build=build)
+
+def drop_collection(collection_name: str):
+    """Delete a physical collection and forget its cached handle"""
+    with _VECTORSTORES_LOCK:
+        _VECTORSTORES.pop(collection_name, None)
+    try:
+        get_chroma_client().delete_collection(collection_name)
+    except Exception as e:
+        logger.warning("could not delete collection", extra={"collection": collection_name, "reason": str(e)})
+    COLLECTION_VERSIONS.pop(collection_name, None)
+
+def get_collection_space(db) -> str:
+    """Distance function of the underlying Chroma collection (Chroma defaults to l2)"""
+    metadata = db._collection.metadata or {}
+    return metadata.get("hnsw:space") or get_hnsw_settings(db).get("space", "l2")
+
+def distance_to_similarity(distance: float, space: str = "l2") -> float:
+    """Convert a Chroma distance into cosine similarity for unit-length embeddings"""
+    if space == "l2":
+        # Chroma reports squared L2; for unit vectors ||a - b||² = 2 - 2·cos
+        return 1.0 - distance / 2.0
+    # cosine and ip distances are both 1 - similarity
+    return 1.0 - distance
+
+def hnsw_metadata(space: str = HNSW_SPACE, m: int = HNSW_M, construction_ef: int = HNSW_CONSTRUCTION_EF,
+                  search_ef: int = HNSW_SEARCH_EF) -> Dict[str, Any]:
+    """Chroma collection metadata for the given HNSW parameters (unset ones left to Chroma)"""
+    if space and space not in ("l2", "cosine", "ip"):
+        raise ValueError(f"Unknown HNSW_SPACE: {space}")
+    metadata = {"hnsw:space": space, "hnsw:M": m, "hnsw:construction_ef": construction_ef, "hnsw:search_ef": search_ef}
+    return {key: value for key, value in metadata.items() if value}
+
+def get_hnsw_settings(db) -> Dict[str, Any]:
+    """HNSW parameters a collection's index actually uses"""
+    configuration = db._collection.configuration or {}
+    return {key: value for key, value in (configuration.get("hnsw") or {}).items()
+            if key in ("space", "max_neighbors", "ef_construction", "ef_search")}
+
+def get_chroma_client():
+    """Process-wide Chroma client for CHROMA_MODE (embedded or http)"""
+    global _CLIENT
+    if _CLIENT is not None:
+        return _CLIENT
+    
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = _open_client()
+    return _CLIENT
+
+def _open_client():
+    import chromadb
+    from chromadb.config import Settings
+    
+    if CHROMA_MODE == "embedded":
+        os.makedirs(PERSIST_DIR, exist_ok=True)
+        return chromadb.PersistentClient(path=PERSIST_DIR, settings=Settings(anonymized_telemetry=False))
+    
+    if CHROMA_MODE != "http":
+        raise ValueError(f"Unknown CHROMA_MODE: {CHROMA_MODE}")
+    
+    import httpx
+    
+    settings = Settings(
+        anonymized_telemetry=False,
+        chroma_http_keepalive_secs=CHROMA_KEEPALIVE_SECONDS,
+        chroma_http_max_connections=CHROMA_MAX_CONNECTIONS,
+        chroma_http_max_keepalive_connections=CHROMA_MAX_KEEPALIVE_CONNECTIONS
+    )
+    client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=CHROMA_SSL, settings=settings)
+    # chromadb builds its httpx session with no timeout at all; a hung server would
+    # otherwise pin a request thread forever
+    client._server._session.timeout = httpx.Timeout(
+        CHROMA_TIMEOUT_SECONDS, connect=CHROMA_CONNECT_TIMEOUT_SECONDS
+    )
+    client.heartbeat()  # fail at start-up, not on the first question
+    logger.info("connected to chroma server", extra={
+        "host": CHROMA_HOST, "port": CHROMA_PORT, "max_connections": CHROMA_MAX_CONNECTIONS
+    })
+    return client
+
+def get_write_batch_size(default: int) -> int:
+    """Largest add() batch the Chroma backend accepts, capped at default"""
+    return min(default, get_chroma_client().get_max_batch_size())
+
 def get_vectorstore(collection_name: str = "manufacturing_manuals"):
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+    """Shared Chroma handle for a collection (or alias), opened once per process
     
-    os.makedirs(PERSIST_DIR, exist_ok=True)
+    LangChain/Chroma/OpenAI are imported here rather than at module load so
+    the API process starts fast; the first call pays for them (or the
+    warm-up hook in app/warmup.py does).
+    """
+    collection_name = resolve_collection(collection_name)
+    db = _VECTORSTORES.get(collection_name)
+    if db is not None:
+        return db
+    
+    with _VECTORSTORES_LOCK:
+        db = _VECTORSTORES.get(collection_name)
+        if db is None:
+            db = _open_vectorstore(collection_name)
+            _VECTORSTORES[collection_name] = db
+    return db
+
+def get_embeddings():
+    """Embeddings client for EMBEDDINGS_PROVIDER"""
+    if EMBEDDINGS_PROVIDER == "local":
+        from .local_embeddings import LocalHashEmbeddings
+        return LocalHashEmbeddings()
+    if EMBEDDINGS_PROVIDER != "openai":
+        raise ValueError(f"Unknown EMBEDDINGS_PROVIDER: {EMBEDDINGS_PROVIDER}")
+    
+    from langchain_openai import OpenAIEmbeddings
+    from .openai_client import get_http_client, OPENAI_TIMEOUT_SECONDS
+    
+    # Same rate-limited connection pool as the chat model (see app/openai_client.py)
+    return OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        http_client=get_http_client(),
+        max_retries=0,
+        timeout=OPENAI_TIMEOUT_SECONDS
+    )
+
+def _open_vectorstore(collection_name: str):
+    from langchain_chroma import Chroma
+    
+    embeddings = get_embeddings()
+    client = get_chroma_client()
     
     try:
-        # Try to load existing collection
-        db = Chroma(
-            persist_directory=PERSIST_DIR,
-            embedding_function=embeddings,
-            collection_name=collection_name
-        )
-        
-        # Verify it has documents
-        collection_info = db.get()
-        if not collection_info['ids']:
-            print(f"Collection '{collection_name}' exists but is empty")
-        
-    except Exception as e:
-        print(f"Creating new collection '{collection_name}': {e}")
-        # If it doesn't exist, create a new empty one
-        db = Chroma(
-            persist_directory=PERSIST_DIR,
-            embedding_function=embeddings,
-            collection_name=collection_name
-        )
-    
-    return db
\ No newline at end of file
+        # Existing collections keep the index dimensions and HNSW graph they were created with
+        existing = client.get_collection(collection_name)
+        metadata = None
+    except Exception:
+        existing = None
+        metadata = hnsw_metadata()
+        if EMBED_INDEX_DIMENSIONS:
+            metadata["index_dimensions"] = EMBED_INDEX_DIMENSIONS
+        logger.info("creating new collection", extra={
+            "collection": collection_name, "index_dimensions": EMBED_INDEX_DIMENSIONS or "full", "hnsw": metadata
+        })
+        metadata = metadata or None
+    
+    if existing is not None and HNSW_SEARCH_EF:
+        current = ((existing.configuration or {}).get("hnsw") or {}).get("ef_search")
+        if current != HNSW_SEARCH_EF:
+            existing.modify(configuration={"hnsw": {"ef_search": HNSW_SEARCH_EF}})
+            logger.info("search_ef updated", extra={"collection": collection_name, "from": current, "to": HNSW_SEARCH_EF})
+    
+    db = Chroma(
+        client=client,
+        embedding_function=embeddings,
+        collection_name=collection_name,
+        collection_metadata=metadata
+    )
+    
+    # Verify it has documents (count() avoids fetching every document)
+    if db._collection.count() == 0:
+        logger.warning("collection is empty", extra={"collection": collection_name})
+    
+    return db
+
+def get_index_dimensions(db) -> int:
+    """Dimensions held by a collection's Chroma index (0 = full embeddings, single-stage search)"""
+    metadata = db._collection.metadata or {}
+    return int(metadata.get("index_dimensions", 0))
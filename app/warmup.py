@@ -0,0 +1,64 @@
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict
+
+from .metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() in ("1", "true", "yes")
+WARMUP_DELAY_SECONDS = float(os.getenv("WARMUP_DELAY_SECONDS", "0.5"))
+
+# Modules deferred out of `import app.main`, in the order the first request needs them
+HEAVY_MODULES = (
+    "langchain_core.messages",
+    "langchain_openai",
+    "chromadb",
+    "langchain_chroma",
+    "langchain_text_splitters",
+    "langchain_community.document_loaders",
+)
+
+WARMUP_STATUS: Dict[str, Any] = {"state": "pending", "seconds": None, "error": None}
+
+
+def warm_up():
+    """Import heavy dependencies and open the LLM client and vector store"""
+    from .retrieval import get_llm
+    from .vectorstore import get_vectorstore
+    from .term_index import get_term_index
+
+    start = time.perf_counter()
+    WARMUP_STATUS["state"] = "running"
+    try:
+        with stage_timer("startup", "imports"):
+            for name in HEAVY_MODULES:
+                importlib.import_module(name)
+        with stage_timer("startup", "llm_client"):
+            get_llm()
+        with stage_timer("startup", "vectorstore"):
+            db = get_vectorstore("manufacturing_manuals")
+            db._collection.count()  # forces the index to be opened
+        with stage_timer("startup", "term_index"):
+            get_term_index().stats()  # loads the exact-term postings into memory
+        WARMUP_STATUS["state"] = "done"
+    except Exception as e:
+        WARMUP_STATUS.update({"state": "failed", "error": str(e)})
+        logger.exception("warm-up failed")
+    finally:
+        WARMUP_STATUS["seconds"] = round(time.perf_counter() - start, 3)
+        logger.info("warm-up finished", extra={"warmup": dict(WARMUP_STATUS)})
+
+
+def start_background_warmup(delay: float = WARMUP_DELAY_SECONDS) -> threading.Thread:
+    """Run warm_up on a daemon thread after a short delay so the server can bind first"""
+    def run():
+        time.sleep(delay)
+        warm_up()
+
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# numpy is imported where it is used to keep API start-up fast
+if TYPE_CHECKING:
+    import numpy as np
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WORKING_SET_ENABLED = os.getenv("WORKING_SET_ENABLED", "true").lower() == "true"
+WORKING_SET_MAX_CHUNKS = int(os.getenv("WORKING_SET_MAX_CHUNKS", "12"))  # per session, newest kept
+WORKING_SET_MAX_SESSIONS = int(os.getenv("WORKING_SET_MAX_SESSIONS", "2000"))
+WORKING_SET_TTL_SECONDS = float(os.getenv("WORKING_SET_TTL_SECONDS", "1800"))
+
+
+class SessionWorkingSet:
+    """Chunks one session retrieved recently, with their full embeddings"""
+
+    def __init__(self, collection: str):
+        self.collection = collection
+        # chunk id → (Document, float16 vector), oldest first
+        self.chunks: "OrderedDict[str, Tuple[Any, np.ndarray]]" = OrderedDict()
+        self.touched_at = time.monotonic()
+
+    def nbytes(self) -> int:
+        return sum(vector.nbytes + len(doc.page_content) for doc, vector in self.chunks.values())
+
+
+class WorkingSetStore:
+    """Per-session working sets, bounded by chunks per session, session count (LRU) and idle TTL
+
+    Kept in process memory only: it is a cache in front of the index, so a
+    follow-up served by another worker simply searches the index instead.
+    """
+
+    def __init__(self, max_chunks: int = WORKING_SET_MAX_CHUNKS, max_sessions: int = WORKING_SET_MAX_SESSIONS,
+                 ttl_seconds: float = WORKING_SET_TTL_SECONDS):
+        self.max_chunks = max_chunks
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, SessionWorkingSet]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _get(self, session_id: str, collection: str) -> Optional[SessionWorkingSet]:
+        working_set = self._sessions.get(session_id)
+        if working_set is None:
+            return None
+        # Chunk ids are only meaningful within the collection they came from
+        if working_set.collection != collection or time.monotonic() - working_set.touched_at > self.ttl_seconds:
+            del self._sessions[session_id]
+            return None
+        return working_set
+
+    def fingerprint(self, session_id: str, collection: str) -> Optional[str]:
+        """Digest of the session's chunk ids (None when it holds none); equal digests retrieve alike"""
+        with self._lock:
+            working_set = self._get(session_id, collection)
+            if working_set is None or not working_set.chunks:
+                return None
+            return hashlib.sha1("\n".join(sorted(working_set.chunks)).encode("utf-8")).hexdigest()
+
+    def missing(self, session_id: str, collection: str, chunk_ids: List[str]) -> List[str]:
+        """The given chunk ids that are not in the session's working set yet"""
+        with self._lock:
+            working_set = self._get(session_id, collection)
+            known = working_set.chunks if working_set else {}
+            return [chunk_id for chunk_id in chunk_ids if chunk_id not in known]
+
+    def remember(self, session_id: str, collection: str, chunk_ids: List[str],
+                 new_chunks: Dict[str, Tuple[Any, List[float]]]):
+        """Mark chunk_ids as the latest retrieved; new_chunks maps ids not yet held to (Document, vector)"""
+        import numpy as np
+
+        with self._lock:
+            working_set = self._get(session_id, collection)
+            if working_set is None:
+                working_set = self._sessions[session_id] = SessionWorkingSet(collection)
+            for chunk_id in chunk_ids:
+                if chunk_id in working_set.chunks:
+                    working_set.chunks.move_to_end(chunk_id)
+                elif chunk_id in new_chunks:
+                    doc, vector = new_chunks[chunk_id]
+                    working_set.chunks[chunk_id] = (doc, np.asarray(vector, dtype=np.float16))
+            while len(working_set.chunks) > self.max_chunks:
+                working_set.chunks.popitem(last=False)
+            working_set.touched_at = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def search(self, session_id: str, collection: str, query_embedding: List[float]) -> List[Tuple[str, Any, float]]:
+        """(chunk id, Document, cosine similarity) for the session's chunks, most similar first"""
+        import numpy as np
+
+        with self._lock:
+            working_set = self._get(session_id, collection)
+            entries = list(working_set.chunks.items()) if working_set else []
+        if not entries:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        vectors = np.stack([vector for _, (_, vector) in entries]).astype(np.float32)
+        similarity = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-12)
+        order = np.argsort(-similarity, kind="stable")
+        return [(entries[i][0], entries[i][1][0], float(similarity[i])) for i in order]
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": WORKING_SET_ENABLED,
+                "sessions": len(self._sessions),
+                "chunks": sum(len(ws.chunks) for ws in self._sessions.values()),
+                "bytes": sum(ws.nbytes() for ws in self._sessions.values()),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else None,
+            }
+
+
+_WORKING_SETS: Optional[WorkingSetStore] = None
+_WORKING_SETS_LOCK = threading.Lock()
+
+
+def get_working_sets() -> WorkingSetStore:
+    """Process-wide working set store, created on first use"""
+    global _WORKING_SETS
+    if _WORKING_SETS is None:
+        with _WORKING_SETS_LOCK:
+            if _WORKING_SETS is None:
+                _WORKING_SETS = WorkingSetStore()
+    return _WORKING_SETS
@@ -362,6 +362,14 @@ def upload_pdf(file):
                     - Content chunks: {result['chunk_types'].get('content', 0)}
                     """)
                 
+                if result.get('embedding'):
+                    embedding = result['embedding']
+                    st.caption(
+                        f"Embedded {embedding['chunks']} chunks in {embedding['seconds']}s "
+                        f"({embedding['chunks_per_sec']} chunks/s, {embedding['tokens_per_sec']} tokens/s, "
+                        f"{embedding['batches']} batches)"
+                    )
+                
                 # Update system stats
                 check_backend_connection()
                 return True
@@ -369,6 +377,10 @@ def upload_pdf(file):
             elif response.status_code == 400:
                 error_data = response.json()
                 st.error(f"❌ Upload failed: {error_data.get('detail', 'Bad request')}")
+            elif response.status_code == 503:
+                retry_after = response.headers.get("Retry-After", "a few")
+                st.warning(f"🚦 The server is busy processing other manuals. Please try again in {retry_after} seconds.")
+                return False
             else:
                 st.error(f"❌ Upload failed with status {response.status_code}")
                 return False
@@ -422,11 +434,19 @@ def send_message(message):
                 "role": "assistant",
                 "content": result["answer"],
                 "sources": result.get("sources", []),
+                "safety_notices": result.get("safety_notices", []),
                 "context_used": result.get("context_used", 0),
+                "usage": result.get("usage"),
+                "degraded": (result.get("budget") or {}).get("level") == "degraded",
                 "message_type": message_type,
                 "timestamp": datetime.now().strftime("%H:%M:%S")
             })
             
+        elif response.status_code == 429:
+            st.error(f"💸 {response.json().get('detail', 'Usage budget exceeded')}")
+        elif response.status_code == 503:
+            retry_after = response.headers.get("Retry-After", "a few")
+            st.warning(f"🚦 The assistant is busy right now. Please try again in {retry_after} seconds.")
         elif response.status_code == 500:
             error_data = response.json()
             st.error(f"❌ Server error: {error_data.get('detail', 'Internal server error')}")
@@ -503,10 +523,29 @@ def format_chat_message(message, role):
                     html += f'<span class="source-badge">{safe_source}</span> '
             html += '</div>'
         
+        # Safety blocks on the pages the answer came from
+        if message.get("safety_notices"):
+            html += '<div class="source-section"><div style="margin-bottom: 8px;">⚠️ Safety notices on these pages:</div>'
+            for notice in message["safety_notices"]:
+                safe_notice = str(notice.get("text", "")).replace('<', '&lt;').replace('>', '&gt;')
+                location = f"page {notice.get('page')}" + (f", {notice['section']}" if notice.get("section") else "")
+                safe_location = location.replace('<', '&lt;').replace('>', '&gt;')
+                if notice.get("truncated"):
+                    safe_notice += " <i>(shortened; read the full warning on that page)</i>"
+                html += f'<div style="margin-bottom: 6px;"><b>{safe_location}:</b> {safe_notice}</div>'
+            html += '</div>'
+        
         # Add context usage info
         if message.get("context_used"):
             html += f'<br><div style="font-size: 0.8rem; color: #666666; margin-top: 8px;"><i>📖 Used {message["context_used"]} document sections</i></div>'
         
+        # Tokens and estimated cost of this turn
+        if message.get("usage"):
+            usage = message["usage"]
+            cached = f' ({usage["cached_tokens"]} cached)' if usage.get("cached_tokens") else ""
+            note = " · reduced mode (budget nearly used)" if message.get("degraded") else ""
+            html += f'<div style="font-size: 0.8rem; color: #666666;"><i>🪙 {usage["total_tokens"]} tokens{cached}, ${usage["cost_usd"]:.4f}{note}</i></div>'
+        
         html += '</div>'
         return html
 
@@ -520,12 +559,15 @@ with st.sidebar:
         
         # Display system stats
         with st.expander("📊 **System Statistics**", expanded=True):
+            # None when the session store cannot report it (e.g. Redis without INFO access)
+            memory_size = st.session_state.system_stats.get('memory_size')
+            memory_usage = f"{memory_size:,} bytes" if memory_size is not None else "n/a"
             st.markdown(f'''
             <div class="stats-box">
             📚 **Documents in DB:** {st.session_state.system_stats.get('documents_in_db', 0)}<br>
             💬 **Active Sessions:** {st.session_state.system_stats.get('active_sessions', 0)}<br>
             🗣️ **Total Messages:** {st.session_state.system_stats.get('total_messages', 0)}<br>
-            💾 **Memory Usage:** {st.session_state.system_stats.get('memory_size', 0):,} chars
+            💾 **Memory Usage:** {memory_usage}
             </div>
             ''', unsafe_allow_html=True)
     else:
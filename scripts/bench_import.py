@@ -0,0 +1,95 @@
+"""Import-time benchmark for the API process.
+
+Imports `app.main` in fresh interpreters and reports wall time, the slowest
+modules (from `python -X importtime`) and whether any heavy dependency was
+pulled in eagerly. Exits non-zero on a regression so it can gate CI.
+
+    python -m scripts.bench_import --runs 5 --max-seconds 1.0
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+# Must stay out of `import app.main`; they are loaded on first use / by the warm-up hook
+FORBIDDEN_MODULES = [
+    "langchain_openai",
+    "langchain_chroma",
+    "langchain_community",
+    "langchain_text_splitters",
+    "chromadb",
+    "openai",
+    "boto3",
+]
+
+PROBE = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "import {module}\n"
+    "elapsed = time.perf_counter() - start\n"
+    "print(json.dumps({{'seconds': elapsed, 'modules': sorted(sys.modules)}}))\n"
+)
+
+
+def run_probe(module: str, env: Dict[str, str]) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module: str, env: Dict[str, str], top: int) -> List[tuple]:
+    """Top modules by cumulative import time (microseconds) from -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        # "import time:       self |  cumulative |   package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API import time")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail if the median exceeds this")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "import-benchmark")
+    env["WARMUP_ON_START"] = "false"
+
+    probes = [run_probe(args.module, env) for _ in range(args.runs)]
+    timings = [probe["seconds"] for probe in probes]
+    loaded = set(probes[-1]["modules"])
+    leaked = [name for name in FORBIDDEN_MODULES if name in loaded]
+
+    print(f"⏱️  import {args.module}: median {statistics.median(timings):.3f}s "
+          f"(min {min(timings):.3f}s, max {max(timings):.3f}s, {args.runs} runs)")
+    print(f"\n{'cumulative ms':>14}{'self ms':>10}  module")
+    for cumulative_us, self_us, name in slowest_imports(args.module, env, args.top):
+        print(f"{cumulative_us / 1000:>14.1f}{self_us / 1000:>10.1f}  {name}")
+
+    failed = False
+    if leaked:
+        print(f"\n❌ Heavy modules imported eagerly: {', '.join(leaked)}")
+        failed = True
+    if args.max_seconds is not None and statistics.median(timings) > args.max_seconds:
+        print(f"\n❌ Median import time above {args.max_seconds:.3f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
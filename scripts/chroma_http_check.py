@@ -0,0 +1,146 @@
+"""Multi-worker check for CHROMA_MODE=http against a locally launched Chroma server.
+
+Starts `chroma run` on a throwaway directory, then runs several worker
+processes that each open the store through `app.vectorstore` (as uvicorn
+workers would), write a batch of chunks and query it. Checks that every
+worker sees every other worker's writes, i.e. they share one index.
+
+No OpenAI calls are made: vectors come from app.local_embeddings.
+
+    python -m scripts.chroma_http_check --workers 4 --docs-per-worker 200
+    python -m scripts.chroma_http_check --no-spawn --port 8001   # existing server
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import requests
+
+from app.local_embeddings import hash_embedding
+
+COLLECTION = "chroma_http_check"
+DIMENSIONS = 256
+
+
+def wait_for(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.5)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def run_worker(worker: int, docs: int, workers: int) -> dict:
+    """One 'uvicorn worker': write docs through the shared store, then query it"""
+    from app.vectorstore import get_vectorstore, get_write_batch_size
+
+    db = get_vectorstore(COLLECTION)
+    texts = [f"worker {worker} chunk {i}: check spindle torque {i}" for i in range(docs)]
+    batch_size = get_write_batch_size(1000)
+
+    start = time.perf_counter()
+    for offset in range(0, docs, batch_size):
+        batch = texts[offset:offset + batch_size]
+        db._collection.add(
+            ids=[f"w{worker}-{offset + i}" for i in range(len(batch))],
+            embeddings=[hash_embedding(text, DIMENSIONS) for text in batch],
+            documents=batch,
+            metadatas=[{"worker": worker} for _ in batch]
+        )
+    write_seconds = time.perf_counter() - start
+
+    # Wait for the other workers, then make sure their chunks are visible here
+    deadline = time.time() + 60
+    while db._collection.count() < docs * workers and time.time() < deadline:
+        time.sleep(0.2)
+
+    latencies = []
+    seen_workers = set()
+    for i in range(20):
+        query = hash_embedding(f"worker {(worker + i) % workers} chunk {i}: check spindle torque {i}", DIMENSIONS)
+        start = time.perf_counter()
+        results = db.similarity_search_by_vector_with_relevance_scores(query, k=4)
+        latencies.append(time.perf_counter() - start)
+        seen_workers.update(doc.metadata["worker"] for doc, _ in results)
+
+    return {
+        "worker": worker,
+        "pid": os.getpid(),
+        "write_seconds": write_seconds,
+        "count": db._collection.count(),
+        "seen_workers": sorted(seen_workers),
+        "query_p50_ms": statistics.median(latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check CHROMA_MODE=http with several worker processes")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--docs-per-worker", type=int, default=200)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--no-spawn", action="store_true", help="Use an already running Chroma server")
+    args = parser.parse_args()
+
+    # Inherited by the spawned workers before they import app.vectorstore
+    os.environ.update({
+        "CHROMA_MODE": "http",
+        "CHROMA_HOST": args.host,
+        "CHROMA_PORT": str(args.port),
+    })
+    os.environ.setdefault("OPENAI_API_KEY", "chroma-http-check")
+
+    server = None
+    data_dir = None
+    if not args.no_spawn:
+        data_dir = tempfile.mkdtemp(prefix="chroma-http-check-")
+        server = subprocess.Popen(
+            ["chroma", "run", "--path", data_dir, "--host", args.host, "--port", str(args.port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+        )
+    try:
+        wait_for(f"http://{args.host}:{args.port}/api/v2/heartbeat")
+
+        import chromadb
+        admin = chromadb.HttpClient(host=args.host, port=args.port)
+        if COLLECTION in [c.name for c in admin.list_collections()]:
+            admin.delete_collection(COLLECTION)
+
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(args.workers) as pool:
+            results: List[dict] = pool.starmap(
+                run_worker, [(worker, args.docs_per_worker, args.workers) for worker in range(args.workers)]
+            )
+
+        expected = args.workers * args.docs_per_worker
+        failed = False
+        print(f"{'worker':>6}{'pid':>8}{'write s':>10}{'count':>8}{'query p50 ms':>14}  workers seen")
+        for result in results:
+            print(f"{result['worker']:>6}{result['pid']:>8}{result['write_seconds']:>10.2f}"
+                  f"{result['count']:>8}{result['query_p50_ms']:>14.1f}  {result['seen_workers']}")
+            if result["count"] != expected or len(result["seen_workers"]) < min(args.workers, 2):
+                failed = True
+
+        print(f"\n{'❌' if failed else '✅'} {args.workers} workers, expected {expected} chunks in one shared index")
+        admin.delete_collection(COLLECTION)
+        sys.exit(1 if failed else 0)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        if data_dir is not None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
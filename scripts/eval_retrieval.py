@@ -0,0 +1,572 @@
+"""Offline retrieval evaluation: quality, context size and latency per configuration.
+
+Ingests a corpus of PDFs with deterministic local embeddings (no API calls),
+runs the retrieval half of answer_question (classify → exact terms / vector
+search → reorder → safety digest) for a labeled question set, and reports
+per configuration, side by side:
+
+  recall@k      share of a question's expected (source, page) labels in the top k chunks
+  MRR           mean reciprocal rank of the first chunk on an expected page
+  ctx tokens    prompt context size (chunks + safety notices)
+  latency       per-question p50/p95 and mean time per retrieval stage
+  index size    bytes of vectors held by the Chroma index (and by the full-vector side store)
+
+Everything runs in a throwaway work directory, so data/ is never touched.
+
+Built-in fixture corpus and questions, current settings only (--distractors N
+adds N generated noise pages, for an index big enough to measure search cost):
+    python -m scripts.eval_retrieval
+
+Your own corpus, several configurations, with gates for CI (exit code 1 on failure):
+    python -m scripts.eval_retrieval --corpus manuals/ --questions questions.jsonl \\
+        --configs configs.json --min-recall 0.8 --min-mrr 0.6 --output results.json
+
+questions.jsonl, one object per line (pages are 1-based, as printed; page may be omitted):
+    {"question": "What does fault F0712 mean?", "expected": [{"source": "mill.pdf", "page": 4}],
+     "type": "troubleshooting"}
+
+configs.json maps a name to settings overriding app.retrieval / app.ingestion
+constants (dicts are merged per key, so only the changed profiles are needed):
+    {"baseline": {},
+     "chunk_900": {"CHUNK_SIZE": 900, "CHUNK_OVERLAP": 180},
+     "diverse": {"MMR_LAMBDA_MULT": 0.5, "RETRIEVAL_PROFILES": {"general": {"k": 8, "keep": 5}}},
+     "no_exact": {"EXACT_TERM_TYPES": []},
+     "dims_256": {"EMBED_INDEX_DIMENSIONS": 256}}
+"""
+import argparse
+import copy
+import glob
+import hashlib
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import textwrap
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Settings a configuration may override → module that owns them
+OVERRIDABLE = {
+    "CHUNK_SIZE": "ingestion",
+    "CHUNK_OVERLAP": "ingestion",
+    "QUESTION_TYPE_KEYWORDS": "retrieval",
+    "RETRIEVAL_PROFILES": "retrieval",
+    "PROBE_K": "retrieval",
+    "EARLY_EXIT_MIN_SCORE": "retrieval",
+    "EARLY_EXIT_MARGIN": "retrieval",
+    "FLAT_SCORE_SPREAD": "retrieval",
+    "WIDEN_FACTOR": "retrieval",
+    "MAX_FETCH_K": "retrieval",
+    "MMR_LAMBDA_MULT": "retrieval",
+    "EXACT_TERM_TYPES": "retrieval",
+    "EXACT_MAX_CANDIDATES": "retrieval",
+    "SHORTLIST_CANDIDATES": "retrieval",
+    "EMBED_INDEX_DIMENSIONS": "vectorstore",
+}
+# Changing these needs its own index
+INDEX_SETTINGS = ("CHUNK_SIZE", "CHUNK_OVERLAP", "EMBED_INDEX_DIMENSIONS")
+
+STAGES = ("classify", "term_lookup", "embed", "search", "reorder", "safety_digest")
+DEFAULT_KS = (1, 3, 5)
+
+FIXTURE_MANUALS = {
+    "cnc_mill_manual.pdf": [
+        """1 Introduction
+The VM-400 vertical machining center is a three axis CNC mill for aluminium and steel parts.
+The spindle is the rotating assembly that holds the cutting tool in a BT40 taper and drives it
+through a poly-V belt from the spindle motor. The tool changer is a 24 pocket carousel mounted
+on the left side of the column. The coolant system delivers flood coolant through nozzles
+around the spindle nose and through the spindle for through-tool drills.""",
+        """2 Safety
+Read this chapter before operating or servicing the machine.
+WARNING: Disconnect and lock out the main power supply before opening the electrical cabinet.
+Capacitors in the spindle drive stay charged for five minutes after power is removed.
+CAUTION: Wear safety glasses and keep the enclosure doors closed while the spindle is turning.
+Chips are hot and sharp; remove them with a brush or hook, never with bare hands.
+Only trained personnel may override the door interlock for setup work at reduced speed.""",
+        """3 Spindle Belt Replacement
+Replace the spindle belt every 4000 operating hours or when it shows cracks or glazing.
+1. Switch off the machine and lock out the main power supply at the disconnect switch.
+2. Remove the six screws of the top cover on the spindle head and lift the cover away.
+3. Loosen the four motor mounting bolts and slide the spindle motor toward the spindle.
+4. Take the old poly-V belt off both pulleys and fit the new belt in the same grooves.
+5. Slide the motor back until the belt deflects 5 mm under a 40 N load at mid span.
+6. Tighten the motor mounting bolts, refit the top cover and run the spindle at low speed.""",
+        """4 Fault Codes
+Fault F0712 spindle overtemperature: the spindle motor winding sensor reads above its limit.
+Check the spindle fan, clean the motor cooling fins and reduce the cutting load.
+Fault F0713 spindle drive overcurrent: check the motor cables for damage and the belt tension.
+Error E-23 coolant level low: refill the coolant tank and check the float switch.
+Alarm AL-305 way lube pressure low: refill the way oil reservoir and bleed the lube pump.""",
+        """5 Specifications
+Spindle maximum speed 12000 rpm, spindle motor power 11 kW.
+Tightening torque for the M8 spindle head bolts 25 Nm, for the M10 motor bolts 49 Nm.
+Coolant pump pressure 6 bar, through-spindle coolant pressure 20 bar.
+Supply voltage 400 VAC three phase, 50 Hz. Air supply 6 bar, dry and filtered.
+Table load capacity 300 kg. Positioning accuracy 0.005 mm over full travel.""",
+    ],
+    "hydraulic_press_manual.pdf": [
+        """1 Introduction
+The HP-200 is a four column hydraulic press with a nominal force of 2000 kN.
+The ram is driven by a double acting cylinder supplied by a variable displacement piston pump.
+A proportional valve controls ram speed; the two hand control station starts each stroke.
+The press is intended for forming, straightening and press fitting of metal parts.""",
+        """2 Safety
+WARNING: Relieve hydraulic pressure and lower the ram onto blocks before working in the tool area.
+Escaping hydraulic oil under pressure can penetrate the skin and cause serious injury.
+DANGER: Never bypass the light curtain or the two hand control. Crushing hazard between the dies.
+Lock out the main disconnect and the pump motor before any maintenance on the hydraulic unit.""",
+        """3 Hydraulic Oil Change
+Change the hydraulic oil every 2000 operating hours or once a year, whichever comes first.
+1. Lower the ram onto safety blocks, switch off the pump and relieve the accumulator pressure.
+2. Drain the tank through the drain valve into a container of at least 250 litres capacity.
+3. Replace the return line filter element and clean the suction strainer in solvent.
+4. Fill the tank through the filler filter with new oil up to the upper mark of the sight glass.
+5. Start the pump, cycle the ram several strokes to bleed air and top up the oil level.""",
+        """4 Alarms
+Alarm AL-101 system pressure low: check the pump coupling and the relief valve setting.
+Alarm AL-205 oil temperature high: check the oil cooler fan and clean the cooler fins.
+Alarm AL-310 light curtain interrupted: clear the protected zone and press reset.
+Alarm AL-412 filter clogged: replace the return line filter element.""",
+        """5 Technical Data
+Nominal press force 2000 kN. Maximum system pressure 210 bar.
+Ram speed: approach 120 mm/s, pressing 12 mm/s, return 150 mm/s.
+Pump motor 400 VAC, 7.5 kW. Oil tank capacity 220 l, oil grade ISO VG 46.
+Oil operating temperature 30 to 55 °C, alarm at 60 °C.""",
+    ],
+}
+
+FIXTURE_QUESTIONS = [
+    {"question": "What does fault F0712 mean?", "type": "troubleshooting",
+     "expected": [{"source": "cnc_mill_manual.pdf", "page": 4}]},
+    {"question": "How do I fix error E-23?", "type": "troubleshooting",
+     "expected": [{"source": "cnc_mill_manual.pdf", "page": 4}]},
+    {"question": "What causes alarm AL-205 on the press?", "type": "troubleshooting",
+     "expected": [{"source": "hydraulic_press_manual.pdf", "page": 4}]},
+    {"question": "The press shows a filter clogged alarm, what should I do?", "type": "troubleshooting",
+     "expected": [{"source": "hydraulic_press_manual.pdf", "page": 4}]},
+    {"question": "What is the tightening torque for the M8 spindle head bolts?", "type": "specification",
+     "expected": [{"source": "cnc_mill_manual.pdf", "page": 5}]},
+    {"question": "torque for M8 bolt", "type": "specification",
+     "expected": [{"source": "cnc_mill_manual.pdf", "page": 5}]},
+    {"question": "What is the maximum system pressure of the hydraulic press?", "type": "specification",
+     "expected": [{"source": "hydraulic_press_manual.pdf", "page": 5}]},
+    {"question": "Which oil grade does the hydraulic tank use?", "type": "general",
+     "expected": [{"source": "hydraulic_press_manual.pdf", "page": 5}]},
+    {"question": "How to replace the spindle belt?", "type": "procedure",
+     "expected": [{"source": "cnc_mill_manual.pdf", "page": 3}]},
+    {"question": "What are the steps to change the hydraulic oil?", "type": "procedure",
+     "expected": [{"source": "hydraulic_press_manual.pdf", "page": 3}]},
+    {"question": "What safety precautions apply before opening the electrical cabinet?", "type": "safety",
+     "expected": [{"source": "cnc_mill_manual.pdf", "page": 2}]},
+    {"question": "Is there a crushing hazard at the press dies?", "type": "safety",
+     "expected": [{"source": "hydraulic_press_manual.pdf", "page": 2}]},
+    {"question": "What is the spindle?", "type": "definition",
+     "expected": [{"source": "cnc_mill_manual.pdf", "page": 1}]},
+    {"question": "Explain the purpose of the proportional valve on the press", "type": "definition",
+     "expected": [{"source": "hydraulic_press_manual.pdf", "page": 1}]},
+    {"question": "How many pockets does the tool changer carousel have?", "type": "general",
+     "expected": [{"source": "cnc_mill_manual.pdf", "page": 1}]},
+]
+
+# Exact terms the term index must (and must not) pull out of text; checked on every run
+TERM_CHECKS = [
+    ("what does fault F0712 mean", {"F0712": "code"}),
+    ("torque for M8 bolt", {"M8": "size"}),
+    ("Tighten the M8 bolts to 25 Nm", {"M8": "size", "25nm": "spec"}),
+    ("Alarm AL-305 way lube pressure low", {"AL305": "code"}),
+    ("replace bearing P/N 6204-2RS", {"62042RS": "part"}),
+    ("oil changed on 2020-01-15", {}),
+]
+
+
+def _write_pdf(path: str, pages: List[str]):
+    import pymupdf
+
+    pdf = pymupdf.open()
+    for text in pages:
+        page = pdf.new_page()
+        y = 72
+        for paragraph in text.splitlines():
+            for line in textwrap.wrap(paragraph, 95) or [""]:
+                page.insert_text((54, y), line, fontsize=9)
+                y += 13
+    pdf.save(path)
+    pdf.close()
+
+
+def distractor_pages(count: int, seed: int = 0) -> List[str]:
+    """Pages of fixture vocabulary in random order: on-topic noise for the labeled pages to compete with"""
+    rng = random.Random(seed)
+    words = sorted({word for pages in FIXTURE_MANUALS.values() for text in pages for word in text.split()})
+    pages = []
+    for _ in range(count):
+        sentences = [" ".join(rng.choices(words, k=rng.randint(12, 20))) + "." for _ in range(6)]
+        pages.append("\n".join(sentences))
+    return pages
+
+
+def write_fixture(directory: str, distractors: int = 0) -> str:
+    """Write the built-in manuals (plus distractor pages) as PDFs and questions.jsonl; returns the questions path"""
+    os.makedirs(directory, exist_ok=True)
+    for name, pages in FIXTURE_MANUALS.items():
+        _write_pdf(os.path.join(directory, name), pages)
+    extra = distractor_pages(distractors)
+    for number, offset in enumerate(range(0, len(extra), 20), 1):
+        _write_pdf(os.path.join(directory, f"distractor_{number:03d}.pdf"), extra[offset:offset + 20])
+
+    questions_path = os.path.join(directory, "questions.jsonl")
+    with open(questions_path, "w") as f:
+        for item in FIXTURE_QUESTIONS:
+            f.write(json.dumps(item) + "\n")
+    return questions_path
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """Labeled questions from a JSON list or JSON lines; "source"/"page" may be given instead of "expected" """
+    with open(path) as f:
+        text = f.read()
+    items = json.loads(text) if text.lstrip().startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+    questions = []
+    for item in items:
+        expected = item.get("expected") or [{"source": item["source"], "page": item.get("page")}]
+        questions.append({
+            "question": item["question"],
+            "type": item.get("type"),
+            "expected": [{"source": os.path.basename(label["source"]), "page": label.get("page")} for label in expected],
+        })
+    return questions
+
+
+def load_configs(path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    if not path:
+        return {"baseline": {}}
+    with open(path) as f:
+        configs = json.load(f)
+    for name, overrides in configs.items():
+        unknown = [key for key in overrides if key.upper() not in OVERRIDABLE]
+        if unknown:
+            raise SystemExit(f"config {name}: unknown settings {unknown}; allowed: {sorted(OVERRIDABLE)}")
+    return {name: {key.upper(): value for key, value in overrides.items()} for name, overrides in configs.items()}
+
+
+def _merged(current: Any, override: Any) -> Any:
+    if isinstance(current, dict) and isinstance(override, dict):
+        merged = copy.deepcopy(current)
+        for key, value in override.items():
+            merged[key] = _merged(merged.get(key), value)
+        return merged
+    if isinstance(current, tuple) and isinstance(override, list):
+        return tuple(override)
+    return override
+
+
+@contextmanager
+def apply_overrides(overrides: Dict[str, Any]):
+    """Temporarily set module constants for one configuration"""
+    import app.ingestion
+    import app.retrieval
+    import app.vectorstore
+
+    modules = {"ingestion": app.ingestion, "retrieval": app.retrieval, "vectorstore": app.vectorstore}
+    saved = []
+    try:
+        for key, value in overrides.items():
+            module = modules[OVERRIDABLE[key]]
+            saved.append((module, key, getattr(module, key)))
+            setattr(module, key, _merged(getattr(module, key), value))
+        yield
+    finally:
+        for module, key, value in reversed(saved):
+            setattr(module, key, value)
+
+
+def collection_for(overrides: Dict[str, Any]) -> str:
+    """One index per distinct chunking / index dimensions; configurations that only change retrieval share it"""
+    settings = {key: overrides[key] for key in INDEX_SETTINGS if key in overrides}
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+    return f"eval_{digest}"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(pct / 100 * len(ordered))) - 1]
+
+
+def matches(doc, label: Dict[str, Any]) -> bool:
+    if os.path.basename(doc.metadata.get("source", "")) != label["source"]:
+        return False
+    # Chunk metadata pages are 0-based, labels 1-based
+    return label["page"] is None or int(doc.metadata.get("page", -1)) + 1 == int(label["page"])
+
+
+def score_question(docs: List, expected: List[Dict[str, Any]], ks: List[int]) -> Dict[str, Any]:
+    def recall(top: List) -> float:
+        return sum(1 for label in expected if any(matches(doc, label) for doc in top)) / len(expected)
+
+    first_hit = next((rank for rank, doc in enumerate(docs, 1) if any(matches(doc, label) for label in expected)), None)
+    return {
+        **{f"recall@{k}": recall(docs[:k]) for k in ks},
+        "recall_context": recall(docs),
+        "reciprocal_rank": 1.0 / first_hit if first_hit else 0.0,
+        "first_hit": first_hit,
+    }
+
+
+def ingest_corpus(pdfs: List[str], collection: str) -> Dict[str, Any]:
+    from app.ingestion import ingest_pdf
+    from app.vectorstore import get_index_dimensions, get_vectorstore
+
+    start = time.perf_counter()
+    chunks = 0
+    for path in pdfs:
+        added, _, _ = ingest_pdf(path, collection_name=collection)
+        chunks += added
+    seconds = time.perf_counter() - start
+
+    # Vector payload only; HNSW graph links add about the same per vector at any dimension
+    db = get_vectorstore(collection)
+    count = db._collection.count()
+    full_dimensions = len(db.embeddings.embed_query("dimensions"))
+    index_dimensions = get_index_dimensions(db) or full_dimensions
+    shortened = index_dimensions < full_dimensions
+    return {
+        "chunks": chunks,
+        "seconds": round(seconds, 3),
+        "index_dimensions": index_dimensions,
+        "index_vector_kb": round(count * index_dimensions * 4 / 1024, 1),
+        "full_vector_kb": round(count * full_dimensions * 4 / 1024, 1) if shortened else 0,
+    }
+
+
+def evaluate_config(overrides: Dict[str, Any], collection: str, questions: List[Dict[str, Any]],
+                    ks: List[int], repeat: int) -> Dict[str, Any]:
+    """Run every question through the retrieval pipeline under overrides and aggregate the scores"""
+    from app.metrics import STAGE_LATENCY, stage_timer
+    from app.retrieval import build_context, classify_question, format_safety_notices, retrieve_context
+    from app.tokens import count_tokens
+    from app.vectorstore import get_vectorstore
+
+    db = get_vectorstore(collection)
+    per_question = []
+    latencies = []
+    modes: Dict[str, int] = {}
+
+    with apply_overrides(overrides):
+        def run(question: str):
+            start = time.perf_counter()
+            with stage_timer("eval", "classify"):
+                question_type = classify_question(question)
+
+            def embed_query() -> List[float]:
+                with stage_timer("eval", "embed"):
+                    return db.embeddings.embed_query(question)
+
+            docs, depth, notices = retrieve_context(db, question, question_type, embed_query, pipeline="eval")
+            return question_type, docs, depth, notices, time.perf_counter() - start
+
+        run(questions[0]["question"])  # warm-up: first query pays for imports and opening the index
+        before = {stage: STAGE_LATENCY.summary(pipeline="eval", stage=stage) for stage in STAGES}
+
+        for item in questions:
+            for attempt in range(repeat):
+                question_type, docs, depth, notices, seconds = run(item["question"])
+                latencies.append(seconds)
+            context_tokens = count_tokens(build_context(docs)) + count_tokens(format_safety_notices(notices))
+            modes[depth["mode"]] = modes.get(depth["mode"], 0) + 1
+            per_question.append({
+                "question": item["question"],
+                "question_type": question_type,
+                "type_correct": None if item["type"] is None else question_type == item["type"],
+                "mode": depth["mode"],
+                "context_chunks": len(docs),
+                "context_tokens": context_tokens,
+                "retrieved": [
+                    f"{os.path.basename(doc.metadata.get('source', ''))} p{int(doc.metadata.get('page', -1)) + 1}"
+                    for doc in docs
+                ],
+                **score_question(docs, item["expected"], ks),
+            })
+
+    stages = {}
+    for stage in STAGES:
+        after = STAGE_LATENCY.summary(pipeline="eval", stage=stage)
+        calls = after["count"] - before[stage]["count"]
+        if calls:
+            stages[stage] = round((after["sum"] - before[stage]["sum"]) / calls * 1000, 3)
+
+    n = len(per_question)
+    typed = [q["type_correct"] for q in per_question if q["type_correct"] is not None]
+    return {
+        "collection": collection,
+        "questions": n,
+        **{f"recall@{k}": round(sum(q[f"recall@{k}"] for q in per_question) / n, 4) for k in ks},
+        "recall_context": round(sum(q["recall_context"] for q in per_question) / n, 4),
+        "mrr": round(sum(q["reciprocal_rank"] for q in per_question) / n, 4),
+        "type_accuracy": round(sum(typed) / len(typed), 4) if typed else None,
+        "context_tokens_mean": round(sum(q["context_tokens"] for q in per_question) / n, 1),
+        "context_chunks_mean": round(sum(q["context_chunks"] for q in per_question) / n, 2),
+        "latency_ms_p50": round(percentile(latencies, 50) * 1000, 3),
+        "latency_ms_p95": round(percentile(latencies, 95) * 1000, 3),
+        "stage_ms_mean": stages,
+        "modes": modes,
+        "per_question": per_question,
+    }
+
+
+def print_table(results: Dict[str, Dict[str, Any]], ks: List[int]):
+    columns = [f"recall@{k}" for k in ks] + ["recall_context", "mrr", "type_accuracy",
+                                             "context_tokens_mean", "latency_ms_p50", "latency_ms_p95"]
+    columns += [f"{stage}_ms" for stage in STAGES if any(stage in r["stage_ms_mean"] for r in results.values())]
+    columns += ["index_dimensions", "index_vector_kb", "full_vector_kb"]
+    names = list(results)
+    modes = {name: ",".join(f"{mode}:{count}" for mode, count in sorted(results[name]["modes"].items())) for name in names}
+    label_width = max(len(column) for column in columns + ["config"])
+    width = max(12, *(len(name) + 2 for name in names))
+
+    print("config".ljust(label_width) + "".join(name.rjust(width) for name in names))
+    for column in columns:
+        cells = []
+        for name in names:
+            result = results[name]
+            if column.endswith("_ms"):
+                value = result["stage_ms_mean"].get(column[:-3])
+            else:
+                value = result.get(column, result["index"].get(column))
+            cells.append(("-" if value is None else f"{value:g}").rjust(width))
+        print(column.ljust(label_width) + "".join(cells))
+    print("\nretrieval modes:")
+    for name in names:
+        print(f"  {name}: {modes[name]}")
+
+
+def check_terms() -> List[str]:
+    from app.term_index import extract_terms
+
+    return [f"terms: extract_terms({text!r}) = {extract_terms(text)}, expected {expected}"
+            for text, expected in TERM_CHECKS if extract_terms(text) != expected]
+
+
+def check_gates(results: Dict[str, Dict[str, Any]], args) -> List[str]:
+    failures = check_terms()
+    for name, result in results.items():
+        if args.min_recall is not None and result["recall_context"] < args.min_recall:
+            failures.append(f"{name}: recall_context {result['recall_context']} < {args.min_recall}")
+        if args.min_mrr is not None and result["mrr"] < args.min_mrr:
+            failures.append(f"{name}: mrr {result['mrr']} < {args.min_mrr}")
+        if args.max_context_tokens is not None and result["context_tokens_mean"] > args.max_context_tokens:
+            failures.append(f"{name}: context_tokens_mean {result['context_tokens_mean']} > {args.max_context_tokens}")
+        if args.max_p95_ms is not None and result["latency_ms_p95"] > args.max_p95_ms:
+            failures.append(f"{name}: latency_ms_p95 {result['latency_ms_p95']} > {args.max_p95_ms}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", nargs="*", help="PDF files or directories (default: built-in fixture)")
+    parser.add_argument("--questions", help="labeled questions, JSON lines or a JSON list (default: built-in)")
+    parser.add_argument("--configs", help="JSON file of named setting overrides (default: current settings)")
+    parser.add_argument("--embeddings", choices=["local", "openai"], default="local",
+                        help="local: deterministic hash embeddings (default); openai: the real model, needs OPENAI_API_KEY")
+    parser.add_argument("--k", type=int, nargs="+", default=list(DEFAULT_KS), help="cut-offs for recall@k")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per question (latency only)")
+    parser.add_argument("--output", help="write full results (including per-question rows) as JSON")
+    parser.add_argument("--show-misses", action="store_true", help="list questions whose context missed every label")
+    parser.add_argument("--workdir", help="keep the indexes here instead of a deleted temp directory")
+    parser.add_argument("--write-fixture", metavar="DIR", help="only write the built-in corpus and questions to DIR")
+    parser.add_argument("--distractors", type=int, default=0,
+                        help="add this many generated noise pages to the built-in corpus (a bigger index)")
+    parser.add_argument("--min-recall", type=float, help="fail if any config's context recall is lower")
+    parser.add_argument("--min-mrr", type=float, help="fail if any config's MRR is lower")
+    parser.add_argument("--max-context-tokens", type=float, help="fail if any config's mean context is larger")
+    parser.add_argument("--max-p95-ms", type=float, help="fail if any config's p95 retrieval latency is higher")
+    args = parser.parse_args()
+
+    if args.write_fixture:
+        print(f"wrote {write_fixture(args.write_fixture, args.distractors)}")
+        return
+
+    configs = load_configs(args.configs and os.path.abspath(args.configs))
+    output = args.output and os.path.abspath(args.output)
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="eval_retrieval_")
+    os.makedirs(workdir, exist_ok=True)
+
+    if args.corpus:
+        pdfs = []
+        for path in args.corpus:
+            pdfs += sorted(glob.glob(os.path.join(path, "*.pdf"))) if os.path.isdir(path) else [path]
+        pdfs = [os.path.abspath(path) for path in pdfs]
+        if not args.questions:
+            parser.error("--questions is required with --corpus")
+        questions_path = os.path.abspath(args.questions)
+    else:
+        fixture_dir = os.path.join(workdir, "fixture")
+        fixture_questions = write_fixture(fixture_dir, args.distractors)
+        pdfs = sorted(glob.glob(os.path.join(fixture_dir, "*.pdf")))
+        questions_path = os.path.abspath(args.questions) if args.questions else fixture_questions
+    questions = load_questions(questions_path)
+    if not pdfs or not questions:
+        raise SystemExit("need at least one PDF and one labeled question")
+
+    # Isolated run: every store under the work directory, offline unless --embeddings openai.
+    # Must be set before app modules are imported (they read settings at import time).
+    os.environ.update({
+        "EMBEDDINGS_PROVIDER": args.embeddings,
+        "CHROMA_MODE": "embedded",
+        "TERM_INDEX_DB": "data/term_index.db",
+        "FULL_VECTORS_DB": "data/full_vectors.db",
+        "SAFETY_DIGEST_DB": "data/safety_digest.db",
+        "COLLECTION_ALIASES_PATH": "data/collection_aliases.json",
+    })
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+
+    results = {}
+    indexes = {}
+    try:
+        for name, overrides in configs.items():
+            collection = collection_for(overrides)
+            if collection not in indexes:
+                with apply_overrides({key: overrides[key] for key in INDEX_SETTINGS if key in overrides}):
+                    indexes[collection] = ingest_corpus(pdfs, collection)
+                print(f"indexed {len(pdfs)} PDFs into {collection}: {indexes[collection]['chunks']} chunks "
+                      f"in {indexes[collection]['seconds']}s", file=sys.stderr)
+            results[name] = evaluate_config(overrides, collection, questions, args.k, max(1, args.repeat))
+            results[name]["index"] = indexes[collection]
+    finally:
+        os.chdir(REPO_ROOT)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{len(questions)} questions, {len(pdfs)} PDFs\n")
+    print_table(results, args.k)
+
+    if args.show_misses:
+        for name, result in results.items():
+            misses = [q for q in result["per_question"] if q["recall_context"] == 0]
+            print(f"\n{name}: {len(misses)} missed")
+            for q in misses:
+                print(f"  [{q['question_type']}/{q['mode']}] {q['question']} → {', '.join(q['retrieved']) or '(nothing)'}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump({"configs": configs, "results": results}, f, indent=2)
+
+    failures = check_gates(results, args)
+    for failure in failures:
+        print(f"GATE FAILED {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""Local OpenAI-compatible stand-in for load testing without API spend.
+
+Implements the endpoints ChatOpenAI and OpenAIEmbeddings call:
+
+    POST /v1/chat/completions   (plain and stream=true)
+    POST /v1/embeddings         (string or token-id inputs, optional `dimensions`)
+    GET  /v1/models
+
+Responses are deterministic for a given request. Latency is modelled as a
+fixed per-request delay plus token count divided by a token rate, so runs
+are repeatable and independent of OpenAI's latency. Prompt caching is
+emulated like OpenAI's: a prompt whose first 1024+ tokens (in 128-token
+steps; see --prompt-cache-min-tokens) match an earlier prompt reports them
+as cached_tokens.
+
+Usage:
+    python -m scripts.fake_openai --port 9000 --chat-latency-ms 300 --output-tokens-per-sec 80
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1 OPENAI_API_KEY=fake \\
+        python -m uvicorn app.main:app --port 8000
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.local_embeddings import hash_embedding
+
+WORDS = (
+    "check the torque setting before restarting the spindle and verify the "
+    "coolant pressure sensor wiring according to the maintenance procedure"
+).split()
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class PromptPrefixCache:
+    """Hashes of prompt prefixes seen so far, at OpenAI's cache granularity"""
+
+    STEP_TOKENS = 128
+
+    def __init__(self, min_tokens: int = 1024):
+        self.min_tokens = min_tokens
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def cached_tokens(self, messages: list) -> int:
+        """Longest previously seen prefix of this prompt, in tokens; remembers its prefixes"""
+        if self.min_tokens <= 0:
+            return 0
+        prompt = json.dumps([[m.get("role"), str(m.get("content", ""))] for m in messages], ensure_ascii=False)
+        boundaries = range(self.min_tokens, estimate_tokens(prompt) + 1, self.STEP_TOKENS)
+        hashes = [(tokens, hashlib.sha256(prompt[:tokens * 4].encode("utf-8")).digest()) for tokens in boundaries]
+        with self._lock:
+            cached = max((tokens for tokens, digest in hashes if digest in self._seen), default=0)
+            self._seen.update(digest for _, digest in hashes)
+        return cached
+
+
+def fake_completion(messages: list, max_tokens: int, output_tokens: int) -> str:
+    """Deterministic reply: echo the question for rewrite prompts, filler otherwise"""
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    if "Rewritten question:" in prompt:
+        for line in prompt.splitlines():
+            if line.strip().startswith("Current question:"):
+                return line.split(":", 1)[1].strip()
+
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+    count = min(max_tokens or output_tokens, output_tokens)
+    words = [WORDS[(seed >> (i % 64)) % len(WORDS)] for i in range(count)]
+    return "Based on Document 1, " + " ".join(words) + "."
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None  # argparse namespace, set in main()
+    prompt_cache = None  # PromptPrefixCache, set in main()
+
+    def log_message(self, format, *args):
+        if self.config.verbose:
+            super().log_message(format, *args)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json({
+                "object": "list",
+                "data": [
+                    {"id": "gpt-4o", "object": "model", "owned_by": "fake"},
+                    {"id": "text-embedding-3-small", "object": "model", "owned_by": "fake"},
+                ],
+            })
+        else:
+            self._send_json({"error": {"message": "not found"}}, status=404)
+
+    def do_POST(self):
+        try:
+            request = self._read_json()
+        except ValueError:
+            self._send_json({"error": {"message": "invalid JSON"}}, status=400)
+            return
+
+        # Simulated quota errors, to exercise client-side retry and rate limiting
+        if random.random() < self.config.rate_limit_error_rate:
+            body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests"}}).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("retry-after-ms", str(int(self.config.retry_after_ms)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            self._chat(request)
+        elif self.path.rstrip("/").endswith("/embeddings"):
+            self._embeddings(request)
+        else:
+            self._send_json({"error": {"message": "not found"}}, status=404)
+
+    def _chat(self, request: dict):
+        cfg = self.config
+        messages = request.get("messages", [])
+        model = request.get("model", "gpt-4o")
+        content = fake_completion(messages, request.get("max_tokens") or request.get("max_completion_tokens"), cfg.output_tokens)
+        prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+        cached_tokens = min(self.prompt_cache.cached_tokens(messages), prompt_tokens)
+        completion_tokens = estimate_tokens(content)
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+        # Time to first token (cached prompt tokens are not processed again), then generation at a fixed rate
+        time.sleep(cfg.chat_latency_ms / 1000 + (prompt_tokens - cached_tokens) / cfg.input_tokens_per_sec)
+
+        if not request.get("stream"):
+            time.sleep(completion_tokens / cfg.output_tokens_per_sec)
+            self._send_json({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        words = content.split(" ")
+        delay = completion_tokens / cfg.output_tokens_per_sec / max(1, len(words))
+        for i, word in enumerate(words):
+            time.sleep(delay)
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if i == 0 else " " + word},
+                    "finish_reason": None,
+                }],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+
+    def _embeddings(self, request: dict):
+        cfg = self.config
+        inputs = request.get("input", [])
+        # A single string or a single token list are both valid "one input" forms
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = request.get("dimensions") or cfg.embedding_dimensions
+
+        total_tokens = sum(len(i) if not isinstance(i, str) else estimate_tokens(i) for i in inputs)
+        time.sleep(cfg.embedding_latency_ms / 1000 + total_tokens / cfg.embedding_tokens_per_sec)
+
+        self._send_json({
+            "object": "list",
+            "model": request.get("model", "text-embedding-3-small"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": hash_embedding(text, dimensions)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": total_tokens, "total_tokens": total_tokens},
+        })
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0, help="Fixed delay before the first token")
+    parser.add_argument("--input-tokens-per-sec", type=float, default=20000.0, help="Prompt processing rate")
+    parser.add_argument("--output-tokens-per-sec", type=float, default=80.0, help="Generation rate")
+    parser.add_argument("--output-tokens", type=int, default=120, help="Length of generated answers")
+    parser.add_argument("--prompt-cache-min-tokens", type=int, default=1024,
+                        help="Shortest prompt prefix reported as cached (0 disables prompt caching)")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50.0)
+    parser.add_argument("--embedding-tokens-per-sec", type=float, default=200000.0)
+    parser.add_argument("--embedding-dimensions", type=int, default=1536)
+    parser.add_argument("--rate-limit-error-rate", type=float, default=0.0, help="Fraction of POSTs answered with 429")
+    parser.add_argument("--retry-after-ms", type=float, default=200.0, help="retry-after-ms header sent with 429s")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    FakeOpenAIHandler.config = args
+    FakeOpenAIHandler.prompt_cache = PromptPrefixCache(args.prompt_cache_min_tokens)
+    server = ThreadingHTTPServer((args.host, args.port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    print(f"🧪 Fake OpenAI API listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
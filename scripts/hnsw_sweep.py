@@ -0,0 +1,235 @@
+"""HNSW parameter sweep: recall against exact search, query latency, build time and index size.
+
+Builds a Chroma collection for every (M, construction_ef) pair on a sample of
+vectors, queries it at every search_ef, and reports per setting:
+
+  build s       time to add the sample (index construction)
+  index MiB     size of the persisted HNSW files (what a process holds in memory)
+  load ms       first query after opening, which loads the index
+  p50/p95 ms    single-query latency
+  recall@k      share of the exact top k (brute force over the same vectors) returned
+
+Held-out vectors from the sample serve as queries, so they come from the
+same distribution as the indexed ones without being in the index. Everything
+runs in a throwaway directory; the live index is only read.
+
+Synthetic clustered unit vectors (no data needed):
+    python -m scripts.hnsw_sweep --synthetic 20000
+
+A sample of the live collection, at the dimensions its index holds, with a
+recall target to pick an operating point:
+    python -m scripts.hnsw_sweep --collection manufacturing_manuals --sample 50000 \\
+        --m 16 32 48 --construction-ef 100 200 --search-ef 20 50 100 200 --target-recall 0.95
+
+The recommended setting maps to HNSW_M / HNSW_CONSTRUCTION_EF / HNSW_SEARCH_EF
+(see .env.example), which apply to collections created afterwards, e.g. by
+POST /index/rebuild.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADD_BATCH = 5000
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def synthetic_vectors(count: int, dimensions: int, seed: int = 0):
+    """Unit vectors around count / 50 random centres, like embeddings of related chunks"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(max(1, count // 50), dimensions)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    noise = rng.normal(scale=0.8 / np.sqrt(dimensions), size=(count, dimensions)).astype(np.float32)
+    vectors = centres[rng.integers(0, len(centres), size=count)] + noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def collection_vectors(name: str, limit: int):
+    """Up to limit embeddings from an existing collection (or alias), as held by its index"""
+    import numpy as np
+    from app.vectorstore import get_chroma_client, resolve_collection
+
+    collection = get_chroma_client().get_collection(resolve_collection(name))
+    vectors = []
+    while len(vectors) < limit:
+        batch = collection.get(include=["embeddings"], limit=min(ADD_BATCH, limit - len(vectors)), offset=len(vectors))
+        if not len(batch["ids"]):
+            break
+        vectors.extend(batch["embeddings"])
+    if not vectors:
+        raise SystemExit(f"collection {name} has no embeddings")
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def exact_neighbors(index_vectors, queries, k: int):
+    """Row i: positions of the k vectors most similar to query i (vectors are unit length)"""
+    import numpy as np
+
+    neighbors = []
+    for start in range(0, len(queries), 256):
+        similarity = queries[start:start + 256] @ index_vectors.T
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        neighbors.extend(set(row) for row in top)
+    return neighbors
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def open_client(path: str):
+    """A fresh client; clearing the cache makes the next query reload the index (and its search_ef)"""
+    import chromadb
+    from chromadb.api.client import SharedSystemClient
+    from chromadb.config import Settings
+
+    SharedSystemClient.clear_system_cache()
+    return chromadb.PersistentClient(path=path, settings=Settings(anonymized_telemetry=False))
+
+
+def build(path: str, name: str, metadata: Dict[str, Any], vectors) -> float:
+    client = open_client(path)
+    collection = client.create_collection(name, metadata=metadata)
+    start = time.perf_counter()
+    for offset in range(0, len(vectors), ADD_BATCH):
+        batch = vectors[offset:offset + ADD_BATCH]
+        collection.add(ids=[str(offset + i) for i in range(len(batch))], embeddings=batch)
+    return time.perf_counter() - start
+
+
+def measure(path: str, name: str, search_ef: int, queries, truth: List[set], k: int) -> Dict[str, Any]:
+    open_client(path).get_collection(name).modify(configuration={"hnsw": {"ef_search": search_ef}})
+    collection = open_client(path).get_collection(name)
+
+    start = time.perf_counter()
+    collection.query(query_embeddings=queries[:1], n_results=k, include=[])
+    load_ms = (time.perf_counter() - start) * 1000
+
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        ids = collection.query(query_embeddings=query[None, :], n_results=k, include=[])["ids"][0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len({int(i) for i in ids} & expected)
+    return {
+        "load_ms": round(load_ms, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "recall": round(hits / (k * len(queries)), 4),
+    }
+
+
+def recommend(rows: List[Dict[str, Any]], target: float) -> Optional[Dict[str, Any]]:
+    """Fastest setting (p95) that reaches the recall target; smaller index breaks ties"""
+    passing = [row for row in rows if row["recall"] >= target]
+    return min(passing, key=lambda row: (row["p95_ms"], row["index_mib"])) if passing else None
+
+
+def print_table(rows: List[Dict[str, Any]], k: int):
+    header = ("M", "constr_ef", "search_ef", "build s", "index MiB", "load ms", "p50 ms", "p95 ms", f"recall@{k}")
+    keys = ("m", "construction_ef", "search_ef", "build_s", "index_mib", "load_ms", "p50_ms", "p95_ms", "recall")
+    print("  ".join(f"{h:>10}" for h in header))
+    for row in rows:
+        print("  ".join(f"{row[key]:>10}" for key in keys))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--synthetic", type=int, default=20000, help="number of synthetic vectors (default)")
+    source.add_argument("--collection", help="sample embeddings from this collection or alias instead")
+    parser.add_argument("--sample", type=int, default=20000, help="vectors read from --collection")
+    parser.add_argument("--dimensions", type=int, default=1536, help="synthetic vector dimensions")
+    parser.add_argument("--index-dimensions", type=int, default=0,
+                        help="shorten vectors to this many dimensions first, as EMBED_INDEX_DIMENSIONS does")
+    parser.add_argument("--queries", type=int, default=200, help="held-out vectors used as queries")
+    parser.add_argument("--k", type=int, default=10, help="neighbours per query (recall@k)")
+    parser.add_argument("--space", default="cosine", choices=["cosine", "l2", "ip"])
+    parser.add_argument("--m", type=int, nargs="+", default=[16, 32])
+    parser.add_argument("--construction-ef", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--target-recall", type=float, help="recommend the fastest setting reaching this recall")
+    parser.add_argument("--output", help="write the rows and settings as JSON")
+    parser.add_argument("--workdir", help="keep the built indexes here instead of a deleted temp directory")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    import numpy as np
+    from app.full_vectors import shorten
+    from app.vectorstore import hnsw_metadata
+
+    if args.collection:
+        vectors = collection_vectors(args.collection, args.sample + args.queries)
+    else:
+        vectors = synthetic_vectors(args.synthetic + args.queries, args.dimensions)
+    if args.index_dimensions:
+        vectors = shorten(vectors, args.index_dimensions)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    rng = np.random.default_rng(1)
+    order = rng.permutation(len(vectors))
+    queries, index_vectors = vectors[order[:args.queries]], vectors[order[args.queries:]]
+    if len(index_vectors) < args.k:
+        raise SystemExit("not enough vectors to index")
+    print(f"{len(index_vectors)} vectors x {index_vectors.shape[1]} dims, {len(queries)} queries, space {args.space}",
+          file=sys.stderr)
+
+    start = time.perf_counter()
+    truth = exact_neighbors(index_vectors, queries, args.k)
+    print(f"exact search: {(time.perf_counter() - start) * 1000 / len(queries):.2f} ms per query (numpy brute force)",
+          file=sys.stderr)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="hnsw_sweep_")
+    rows = []
+    try:
+        for m in args.m:
+            for construction_ef in args.construction_ef:
+                path = os.path.join(workdir, f"m{m}_ef{construction_ef}")
+                shutil.rmtree(path, ignore_errors=True)
+                metadata = hnsw_metadata(args.space, m, construction_ef, args.search_ef[0])
+                build_s = build(path, "sweep", metadata, index_vectors)
+                index_mib = (directory_size(path) - os.path.getsize(os.path.join(path, "chroma.sqlite3"))) / 2 ** 20
+                for search_ef in args.search_ef:
+                    row = {"m": m, "construction_ef": construction_ef, "search_ef": search_ef,
+                           "build_s": round(build_s, 2), "index_mib": round(index_mib, 1)}
+                    row.update(measure(path, "sweep", search_ef, queries, truth, args.k))
+                    rows.append(row)
+                    print(f"  M={m} construction_ef={construction_ef} search_ef={search_ef}: "
+                          f"recall {row['recall']}, p95 {row['p95_ms']} ms", file=sys.stderr)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(rows, args.k)
+    best = recommend(rows, args.target_recall) if args.target_recall is not None else None
+    if args.target_recall is not None:
+        if best is None:
+            print(f"\nno setting reaches recall@{args.k} {args.target_recall}; try larger M / ef values")
+        else:
+            print(f"\nfastest setting with recall@{args.k} >= {args.target_recall}:")
+            print(f"HNSW_SPACE={args.space}\nHNSW_M={best['m']}\n"
+                  f"HNSW_CONSTRUCTION_EF={best['construction_ef']}\nHNSW_SEARCH_EF={best['search_ef']}")
+
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key not in ("output", "workdir")}
+        with open(args.output, "w") as f:
+            json.dump({"settings": settings, "vectors": len(index_vectors), "rows": rows, "recommended": best}, f, indent=2)
+    if args.target_recall is not None and best is None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Export a collection to a portable snapshot, or bootstrap a node's index from one.
+
+A snapshot is one .npz file with the collection's ids, embeddings (a
+contiguous float32 array), documents and metadata (see app/index_io.py).
+Importing it needs no PDFs and no embedding calls: the chunks are bulk-loaded
+into a new version of the alias, the term index, safety digest and full
+vectors are rebuilt from the snapshot, and the version is validated and
+swapped in like POST /index/rebuild does.
+
+On a node with a complete index (nothing ingesting at the time):
+    python -m scripts.index_snapshot export manuals.npz
+
+On the new node (same EMBEDDINGS_PROVIDER and, in CHROMA_MODE=http, its own Chroma server):
+    python -m scripts.index_snapshot import manuals.npz
+
+    python -m scripts.index_snapshot info manuals.npz    # manifest only
+"""
+import argparse
+import json
+import sys
+
+from app.index_builds import IndexBuildError
+from app.index_io import export_index, import_index, read_manifest
+from app.logging_utils import configure_logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="write a collection (or alias) to a snapshot")
+    export.add_argument("path")
+    export.add_argument("--collection", default="manufacturing_manuals")
+    export.add_argument("--compress", action="store_true",
+                        help="deflate the columns (smaller file, slower export and import)")
+
+    load = commands.add_parser("import", help="load a snapshot into a new version of an alias and swap to it")
+    load.add_argument("path")
+    load.add_argument("--alias", default="manufacturing_manuals")
+    load.add_argument("--force", action="store_true",
+                      help="skip the embedding model and live index size checks")
+
+    info = commands.add_parser("info", help="print a snapshot's manifest")
+    info.add_argument("path")
+
+    args = parser.parse_args()
+    configure_logging()
+
+    try:
+        if args.command == "export":
+            result = export_index(args.path, args.collection, compress=args.compress)
+        elif args.command == "import":
+            result = import_index(args.path, args.alias, force=args.force)
+        else:
+            result = read_manifest(args.path)
+    except IndexBuildError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""End-to-end load benchmark for the FastAPI app.
+
+Drives /chat with N concurrent sessions (each asking a few follow-up turns)
+and optionally /ingest with PDFs, then reports per-endpoint p50/p95/p99
+latency, throughput and error rate.
+
+Against an already running API:
+    python -m scripts.load_benchmark --base-url http://127.0.0.1:8000 --sessions 20 --turns 3
+
+Self-contained baseline (starts the fake OpenAI server and the API, no API spend):
+    python -m scripts.load_benchmark --spawn-stack --sessions 20 --turns 3 --ingest manual.pdf
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+DEFAULT_QUESTIONS = [
+    "What does fault F0712 mean?",
+    "What is the torque for an M8 bolt?",
+    "How do I replace the spindle belt?",
+    "What safety precautions apply before opening the cabinet?",
+    "What is the maximum coolant pressure?",
+    "How do I troubleshoot a servo overload alarm?",
+]
+
+FOLLOW_UPS = [
+    "And what tools do I need for that?",
+    "What should I check after step 3?",
+    "Is there a warning I should know about?",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.error_samples: Dict[str, List[str]] = defaultdict(list)
+
+    def record(self, endpoint: str, seconds: float, ok: bool, detail: str = ""):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+                if len(self.error_samples[endpoint]) < 3:
+                    self.error_samples[endpoint].append(detail[:200])
+
+    def report(self, wall_seconds: float) -> Dict[str, dict]:
+        results = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            count = len(values)
+            errors = self.errors.get(endpoint, 0)
+            results[endpoint] = {
+                "requests": count,
+                "errors": errors,
+                "error_rate": round(errors / count, 4) if count else 0.0,
+                "throughput_rps": round(count / wall_seconds, 2) if wall_seconds else 0.0,
+                "mean_ms": round(sum(values) / count * 1000, 1) if count else 0.0,
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "error_samples": self.error_samples.get(endpoint, []),
+            }
+        return results
+
+
+def timed_request(recorder: Recorder, endpoint: str, send) -> requests.Response:
+    start = time.perf_counter()
+    try:
+        response = send()
+        ok = response.status_code < 400
+        recorder.record(endpoint, time.perf_counter() - start, ok, "" if ok else f"{response.status_code}: {response.text}")
+        return response
+    except requests.RequestException as e:
+        recorder.record(endpoint, time.perf_counter() - start, False, str(e))
+        return None
+
+
+def run_session(base_url: str, session_index: int, turns: int, questions: List[str], timeout: float, recorder: Recorder):
+    session_id = f"bench_{os.getpid()}_{session_index}"
+    http = requests.Session()
+    for turn in range(turns):
+        if turn == 0:
+            question = questions[session_index % len(questions)]
+        else:
+            question = FOLLOW_UPS[(session_index + turn) % len(FOLLOW_UPS)]
+        timed_request(recorder, "/chat", lambda: http.post(
+            f"{base_url}/chat",
+            json={"session_id": session_id, "question": question},
+            timeout=timeout,
+        ))
+    timed_request(recorder, "/clear_history", lambda: http.post(
+        f"{base_url}/clear_history", json={"session_id": session_id}, timeout=timeout
+    ))
+
+
+def run_ingest(base_url: str, pdf_path: str, timeout: float, recorder: Recorder):
+    with open(pdf_path, "rb") as f:
+        data = f.read()
+    timed_request(recorder, "/ingest", lambda: requests.post(
+        f"{base_url}/ingest",
+        files={"file": (os.path.basename(pdf_path), data, "application/pdf")},
+        timeout=timeout,
+    ))
+
+
+def wait_for(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.5)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def spawn_stack(args) -> List[subprocess.Popen]:
+    """Start the fake OpenAI server and the API pointed at it"""
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "scripts.fake_openai", "--port", str(args.fake_port)] + args.fake_args,
+    )
+    wait_for(f"http://127.0.0.1:{args.fake_port}/v1/models")
+
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.fake_port}/v1",
+        "OPENAI_API_KEY": "fake",
+    })
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.api_port),
+         "--workers", str(args.workers)],
+        env=env,
+    )
+    wait_for(f"http://127.0.0.1:{args.api_port}/docs")
+    return [fake, api]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark for /chat and /ingest")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sessions", type=int, default=10, help="Concurrent chat sessions")
+    parser.add_argument("--turns", type=int, default=3, help="Questions per session (first + follow-ups)")
+    parser.add_argument("--questions", help="Text file with one opening question per line")
+    parser.add_argument("--ingest", nargs="*", default=[], help="PDFs to upload concurrently with the chat load")
+    parser.add_argument("--timeout", type=float, default=90.0, help="Per-request timeout (matches the frontend)")
+    parser.add_argument("--json", dest="json_out", help="Write the report to this file")
+    parser.add_argument("--spawn-stack", action="store_true", help="Start fake OpenAI + API subprocesses")
+    parser.add_argument("--fake-port", type=int, default=9000)
+    parser.add_argument("--api-port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers when spawning")
+    parser.add_argument("--fake-args", nargs=argparse.REMAINDER, default=[], help="Extra args for the fake server")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    procs = []
+    base_url = args.base_url
+    if args.spawn_stack:
+        procs = spawn_stack(args)
+        base_url = f"http://127.0.0.1:{args.api_port}"
+
+    recorder = Recorder()
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions + len(args.ingest)) as pool:
+            futures = [pool.submit(run_ingest, base_url, path, args.timeout * 4, recorder) for path in args.ingest]
+            futures += [
+                pool.submit(run_session, base_url, i, args.turns, questions, args.timeout, recorder)
+                for i in range(args.sessions)
+            ]
+            for future in futures:
+                future.result()
+        wall = time.perf_counter() - start
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    report = recorder.report(wall)
+    print(f"\n📈 {args.sessions} sessions x {args.turns} turns in {wall:.2f}s\n")
+    print(f"{'endpoint':<16}{'reqs':>6}{'err%':>8}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in report.items():
+        print(
+            f"{endpoint:<16}{stats['requests']:>6}{stats['error_rate'] * 100:>7.1f}%{stats['throughput_rps']:>8.2f}"
+            f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+        )
+        for sample in stats["error_samples"]:
+            print(f"    ❌ {sample}")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"wall_seconds": wall, "sessions": args.sessions, "turns": args.turns, "endpoints": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()